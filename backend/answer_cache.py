@@ -0,0 +1,108 @@
+# answer_cache.py
+"""
+Semantic cache of /ask and /ask-simple answers.
+
+An entry is only reused when everything that shapes the LLM call matches exactly -- endpoint, retrieval mode,
+facet filters, the selected chunk ids *in order* (citations are positional), CHAT_MODEL and PROMPT_VERSION --
+and the new question is a paraphrase of the cached one: cosine similarity of the query embeddings at or above
+ANSWER_CACHE_SIM (identical normalised text when no embedding is available, e.g. lexical mode).
+
+Entries expire after ANSWER_CACHE_TTL seconds, the least recently used are evicted past ANSWER_CACHE_SIZE, and
+the whole cache is dropped when the index version changes.
+"""
+import os, time, threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))    # entries; 0 disables the cache
+ANSWER_CACHE_TTL  = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # seconds; 0 = no expiry
+ANSWER_CACHE_SIM  = float(os.getenv("ANSWER_CACHE_SIM", "0.95"))   # min cosine similarity of the questions
+
+class AnswerCache:
+    def __init__(self, size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL, threshold: float = ANSWER_CACHE_SIM):
+        self.size = size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.version: Optional[str] = None
+        self._lock = threading.Lock()
+        # (key, n) -> (stored_at, unit question vector or None, normalised question, payload)
+        self._entries: "OrderedDict[Tuple[Hashable, int], Tuple[float, Optional[np.ndarray], str, Dict[str, Any]]]" = OrderedDict()
+        self._by_key: Dict[Hashable, List[int]] = {}
+        self._seq = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def set_version(self, version: Optional[str]):
+        """Drop every entry when the index the answers were grounded on changes."""
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._by_key.clear()
+                self.version = version
+
+    @staticmethod
+    def _unit(vec: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        if vec is None:
+            return None
+        v = np.asarray(vec, dtype="float32").reshape(-1)
+        n = float(np.linalg.norm(v))
+        return v / n if n else v
+
+    def lookup(self, key: Hashable, q_vec: Optional[np.ndarray], q_norm: str) -> Optional[Dict[str, Any]]:
+        u = self._unit(q_vec)
+        now = time.monotonic()
+        with self._lock:
+            best, best_sim = None, -1.0
+            for seq in list(self._by_key.get(key, ())):
+                ek = (key, seq)
+                t, ev, eq, payload = self._entries[ek]
+                if self.ttl and now - t > self.ttl:
+                    self._drop(ek)
+                    continue
+                if u is not None and ev is not None:
+                    sim = float(ev @ u)
+                else:
+                    sim = 1.0 if eq == q_norm else -1.0
+                if sim >= self.threshold and sim > best_sim:
+                    best, best_sim = ek, sim
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best][3]
+
+    def _drop(self, ek: Tuple[Hashable, int]):
+        del self._entries[ek]
+        seqs = self._by_key[ek[0]]
+        seqs.remove(ek[1])
+        if not seqs:
+            del self._by_key[ek[0]]
+
+    def store(self, key: Hashable, q_vec: Optional[np.ndarray], q_norm: str, payload: Dict[str, Any]):
+        with self._lock:
+            self._seq += 1
+            self._entries[(key, self._seq)] = (time.monotonic(), self._unit(q_vec), q_norm, payload)
+            self._by_key.setdefault(key, []).append(self._seq)
+            while len(self._entries) > self.size:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "entries": entries,
+            "max_entries": self.size,
+            "ttl_s": self.ttl,
+            "similarity": self.threshold,
+            "index_version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
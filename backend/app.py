@@ -1,9 +1,10 @@
 # app.py
-import os, json
+import os, json, time, threading, weakref
 import warnings
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional
 from collections import Counter
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -34,10 +35,22 @@ from auth import (
 )
 
 from rag_core import (
-    get_client, CHAT_MODEL, EMBED_MODEL, embed_texts, build_prompt,
-    ORGANISMS, STRESSORS, PLATFORMS
+    get_client, CHAT_MODEL, EMBED_MODEL, build_prompt, PROMPT_VERSION,
+    ORGANISMS, STRESSORS, PLATFORMS, get_embed_cache, get_embed_backend, get_query_cache, embed_query,
+    embed_queries,
+    FACET_TAGGER, tag_text
 )
 
+from vector_index import search_params, search_filtered, index_type, load_index, read_index_info
+from meta_store import ChunkStore, write_chunk_store
+from text_index import TextIndex, write_text_index
+from query_cache import normalize_query
+from answer_cache import AnswerCache
+from search_dispatcher import SearchDispatcher, MICROBATCH
+from retrieval import RetrievalEngine, Selection
+from index_versions import read_current, current_mtime, version_dir, index_lock
+from mem_usage import memory_usage
+from shards import ShardSet, open_shards
 from speech_io import tts_piper_to_wav, stt_transcribe, gpu_status
 
 # silence generic pkg_resources deprecation warnings
@@ -55,11 +68,23 @@ BOOT_MODE  = os.getenv("BOOT_MODE", "light").strip().lower()  # light | full
 IDX_DIR    = "data/index"
 META_PATH  = os.path.join(IDX_DIR, "meta.jsonl")
 FAISS_PATH = os.path.join(IDX_DIR, "index.faiss")
+VECTORS_PATH = os.path.join(IDX_DIR, "vectors.f32")
+CHUNKS_DIR = os.path.join(IDX_DIR, "chunks")
+TEXT_DIR   = os.path.join(IDX_DIR, "text")
+INDEX_INFO_PATH = os.path.join(IDX_DIR, "index_info.json")
+INDEX_LOAD = os.getenv("INDEX_LOAD", "mmap").strip().lower()  # mmap | ram
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "5"))  # seconds between checks of data/index/CURRENT; 0 = off
+SEARCH_MODE = os.getenv("SEARCH_MODE", "dense").strip().lower()  # lexical | dense | hybrid (per-request override)
+SEARCH_MODES = ("lexical", "dense", "hybrid")
+RRF_K = int(os.getenv("RRF_K", "60"))  # reciprocal rank fusion damping for hybrid mode
+SEARCH_BATCH_MAX  = int(os.getenv("SEARCH_BATCH_MAX", "256"))          # queries per /search/batch call
+SEARCH_BATCH_RATE = os.getenv("SEARCH_BATCH_RATE", "600/minute")       # counted per query, not per call
 
 os.makedirs(os.path.join("data", "audio"), exist_ok=True)
 
-index = None  # type: ignore
-meta: List[Dict[str, Any]] = []
+answer_cache = AnswerCache()
+dispatcher: Optional[SearchDispatcher] = None  # micro-batches concurrent single-query searches
+retrieval = RetrievalEngine()  # filter / re-score / dedupe / truncate over id arrays, timed per stage
 
 # --------------------------------------------------------------------------------------
 # Utilities
@@ -84,65 +109,304 @@ def _allow_origin_regex() -> Optional[str]:
     rx = os.getenv("ALLOW_ORIGIN_REGEX", "").strip()
     return rx or None
 
-def _load_index_and_meta():
-    """Load FAISS index + metadata once at startup. Skips index in light mode or when FAISS absent."""
-    global index, meta
-
-    # Load meta always (cheap & useful for /library)
-    meta.clear()
-    if os.path.exists(META_PATH):
-        with open(META_PATH, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    meta.append(json.loads(line))
-                except Exception:
-                    continue
-
-    # Load FAISS only when requested and available
-    if BOOT_MODE != "light" and faiss is not None and os.path.exists(FAISS_PATH):
+class IndexSnapshot:
+    """
+    Everything a request reads from the index, loaded together and never mutated afterwards. Hot-swaps replace
+    the whole object; requests keep the snapshot that was current when they arrived (see _snap()).
+    """
+    def __init__(self, version: Optional[str], root: Optional[str], meta: ChunkStore,
+                 text_index: Optional[TextIndex] = None, index=None, vectors: Optional[np.ndarray] = None,
+                 info: Optional[Dict[str, Any]] = None, shards: Optional[ShardSet] = None):
+        self.version = version        # CURRENT version name (legacy layout: build time / chunk store mtime)
+        self.root = root              # directory the files were loaded from
+        self.meta = meta              # ChunkStore; rows index like meta[i] -> dict
+        self.text_index = text_index  # inverted index for lexical search and /library?q=
+        self.index = index            # FAISS index (None in light mode / without FAISS)
+        self.vectors = vectors        # np.memmap over the vectors.f32 rows covered by the index (exact filtered scoring)
+        self.shards = shards          # scatter-gather over shards/<s>/ instead of one index (sharded versions)
+        if shards is not None:
+            # threads and connections go when the last request pinned to this snapshot lets go of it
+            weakref.finalize(self, shards.close)
+        self.dense = index is not None or shards is not None
+        self.ntotal = index.ntotal if index is not None else (shards.ntotal if shards is not None else 0)
+        self.kind = index_type(index) if index is not None else \
+            (f"{info.get('type')} x {len(shards.shards)} shards" if shards is not None else None)
+        self.info = info or {}
+        # queries are embedded by the backend that embedded the corpus (indexes predating backends: OpenAI)
+        self.embed_model = self.info.get("embed_model") or EMBED_MODEL
+        self.embed_dims = self.info.get("dims")  # reduced width: queries are truncated + re-normalised to it
+        self.stats_payload = _stats_payload(meta.stats)  # /stats response, from the store's precomputed counts
+        self.loaded_at = time.time()
+
+def _stats_payload(st: Dict[str, Any]) -> Dict[str, Any]:
+    facets = st.get("facets", {})
+    return {
+        "organisms": facets.get("organism", []),
+        "stressors": facets.get("stressor", []),
+        "platforms": facets.get("platform", []),
+        "chunks": st.get("chunks", 0),
+        "documents": st.get("documents", 0),
+        "documents_by_facet": st.get("documents_by_facet", {}),
+        "organism_x_stressor": st.get("organism_x_stressor", {}),
+        "by_year": st.get("by_year", {}),
+    }
+
+def _load_snapshot() -> IndexSnapshot:
+    """Load the version CURRENT points at (or the legacy top-level files). Skips FAISS in light mode or when absent."""
+    version = read_current(IDX_DIR)
+    root = version_dir(IDX_DIR, version) if version else IDX_DIR
+    chunks_dir, text_dir = os.path.join(root, "chunks"), os.path.join(root, "text")
+    if version is None:
+        # index built before the chunk store / text index existed: convert once; with several workers one
+        # converts while the others wait, then they all map the same files
+        with index_lock(IDX_DIR):
+            if not os.path.isdir(chunks_dir) and os.path.exists(META_PATH):
+                write_chunk_store(META_PATH, chunks_dir, FACET_TAGGER.labels)
+            if not os.path.isdir(text_dir) and os.path.isdir(chunks_dir):
+                store = ChunkStore(chunks_dir)
+                if len(store):
+                    write_text_index(store, text_dir)
+                store.close()
+
+    # meta always (memory-mapped, so cheap & useful for /library)
+    meta = ChunkStore(chunks_dir) if os.path.isdir(chunks_dir) else ChunkStore(None, FACET_TAGGER.labels)
+    text_index = TextIndex(text_dir) if os.path.isdir(text_dir) else None
+    info = read_index_info(os.path.join(root, "index_info.json"))
+    if version is None:
+        built_at = info.get("built_at")
+        version = str(built_at) if built_at else \
+            (str(os.stat(chunks_dir).st_mtime_ns) if os.path.isdir(chunks_dir) else None)
+
+    # FAISS only when requested and available
+    index, vectors, shards = None, None, None
+    faiss_path, vectors_path = os.path.join(root, "index.faiss"), os.path.join(root, "vectors.f32")
+    if BOOT_MODE != "light" and faiss is not None and int(info.get("shards") or 1) > 1:
+        try:
+            shards = open_shards(root, int(info["shards"]), version, INDEX_LOAD)
+        except Exception as e:
+            print(f"[shards] could not open the shards of {version}: {e}")
+    elif BOOT_MODE != "light" and faiss is not None and os.path.exists(faiss_path):
         try:
-            index = faiss.read_index(FAISS_PATH)
+            index = load_index(faiss_path, vectors_path, info, INDEX_LOAD)
         except Exception:
             index = None
-    else:
-        index = None
+        if index is not None and os.path.exists(vectors_path) \
+                and os.path.getsize(vectors_path) >= index.ntotal * index.d * 4:
+            vectors = np.memmap(vectors_path, dtype="float32", mode="r", shape=(index.ntotal, index.d))
+    snap = IndexSnapshot(version, root, meta, text_index, index, vectors, info, shards)
+    if snap.dense:
+        try:
+            get_embed_backend(snap.embed_model)  # load a local model here rather than in the first request
+        except Exception as e:
+            print(f"[embed] backend {snap.embed_model} of version {version} unavailable: {e}")
+    return snap
+
+snapshot = IndexSnapshot(None, None, ChunkStore(None, FACET_TAGGER.labels))  # replaced at startup / on reload
+_pinned: ContextVar[Optional[IndexSnapshot]] = ContextVar("index_snapshot", default=None)
+_missing_shards: ContextVar[Optional[set]] = ContextVar("missing_shards", default=None)  # per request
+_reload_lock = threading.Lock()
+
+def _snap() -> IndexSnapshot:
+    """The snapshot pinned to the current request, or the active one outside requests."""
+    return _pinned.get() or snapshot
+
+def reload_index(force: bool = False) -> Dict[str, Any]:
+    """
+    Load the published version into a new snapshot and swap it in with a single assignment. Loading happens
+    here, off the request path; requests already running finish on the snapshot they pinned, whose files stay
+    readable until the last reference to them is dropped.
+    """
+    global snapshot, dispatcher
+    with _reload_lock:
+        old = snapshot
+        if not force and old.root is not None and read_current(IDX_DIR) == old.version:
+            return {"swapped": False, "version": old.version}
+        t0 = time.perf_counter()
+        new = _load_snapshot()
+        snapshot = new
+        answer_cache.set_version(new.version)
+        if new.index is not None and MICROBATCH and dispatcher is None:
+            dispatcher = SearchDispatcher(_search_matrix)
+        took = time.perf_counter() - t0
+        if old.root is not None:
+            print(f"[reload] index version {old.version} -> {new.version} | rows={len(new.meta)} | loaded in {took:.2f}s")
+        return {"swapped": True, "version": new.version, "previous": old.version, "load_s": round(took, 3)}
+
+def _reload_logged(force: bool = False):
+    try:
+        reload_index(force)
+    except Exception as e:  # keep serving the old version
+        print(f"[reload] failed, still serving {snapshot.version}: {e}")
+
+def _watch_index(stop: threading.Event, seen: Optional[int]):
+    """Poll data/index/CURRENT and hot-swap when ingest publishes a new version."""
+    while not stop.wait(INDEX_WATCH_INTERVAL):
+        m = current_mtime(IDX_DIR)
+        if m != seen:
+            seen = m
+            _reload_logged()
 
+def _load_index_and_meta():
+    """Load the current index version + metadata once at startup."""
+    t0 = time.perf_counter()
+    reload_index(force=True)
+    s = snapshot
     print(
         f"[startup] BOOT_MODE={BOOT_MODE} | faiss={'yes' if faiss else 'no'} | "
-        f"index_loaded={'yes' if index is not None else 'no'} | meta_rows={len(meta)}"
+        f"index_loaded={'yes' if s.dense else 'no'}"
+        f"{f' ({s.kind}, {INDEX_LOAD})' if s.dense else ''} | meta_rows={len(s.meta)} | "
+        f"version={s.version} | loaded in {time.perf_counter() - t0:.2f}s"
     )
-
-def _search_vectors(q_emb: np.ndarray, k: int):
-    if index is None or faiss is None:
+    mem = memory_usage(IDX_DIR)
+    if mem is not None:
+        # shared = pages other workers map too; grows as workers start and index pages are touched (see /memory)
+        print(
+            f"[startup] worker pid={mem['pid']} | rss={mem['rss_mb']}MB private={mem['private_mb']}MB "
+            f"shared={mem['shared_mb']}MB | index files resident={mem['index_files']['rss_mb']}MB "
+            f"(shared {mem['index_files']['shared_mb']}MB)"
+        )
+
+def _row_text(r: Dict[str, Any]) -> str:
+    """Chunk text of a row, fetched from the store by id if the row was materialised without it."""
+    if "text" in r:
+        return r["text"] or ""
+    return _snap().meta.text(r["id"])
+
+def _search_matrix(q_emb: np.ndarray, k: int, ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                   allowed: Optional[np.ndarray] = None, snap: Optional[IndexSnapshot] = None,
+                   filters: Optional[tuple] = None):
+    """
+    One index.search over all rows of q_emb (nq x d); I is padded with -1 like FAISS. Sharded versions get
+    `filters` (organism, stressor, platform) instead of the mask, since each shard builds its own.
+    """
+    s = snap or _snap()  # explicit from the dispatcher thread, which has no request context
+    index = s.index
+    if not s.dense or faiss is None:
         raise RuntimeError("Vector index unavailable. Set BOOT_MODE=full and ensure FAISS/index files exist.")
-    q = q_emb.astype("float32")
+    q = np.array(q_emb, dtype="float32")
+    d = s.index.d if index is not None else int(s.info.get("dim") or q.shape[1])
+    if q.shape[1] != d:
+        raise RuntimeError(f"{q.shape[1]}-d query vectors for a {d}-d index (embedded with {s.embed_model})")
     faiss.normalize_L2(q)
-    D, I = index.search(q, k)
-    return D[0], I[0]
-
-def _apply_filters(rows: List[Dict[str, Any]], organism, stressor, platform):
-    def ok(r):
-        if organism and r.get("organism") != organism:
-            return False
-        if stressor and r.get("stressor") != stressor:
-            return False
-        if platform and r.get("platform") != platform:
-            return False
-        return True
-    return [r for r in rows if ok(r)]
+    if s.shards is not None:
+        D, I, missing = s.shards.search(q, k, filters if filters and any(filters) else None, ef_search, nprobe)
+        if missing and _missing_shards.get() is not None:
+            _missing_shards.get().update(missing)
+        return D, I
+    if allowed is None:
+        return index.search(q, k, params=search_params(index, ef_search, nprobe))
+    return search_filtered(index, q, k, allowed[:index.ntotal], s.vectors, ef_search, nprobe)
+
+def _search_vectors(q_emb: np.ndarray, k: int, ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                    allowed: Optional[np.ndarray] = None, filters: Optional[tuple] = None):
+    s = _snap()
+    if dispatcher is not None and len(q_emb) == 1 and s.shards is None:
+        D, I = dispatcher.search(q_emb, k, ef_search, nprobe, allowed, s, filters)
+    else:
+        D, I = _search_matrix(q_emb, k, ef_search, nprobe, allowed, s, filters)
+    keep = I[0] >= 0  # ANN indexes pad with -1 when fewer than k candidates were visited
+    return D[0][keep], I[0][keep]
+
+def _resolve_mode(mode: Optional[str]) -> Optional[str]:
+    """Requested (or SEARCH_MODE) retrieval mode, degraded to what is loaded; None if nothing is."""
+    mode = (mode or SEARCH_MODE).strip().lower()
+    s = _snap()
+    dense_ok = s.dense and faiss is not None
+    if mode in ("dense", "hybrid") and not dense_ok:
+        mode = "lexical"  # light mode / no FAISS: answer locally instead of failing
+    if mode == "lexical" and s.text_index is None:
+        mode = "dense" if dense_ok else None
+    if mode == "hybrid" and s.text_index is None:
+        mode = "dense"
+    return mode
+
+def _rrf(rankings: List[np.ndarray], k: int):
+    """Reciprocal rank fusion of id rankings -> (fused scores, ids), best first."""
+    ids = np.concatenate(rankings).astype(np.int64)
+    contrib = np.concatenate([1.0 / (RRF_K + 1 + np.arange(len(r))) for r in rankings])
+    u, inv = np.unique(ids, return_inverse=True)
+    fused = np.bincount(inv, weights=contrib, minlength=len(u))
+    order = np.lexsort((u, -fused))[:k]
+    return fused[order], u[order]
+
+def _candidates(question: str, k: int, mode: str, allowed: Optional[np.ndarray] = None,
+                ef_search: Optional[int] = None, nprobe: Optional[int] = None, q_vec: Optional[np.ndarray] = None,
+                filters: Optional[tuple] = None):
+    """Top-k (scores, ids) for one query; lexical never calls the embedding API."""
+    text_index = _snap().text_index
+    if mode == "lexical":
+        ids, scores = text_index.search(question, mode="any", allowed=allowed, limit=k)
+        return scores, ids
+    if q_vec is None:
+        q_vec = embed_query(question, _snap().embed_model, _snap().embed_dims)
+    scores, ids = _search_vectors(q_vec, k, ef_search, nprobe, allowed, filters)
+    if mode == "dense":
+        return scores, ids
+    lex_ids, _ = text_index.search(question, mode="any", allowed=allowed, limit=k)
+    return _rrf([ids, lex_ids], k)
+
+def _select(question: str, top_k: int, organism=None, stressor=None, platform=None,
+            ef_search: Optional[int] = None, nprobe: Optional[int] = None, mode: str = "dense",
+            guess: Optional[Dict[str, Optional[str]]] = None, first: Optional[tuple] = None) -> Selection:
+    """
+    Up to top_k ids (one per doc page, best score first) that pass the facet filters. Filters are applied
+    inside the index; k grows until top_k distinct pages are found or every allowed row has been ranked.
+    `guess` adds the facet bonus before dedupe; `first` is an already searched candidate list (batch).
+    """
+    s = _snap()
+    meta = s.meta
+    allowed = meta.filter_mask(organism, stressor, platform)
+    n_allowed = len(meta) if allowed is None else int(allowed.sum())
+    timings: Dict[str, float] = {}
+    q_vec = None
+    if mode != "lexical" and first is None:
+        t0 = time.perf_counter()
+        q_vec = embed_query(question, s.embed_model, s.embed_dims)  # once for all rounds
+        timings["embed"] = (time.perf_counter() - t0) * 1000.0
+    filters = (organism, stressor, platform)
+    fetch = lambda k: _candidates(question, k, mode, allowed, ef_search, nprobe, q_vec, filters)
+    return retrieval.retrieve(meta, fetch, top_k, max(30, top_k * 4), n_allowed, allowed, guess, first, timings)
+
+def _retrieve(question: str, top_k: int, organism=None, stressor=None, platform=None,
+              ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+              mode: str = "dense") -> List[Dict[str, Any]]:
+    """_select, materialised: row dicts with "score"."""
+    sel = _select(question, top_k, organism, stressor, platform, ef_search, nprobe, mode)
+    return retrieval.rows(_snap().meta, sel)
+
+def _timings(sel: Selection) -> Dict[str, float]:
+    return {stage: round(ms, 3) for stage, ms in sel.timings.items()}
+
+def _degraded() -> bool:
+    """True if a shard was left out of any search made for the current request."""
+    return bool(_missing_shards.get())
+
+def _chat_answer(endpoint: str, question: str, mode: str, filters: tuple, selected: List[Dict[str, Any]]):
+    """
+    LLM answer over `selected`, reused from the answer cache when a near-identical question was already
+    answered from the same chunks with the same model and prompt. Returns (answer, cache_hit).
+    """
+    s = _snap()
+    key = (endpoint, s.version, mode, filters, tuple(int(r["id"]) for r in selected), CHAT_MODEL, PROMPT_VERSION)
+    q_vec = embed_query(question, s.embed_model, s.embed_dims) if mode != "lexical" else None  # from the query cache
+    q_norm = normalize_query(question)
+    hit = answer_cache.lookup(key, q_vec, q_norm)
+    if hit is not None:
+        return hit["answer"], True
+    client = get_client()
+    messages = build_prompt(question, selected)
+    chat = client.chat.completions.create(model=CHAT_MODEL, temperature=0.2, messages=messages)
+    answer = chat.choices[0].message.content
+    if not _degraded():  # never serve an answer grounded on partial results to later callers
+        answer_cache.store(key, q_vec, q_norm, {"answer": answer})
+    return answer, False
 
 def _majority(rows, key):
     vals = [r.get(key) for r in rows if r.get(key)]
     return Counter(vals).most_common(1)[0][0] if vals else None
 
 def _guess_from_text(txt: str, vocab: dict):
-    low = (txt or "").lower()
-    best, score = None, 0
-    for k, terms in vocab.items():
-        s = sum(1 for t in terms if t in low)
-        if s > score:
-            best, score = k, s
-    return best
+    return tag_text(txt or "", vocab)
 
 def _normalize_voice_param(v: Optional[str]) -> Optional[str]:
     if v is None:
@@ -154,7 +418,7 @@ def _normalize_voice_param(v: Optional[str]) -> Optional[str]:
 
 def _row_to_result(r: Dict[str, Any]) -> Dict[str, Any]:
     """Unified shape used by /search, /ask, and /library results."""
-    text = r.get("text", "") or ""
+    text = _row_text(r)
     return {
         "title": r.get("doc_title") or "",
         "year": r.get("year"),
@@ -168,30 +432,19 @@ def _row_to_result(r: Dict[str, Any]) -> Dict[str, Any]:
 
 def _pick_context(question: Optional[str], top_k: int, organism=None, stressor=None, platform=None, paths=None):
     """Select top-k rows then compress to short snippets."""
-    rows = meta
-    if paths:
-        rows = [r for r in rows if r.get("doc_path") in set(paths)]
-    elif question and index is not None and faiss is not None:
-        q_vec = embed_texts([question])
-        scores, ids = _search_vectors(q_vec, max(30, top_k * 4))
-        rows = [meta[i] | {"score": float(scores[j])} for j, i in enumerate(ids)]
-        # dedupe per (doc_path, page_start)
-        seen, uniq = set(), []
-        for r in rows:
-            key = (r.get("doc_path"), r.get("page_start"))
-            if key in seen:
-                continue
-            seen.add(key)
-            uniq.append(r)
-            if len(uniq) >= top_k:
-                break
-        rows = uniq
-
-    rows = _apply_filters(rows, organism, stressor, platform)
+    meta = _snap().meta
+    mode = _resolve_mode(None)
+    if question and mode in SEARCH_MODES and not paths:
+        sel = _select(question, top_k, organism, stressor, platform, mode=mode)
+    else:
+        # library order, every chunk (no page dedupe); the filter stage applies the facet mask
+        ids = meta.ids_for_paths(paths) if paths else meta.all_ids()
+        sel = retrieval.select(meta, None, ids, top_k, meta.filter_mask(organism, stressor, platform), dedupe=False)
+    rows = retrieval.rows(meta, sel, text=False)
 
     ctx = []
-    for r in rows[:top_k]:
-        snippet = (r.get("text") or "")[:800]
+    for r in rows:
+        snippet = _row_text(r)[:800]
         ctx.append({
             "title": r.get("doc_title") or "",
             "year": r.get("year"),
@@ -206,11 +459,15 @@ def _pick_context(question: Optional[str], top_k: int, organism=None, stressor=N
 # --------------------------------------------------------------------------------------
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    seen = current_mtime(IDX_DIR)
     _load_index_and_meta()
+    stop = threading.Event()
+    if INDEX_WATCH_INTERVAL > 0:
+        threading.Thread(target=_watch_index, args=(stop, seen), name="index-watcher", daemon=True).start()
     try:
         yield
     finally:
-        pass
+        stop.set()
 
 app = FastAPI(title="Space Biology Knowledge Engine (Backend)", lifespan=lifespan)
 
@@ -218,6 +475,24 @@ app = FastAPI(title="Space Biology Knowledge Engine (Backend)", lifespan=lifespa
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+class PinSnapshotMiddleware:
+    """Pins the active IndexSnapshot for the whole request, so a hot-swap mid-request is never observed."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _pinned.set(snapshot)
+        missing = _missing_shards.set(set())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _missing_shards.reset(missing)
+            _pinned.reset(token)
+
+app.add_middleware(PinSnapshotMiddleware)
+
 # Static (exists because we created the directory above)
 app.mount("/audio", StaticFiles(directory="data/audio"), name="audio")
 
@@ -240,10 +515,25 @@ class AskRequest(BaseModel):
     organism: Optional[str] = None
     stressor: Optional[str] = None
     platform: Optional[str] = None
+    mode: Optional[str] = None  # lexical | dense | hybrid (default SEARCH_MODE)
+
+class BatchQuery(BaseModel):
+    q: str
+    top_k: int = 10
+    organism: Optional[str] = None
+    stressor: Optional[str] = None
+    platform: Optional[str] = None
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchQuery]
+    mode: Optional[str] = None
+    ef_search: Optional[int] = None
+    nprobe: Optional[int] = None
 
 class AskSimpleRequest(BaseModel):
     question: str
     top_k: int = 8
+    mode: Optional[str] = None
 
 class TTSRequest(BaseModel):
     text: str
@@ -306,12 +596,21 @@ class StoryResponse(BaseModel):
 # --------------------------------------------------------------------------------------
 @app.get("/")
 def root():
+    s = _snap()
     return {
         "name": "Space Biology Knowledge Engine (Backend)",
         "mode": BOOT_MODE,
         "faiss": bool(faiss),
-        "index_loaded": bool(index),
-        "vectors": int(index.ntotal) if index is not None else 0,
+        "index_loaded": s.dense,
+        "index_version": s.version,
+        "vectors": int(s.ntotal),
+        "index_type": s.kind,
+        "index_storage": s.info.get("storage", "f32"),  # compressed codes are re-ranked against vectors.f32
+        "embed_model": s.embed_model,
+        "embed_dims": s.embed_dims or s.info.get("dim"),
+        "shards": len(s.shards.shards) if s.shards is not None else None,
+        "text_index": s.text_index is not None,
+        "search_mode": _resolve_mode(None),
         "auth_required": is_auth_enabled()
     }
 
@@ -348,7 +647,13 @@ def verify_token(user: dict = Depends(get_current_user)):
 # --------------------------------------------------------------------------------------
 @app.get("/ping")
 def ping(user: dict = Depends(get_current_user)):
-    return {"status": "ok", "index_loaded": bool(index), "vectors": index.ntotal if index else 0}
+    s = _snap()
+    return {"status": "ok", "index_loaded": s.dense, "index_version": s.version, "vectors": int(s.ntotal)}
+
+@app.get("/memory")
+def memory(user: dict = Depends(get_current_user)):
+    """Memory of the worker that served this request: private vs shared pages, and the mapped index files."""
+    return {"index_load": INDEX_LOAD, "memory": memory_usage(IDX_DIR)}
 
 @app.get("/gpu")
 def gpu(user: dict = Depends(get_current_user)):
@@ -356,24 +661,39 @@ def gpu(user: dict = Depends(get_current_user)):
     status["faiss_gpu"] = False  # faiss-cpu (or no faiss) on cloud free tiers
     return status
 
-@app.get("/stats")
-def stats(user: dict = Depends(get_current_user)):
-    org = Counter([r.get("organism") for r in meta if r.get("organism")])
-    strsr = Counter([r.get("stressor") for r in meta if r.get("stressor")])
-    plat = Counter([r.get("platform") for r in meta if r.get("platform")])
+@app.get("/cache/stats")
+def cache_stats(user: dict = Depends(get_current_user)):
+    model = _snap().embed_model
+    cache, qcache = get_embed_cache(model), get_query_cache(model)
     return {
-        "organisms": org.most_common(),
-        "stressors": strsr.most_common(),
-        "platforms": plat.most_common(),
-        "chunks": len(meta)
+        "embeddings": cache.stats() if cache is not None else None,
+        "embed_backend": get_embed_backend(model).stats(),
+        "query_embeddings": qcache.stats() if qcache is not None else None,
+        "answers": answer_cache.stats(),
     }
 
+@app.get("/stats")
+def stats(user: dict = Depends(get_current_user)):
+    return _snap().stats_payload
+
+@app.post("/admin/reload")
+def admin_reload(
+    wait: bool = Query(False, description="Block until the new version is loaded and swapped in"),
+    force: bool = Query(False, description="Reload even if CURRENT still names the active version"),
+    user: dict = Depends(get_current_user),
+):
+    """Hot-swap to the index version ingest last published; requests already running finish on the old one."""
+    if wait:
+        return reload_index(force)
+    threading.Thread(target=_reload_logged, args=(force,), name="index-reload", daemon=True).start()
+    return {"status": "reloading", "version": _snap().version, "published": read_current(IDX_DIR)}
+
 # --------------------------------------------------------------------------------------
 # Library (direct meta.jsonl) - Protected
 # --------------------------------------------------------------------------------------
 @app.get("/library")
 def library(
-    q: Optional[str] = Query(None, description="Full-text match on title/text/path"),
+    q: Optional[str] = Query(None, description='Full-text query on title/text/file name: words, "phrases", prefix*'),
     organism: Optional[str] = Query(None),
     stressor: Optional[str] = Query(None),
     platform: Optional[str] = Query(None),
@@ -383,38 +703,23 @@ def library(
     order: str = Query("desc", pattern="^(asc|desc)$"),
     user: dict = Depends(get_current_user),
 ):
-    rows = meta
-
-    if organism or stressor or platform:
-        rows = _apply_filters(rows, organism, stressor, platform)
-
-    if q:
-        needle = q.lower().strip()
-        def hit(r: Dict[str, Any]) -> bool:
-            return (
-                needle in (r.get("doc_title") or "").lower()
-                or needle in (r.get("text") or "").lower()
-                or needle in (r.get("doc_path") or "").lower()
-            )
-        rows = [r for r in rows if hit(r)]
-
+    # id pipeline over the columnar store; only the returned page is materialised
+    s = _snap()
+    meta, text_index = s.meta, s.text_index
+    if q and q.strip() and text_index is not None:
+        # BM25-ranked; an explicit sort below re-orders stably, so ties keep relevance order
+        ids, _ = text_index.search(q, mode="all", allowed=meta.filter_mask(organism, stressor, platform))
+    else:
+        ids = meta.filter_ids(meta.all_ids(), organism, stressor, platform)
+        if q:
+            ids = meta.match_text(ids, q)
     if sort in ("year", "path"):
-        reverse = (order == "desc")
-        if sort == "year":
-            def yr(v) -> Tuple[int, str]:
-                y = v.get("year")
-                try:
-                    return (int(y), "") if y is not None else (-10**9, "")
-                except Exception:
-                    return (-10**9, str(y or ""))
-            rows = sorted(rows, key=yr, reverse=reverse)
-        else:
-            rows = sorted(rows, key=lambda r: r.get("doc_path") or "", reverse=reverse)
-
-    total = len(rows)
+        ids = meta.sort_ids(ids, sort, desc=(order == "desc"))
+
+    total = len(ids)
     start = (page - 1) * page_size
     end = start + page_size
-    page_rows = rows[start:end]
+    page_rows = meta.rows(ids[start:end])
     results = [_row_to_result(r) for r in page_rows]
 
     # Dedupe to 1 row per (doc_path) keeping first occurrence
@@ -438,50 +743,105 @@ def library(
 # --------------------------------------------------------------------------------------
 @app.get("/search")
 @limiter.limit("30/minute")  # Limit searches
-def search(request: Request, q: str, top_k: int = 10, user: dict = Depends(get_current_user)):
-    if index is None or faiss is None:
-        return JSONResponse({"error": "Index missing. Set BOOT_MODE=full and run ingest to build FAISS."}, status_code=400)
-    em = embed_texts([q])
-    scores, ids = _search_vectors(em, top_k)
-    out = []
-    seen = set()
-    for j, i in enumerate(ids):
-        r = meta[i]
-        item = _row_to_result(r)
-        item["score"] = float(scores[j])
-        # dedupe per (doc_path,page) at the API level
-        key = (item["path"], item["page"])
-        if key in seen:
-            continue
-        seen.add(key)
-        out.append(item)
-    return {"results": out}
+def search(
+    request: Request,
+    q: str,
+    top_k: int = 10,
+    ef_search: Optional[int] = Query(None, ge=1, description="HNSW efSearch override"),
+    nprobe: Optional[int] = Query(None, ge=1, description="IVF nprobe override"),
+    organism: Optional[str] = Query(None),
+    stressor: Optional[str] = Query(None),
+    platform: Optional[str] = Query(None),
+    mode: Optional[str] = Query(None, pattern="^(lexical|dense|hybrid)$",
+                                description="lexical (BM25, no embedding call) | dense | hybrid (RRF); default SEARCH_MODE"),
+    user: dict = Depends(get_current_user),
+):
+    mode = _resolve_mode(mode)
+    if mode is None:
+        return JSONResponse({"error": "Index missing. Run ingest to build the search indexes."}, status_code=400)
+    # one result per (doc_path, page), best first
+    sel = _select(q, top_k, organism, stressor, platform, ef_search, nprobe, mode)
+    rows = retrieval.rows(_snap().meta, sel)
+    return {"results": [_row_to_result(r) | {"score": r["score"]} for r in rows], "mode": mode,
+            "degraded": _degraded(), "timings_ms": _timings(sel)}
+
+def _count_batch(request: Request, req: BatchSearchRequest) -> BatchSearchRequest:
+    request.state.search_cost = max(1, len(req.queries))
+    return req
+
+def _batch_cost(request: Request) -> int:
+    """A batch is charged one unit per query against SEARCH_BATCH_RATE."""
+    return getattr(request.state, "search_cost", 1)
+
+@app.get("/search/stats")
+def search_stats(user: dict = Depends(get_current_user)):
+    """
+    Micro-batching dispatcher counters (batch-size histogram, queue wait, inline fallbacks), shard fan-out and
+    per-stage latency of the retrieval pipeline (embed, candidates, filter, rescore, dedupe, truncate, materialise).
+    """
+    s = _snap()
+    return {"microbatch": dispatcher.stats() if dispatcher is not None else None,
+            "shards": s.shards.stats() if s.shards is not None else None,
+            "retrieval": retrieval.stats()}
+
+@app.post("/search/batch")
+@limiter.limit(SEARCH_BATCH_RATE, cost=_batch_cost)
+def search_batch(request: Request, req: BatchSearchRequest = Depends(_count_batch), user: dict = Depends(get_current_user)):
+    """
+    Many queries in one call: one embedding request for the uncached queries, then one matrix search per
+    distinct filter combination. Results per query match /search (one hit per page).
+    """
+    if not req.queries or len(req.queries) > SEARCH_BATCH_MAX:
+        return JSONResponse({"error": f"Send between 1 and {SEARCH_BATCH_MAX} queries."}, status_code=400)
+    mode = _resolve_mode(req.mode)
+    if mode is None:
+        return JSONResponse({"error": "Index missing. Run ingest to build the search indexes."}, status_code=400)
+    if mode not in SEARCH_MODES:
+        return JSONResponse({"error": f"mode must be one of {SEARCH_MODES}"}, status_code=400)
+
+    s = _snap()
+    meta, text_index = s.meta, s.text_index
+    qs = req.queries
+    q_vecs = embed_queries([x.q for x in qs], s.embed_model, s.embed_dims) if mode != "lexical" else None
+    groups: Dict[tuple, List[int]] = {}
+    for n, x in enumerate(qs):
+        groups.setdefault((x.organism, x.stressor, x.platform), []).append(n)
+
+    out: List[Optional[List[Dict[str, Any]]]] = [None] * len(qs)
+    for filters, members in groups.items():
+        allowed = meta.filter_mask(*filters)
+        k = max(30, max(qs[n].top_k for n in members) * 4)
+        if q_vecs is not None:
+            D, I = _search_matrix(q_vecs[members], k, req.ef_search, req.nprobe, allowed, filters=filters)
+        for row, n in enumerate(members):
+            x = qs[n]
+            if mode == "lexical":
+                ids, scores = text_index.search(x.q, mode="any", allowed=allowed, limit=k)
+            else:
+                scores, ids = D[row], I[row]  # -1 padding is dropped by the filter stage
+                if mode == "hybrid":
+                    keep = ids >= 0
+                    scores, ids = scores[keep], ids[keep]
+                    lex_ids, _ = text_index.search(x.q, mode="any", allowed=allowed, limit=k)
+                    scores, ids = _rrf([ids, lex_ids], k)
+            # too many hits on the same pages widens this query alone (its embedding is cached now)
+            sel = _select(x.q, x.top_k, *filters, req.ef_search, req.nprobe, mode, first=(scores, ids))
+            out[n] = [_row_to_result(r) | {"score": r["score"]} for r in retrieval.rows(meta, sel)]
+
+    return {"results": [{"q": x.q, "results": r} for x, r in zip(qs, out)], "mode": mode,
+            "degraded": _degraded()}
 
 @app.post("/ask")
 @limiter.limit("20/minute")  # Limit expensive LLM calls
 def ask(request: Request, req: AskRequest, user: dict = Depends(get_current_user)):
-    if index is None or faiss is None:
-        return JSONResponse({"error": "Index missing. Set BOOT_MODE=full and run ingest to build FAISS."}, status_code=400)
+    mode = _resolve_mode(req.mode)
+    if mode is None:
+        return JSONResponse({"error": "Index missing. Run ingest to build the search indexes."}, status_code=400)
+    if mode not in SEARCH_MODES:
+        return JSONResponse({"error": f"mode must be one of {SEARCH_MODES}"}, status_code=400)
 
-    q_vec = embed_texts([req.question])
-    scores, ids = _search_vectors(q_vec, max(30, req.top_k * 4))
-    rows = [meta[i] | {"score": float(scores[j])} for j, i in enumerate(ids)]
-    rows = _apply_filters(rows, req.organism, req.stressor, req.platform)
-
-    selected, seen = [], set()
-    for r in rows:
-        key = (r["doc_path"], r["page_start"])
-        if key in seen:
-            continue
-        seen.add(key)
-        selected.append(r)
-        if len(selected) >= req.top_k:
-            break
-
-    client = get_client()
-    messages = build_prompt(req.question, selected)
-    chat = client.chat.completions.create(model=CHAT_MODEL, temperature=0.2, messages=messages)
-    answer = chat.choices[0].message.content
+    selected = _retrieve(req.question, req.top_k, req.organism, req.stressor, req.platform, mode=mode)
+    answer, cache_hit = _chat_answer("ask", req.question, mode, (req.organism, req.stressor, req.platform), selected)
 
     sources = [{
         "title": r["doc_title"],
@@ -494,40 +854,25 @@ def ask(request: Request, req: AskRequest, user: dict = Depends(get_current_user
         "score": r["score"]
     } for r in selected]
 
-    return {"answer": answer, "sources": sources}
+    return {"answer": answer, "sources": sources, "mode": mode, "cache_hit": cache_hit, "degraded": _degraded()}
 
 @app.post("/ask-simple")
 @limiter.limit("20/minute")  # Limit expensive LLM calls
 def ask_simple(request: Request, req: AskSimpleRequest, tts: bool = False, user: dict = Depends(get_current_user)):
-    if index is None or faiss is None:
-        return JSONResponse({"error": "Index missing. Set BOOT_MODE=full and run ingest to build FAISS."}, status_code=400)
-
-    q_vec = embed_texts([req.question])
-    scores, ids = _search_vectors(q_vec, max(30, req.top_k * 4))
-    rows = [meta[i] | {"score": float(scores[j])} for j, i in enumerate(ids)]
+    mode = _resolve_mode(req.mode)
+    if mode is None:
+        return JSONResponse({"error": "Index missing. Run ingest to build the search indexes."}, status_code=400)
+    if mode not in SEARCH_MODES:
+        return JSONResponse({"error": f"mode must be one of {SEARCH_MODES}"}, status_code=400)
 
     q_guess = {
         "organism": _guess_from_text(req.question, ORGANISMS),
         "stressor": _guess_from_text(req.question, STRESSORS),
         "platform": _guess_from_text(req.question, PLATFORMS)
     }
-    def bonus(r):
-        b = 0.0
-        if q_guess["organism"] and r.get("organism")==q_guess["organism"]: b += 0.05
-        if q_guess["stressor"] and r.get("stressor")==q_guess["stressor"]: b += 0.05
-        if q_guess["platform"] and r.get("platform")==q_guess["platform"]: b += 0.05
-        return b
-    rows.sort(key=lambda r: r["score"] + bonus(r), reverse=True)
-
-    selected, seen = [], set()
-    for r in rows:
-        key = (r["doc_path"], r["page_start"])
-        if key in seen:
-            continue
-        seen.add(key)
-        selected.append(r)
-        if len(selected) >= req.top_k:
-            break
+    # unfiltered; rows whose top facet labels match the guesses get FACET_BONUS each before the page dedupe
+    sel = _select(req.question, req.top_k, mode=mode, guess=q_guess)
+    selected = retrieval.rows(_snap().meta, sel)
 
     inferred = {
         "organism": _majority(selected, "organism"),
@@ -535,10 +880,7 @@ def ask_simple(request: Request, req: AskSimpleRequest, tts: bool = False, user:
         "platform": _majority(selected, "platform")
     }
 
-    client = get_client()
-    messages = build_prompt(req.question, selected)
-    chat = client.chat.completions.create(model=CHAT_MODEL, temperature=0.2, messages=messages)
-    answer = chat.choices[0].message.content
+    answer, cache_hit = _chat_answer("ask-simple", req.question, mode, (), selected)
 
     sources = [{
         "title": r["doc_title"],
@@ -555,7 +897,10 @@ def ask_simple(request: Request, req: AskSimpleRequest, tts: bool = False, user:
         "answer": answer,
         "sources": sources,
         "inferred_facets": inferred,
-        "query_guess": q_guess
+        "query_guess": q_guess,
+        "mode": mode,
+        "cache_hit": cache_hit,
+        "degraded": _degraded()
     }
 
     if tts:
@@ -0,0 +1,83 @@
+# bench_chunker.py
+"""
+Micro-benchmark: token-offset chunk_text vs the previous re-tokenising chunker on the bundled PDFs.
+
+    python bench_chunker.py --limit 40
+"""
+import os, re, time, argparse, statistics
+from typing import List
+
+from rag_core import chunk_text, tokenize_len, extract_text_from_pdf, CHUNK_TOKENS, CHUNK_OVERLAP
+
+DATA_DIR = "data/pdfs"
+
+def chunk_text_reencode(text: str, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP) -> List[str]:
+    """The previous chunker, kept verbatim as the baseline (re-encodes the growing buffer per piece)."""
+    candidates = re.split(r"\n\s*(?=[A-Z][A-Za-z0-9 ()\-]{2,50}\n)|\n{2,}", text)
+    chunks, buff = [], ""
+    for piece in candidates:
+        piece = piece.strip()
+        if not piece:
+            continue
+        if tokenize_len(buff + ("\n" if buff else "") + piece) <= max_tokens:
+            buff = (buff + ("\n" if buff else "") + piece).strip()
+        else:
+            if buff:
+                chunks.append(buff)
+            if tokenize_len(piece) <= max_tokens:
+                buff = piece
+            else:
+                words = piece.split()
+                start = 0
+                step = 300
+                while start < len(words):
+                    sub = " ".join(words[start:start+step])
+                    chunks.append(sub)
+                    start += (step - max(0, overlap // 3))
+                buff = ""
+    if buff:
+        chunks.append(buff)
+
+    final: List[str] = []
+    for i, c in enumerate(chunks):
+        if i == 0:
+            final.append(c)
+        else:
+            prev = final[-1]
+            tail = " ".join(prev.split()[-120:])
+            merged = (tail + "\n" + c).strip()
+            if tokenize_len(merged) <= max_tokens:
+                final[-1] = merged
+            else:
+                final.append(c)
+    return final or [text[:2000]]
+
+def run(fn, pages: List[str]):
+    t0 = time.perf_counter()
+    out = [fn(p) for p in pages]
+    secs = time.perf_counter() - t0
+    lens = [tokenize_len(c) for chunks in out for c in chunks]
+    return secs, lens
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--limit", type=int, default=40, help="number of PDFs to load (0 = all)")
+    args = ap.parse_args()
+
+    pdfs = sorted(os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.lower().endswith(".pdf"))
+    if args.limit:
+        pdfs = pdfs[:args.limit]
+    pages = [t for p in pdfs for _, t in extract_text_from_pdf(p) if t.strip()]
+    print(f"{len(pdfs)} PDFs, {len(pages)} non-empty pages, CHUNK_TOKENS={CHUNK_TOKENS}, CHUNK_OVERLAP={CHUNK_OVERLAP}")
+
+    results = {}
+    for name, fn in (("reencode (old)", chunk_text_reencode), ("token-offset", chunk_text)):
+        secs, lens = run(fn, pages)
+        results[name] = secs
+        print(f"{name:>15}: {secs:7.2f}s  {len(pages)/max(secs, 1e-9):8.1f} pages/s  chunks={len(lens):6d}  "
+              f"tokens mean={statistics.mean(lens):6.1f} max={max(lens):5d}")
+    old, new = results["reencode (old)"], results["token-offset"]
+    print(f"speedup: {old/max(new, 1e-9):.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# bench_dims.py
+"""
+Benchmark: reduced-dimension embeddings (truncate + re-normalise) against the full-width vectors they come from.
+
+    python bench_dims.py                                             # ingest store, synthetic queries (see synthetic_queries)
+    python bench_dims.py --dims 256,512,1024 --index-type hnsw --eval-queries queries.txt
+
+Ground truth is exact top-k over the stored vectors at their stored width. For each width: bytes per vector of
+the saved index, build time, recall@k of the index over the shortened vectors (on a flat index the whole loss
+comes from the projection) and p50/p99 single-query latency. Pick the smallest width whose recall is acceptable
+and ingest with --dims N (or EMBED_DIMS): the stored vectors are projected the same way, no re-embedding.
+"""
+import os, json, time, argparse, tempfile
+from typing import Any, Dict, List, Optional
+import numpy as np
+import faiss
+
+from vector_index import (
+    INDEX_TYPE, INDEX_TYPES, INDEX_STORAGE, INDEX_STORAGES, index_params, build_index, recall_report,
+    synthetic_queries, exact_topk, RerankIndex
+)
+from embed_backends import project
+
+IDX_DIR = "data/index"
+
+def load_store():
+    with open(os.path.join(IDX_DIR, "manifest.json"), "r", encoding="utf-8") as f:
+        man = json.load(f)
+    vec = np.memmap(os.path.join(IDX_DIR, "vectors.f32"), dtype="float32", mode="r", shape=(man["rows"], man["dim"]))
+    return man, vec
+
+def eval_queries(path: str, man: Dict[str, Any]) -> np.ndarray:
+    from rag_core import embed_texts  # only needed for real queries
+    with open(path, "r", encoding="utf-8") as f:
+        qs = [l.strip() for l in f if l.strip()]
+    q = embed_texts(qs, man["embed_model"], man.get("dims"))
+    faiss.normalize_L2(q)
+    return q
+
+def bench(vec: np.ndarray, queries: np.ndarray, widths: List[Optional[int]], kind: str, storage: str, k: int,
+          tmp: str) -> List[Dict[str, Any]]:
+    rows, full = vec.shape
+    truth = exact_topk(vec, queries, k)
+    out = []
+    for d in widths:
+        d = d if d and d < full else None
+        xs = np.vstack([project(np.asarray(vec[s:s + 65536]), d) for s in range(0, rows, 65536)])
+        params = index_params(kind, rows, storage)
+        t0 = time.perf_counter()
+        index = build_index(xs, params)
+        build_s = time.perf_counter() - t0
+        path = os.path.join(tmp, f"{kind}_{d or full}.faiss")
+        faiss.write_index(index, path)
+        if params.get("storage"):
+            index = RerankIndex(index, xs)
+        rep = recall_report(index, xs, project(queries, d), k, truth=truth)
+        out.append({"dims": d or full, "bytes_per_vector": round(os.path.getsize(path) / rows, 1),
+                    "build_s": round(build_s, 2), "recall_at_k": rep["recall_at_k"], "latency_ms": rep["latency_ms"]})
+        os.remove(path)
+    return out
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="recall@k and latency of shortened embeddings vs full width")
+    ap.add_argument("--dims", default="256,512,1024", help="comma list of widths; the stored width is always included")
+    ap.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE)
+    ap.add_argument("--storage", choices=INDEX_STORAGES, default=INDEX_STORAGE)
+    ap.add_argument("--eval-queries", default=None, help="text file, one query per line (default: synthetic)")
+    ap.add_argument("--queries", type=int, default=200, help="synthetic queries")
+    ap.add_argument("-k", type=int, default=10)
+    ap.add_argument("--json", default=None, help="also write the rows to this file")
+    args = ap.parse_args()
+
+    man, vec = load_store()
+    queries = eval_queries(args.eval_queries, man) if args.eval_queries else synthetic_queries(vec, args.queries)
+    widths = sorted({int(d) for d in args.dims.split(",") if d.strip() and int(d) < vec.shape[1]}) + [None]
+    print(f"{vec.shape[0]} vectors x {vec.shape[1]} dims ({man['embed_model']}), {args.index_type}/{args.storage}, "
+          f"{len(queries)} queries, k={args.k}")
+    with tempfile.TemporaryDirectory() as tmp:
+        rows = bench(vec, queries, widths, args.index_type, args.storage, args.k, tmp)
+
+    print(f"{'dims':>6} {'index B/vec':>11} {'build s':>8} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in rows:
+        print(f"{r['dims']:>6} {r['bytes_per_vector']:>11} {r['build_s']:>8} {r['recall_at_k']:>9} "
+              f"{r['latency_ms']['p50']:>8} {r['latency_ms']['p99']:>8}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=1)
@@ -0,0 +1,97 @@
+# bench_quant.py
+"""
+Benchmark: compressed vector storage (f16 / int8 / PQ codes) with exact re-ranking vs full-precision float32.
+
+    python bench_quant.py                                   # vectors of the ingest store (data/index/vectors.f32)
+    python bench_quant.py --synthetic 200000 --dim 1536     # clustered random vectors
+    python bench_quant.py --index-type hnsw --rerank 1,4,10 --json quant_report.json
+
+Per storage: bytes per vector of the saved index (codes plus graph / list overhead), bytes of codes alone, build
+time, and recall@k against exact search with p50/p99 single-query latency -- for the compressed scores alone
+(rerank=0) and after re-scoring rerank*k candidates against the memory-mapped float32 rows.
+"""
+import os, json, time, argparse, tempfile
+from typing import Any, Dict, List
+import numpy as np
+import faiss
+
+from vector_index import (
+    INDEX_TYPE, INDEX_TYPES, INDEX_STORAGES, index_params, build_index, code_bytes, recall_report,
+    synthetic_queries, RerankIndex
+)
+
+IDX_DIR = "data/index"
+
+def store_vectors() -> np.ndarray:
+    """The ingest working store: rows x dim float32, memory-mapped."""
+    with open(os.path.join(IDX_DIR, "manifest.json"), "r", encoding="utf-8") as f:
+        man = json.load(f)
+    return np.memmap(os.path.join(IDX_DIR, "vectors.f32"), dtype="float32", mode="r", shape=(man["rows"], man["dim"]))
+
+def synthetic_vectors(path: str, rows: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Gaussian clusters on the unit sphere (closer to embeddings than uniform noise), written to `path` and mapped."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype("float32")
+    with open(path, "wb") as f:
+        for s in range(0, rows, 65536):
+            n = min(65536, rows - s)
+            x = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype("float32")
+            faiss.normalize_L2(x)
+            f.write(x.tobytes())
+    return np.memmap(path, dtype="float32", mode="r", shape=(rows, dim))
+
+def bench(vec: np.ndarray, kind: str, storages: List[str], reranks: List[int], nq: int, k: int,
+          tmp: str) -> List[Dict[str, Any]]:
+    rows, dim = vec.shape
+    queries = synthetic_queries(vec, nq)
+    out = []
+    for storage in storages:
+        params = index_params(kind, rows, storage)
+        t0 = time.perf_counter()
+        index = build_index(vec, params)
+        build_s = time.perf_counter() - t0
+        path = os.path.join(tmp, f"{kind}_{storage}.faiss")
+        faiss.write_index(index, path)
+        base = {
+            "storage": params.get("storage", "f32"),  # pq falls back to int8 below ~10k rows
+            "code_bytes": code_bytes(params, dim),
+            "bytes_per_vector": round(os.path.getsize(path) / rows, 1),
+            "build_s": round(build_s, 2),
+        }
+        for r in ([0] + reranks if base["storage"] != "f32" else [0]):
+            searched = RerankIndex(index, vec, r) if r else index
+            rep = recall_report(searched, vec, queries, k)
+            out.append(base | {"rerank": r, "recall_at_k": rep["recall_at_k"], "latency_ms": rep["latency_ms"],
+                               "search_params": rep["search_params"]})
+        os.remove(path)
+    return out
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Bytes per vector, recall@k and latency per vector storage")
+    ap.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE)
+    ap.add_argument("--storages", default=",".join(INDEX_STORAGES), help="comma list of f32,f16,int8,pq")
+    ap.add_argument("--rerank", default="2,4,10", help="re-rank factors to try (candidates = factor * k)")
+    ap.add_argument("--synthetic", type=int, default=0, help="rows of synthetic vectors instead of the ingest store")
+    ap.add_argument("--dim", type=int, default=1536, help="dimension of synthetic vectors")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("-k", type=int, default=10)
+    ap.add_argument("--json", default=None, help="also write the rows to this file")
+    args = ap.parse_args()
+
+    storages = [s.strip() for s in args.storages.split(",") if s.strip()]
+    reranks = [int(r) for r in args.rerank.split(",") if r.strip()]
+    with tempfile.TemporaryDirectory() as tmp:
+        vec = synthetic_vectors(os.path.join(tmp, "vectors.f32"), args.synthetic, args.dim) if args.synthetic \
+            else store_vectors()
+        print(f"{vec.shape[0]} vectors x {vec.shape[1]} dims, {args.index_type}, {args.queries} queries, k={args.k}")
+        rows = bench(vec, args.index_type, storages, reranks, args.queries, args.k, tmp)
+        del vec
+
+    print(f"{'storage':8} {'codes B':>8} {'index B/vec':>11} {'build s':>8} {'rerank':>6} "
+          f"{'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in rows:
+        print(f"{r['storage']:8} {r['code_bytes']:>8} {r['bytes_per_vector']:>11} {r['build_s']:>8} "
+              f"{r['rerank'] or '-':>6} {r['recall_at_k']:>9} {r['latency_ms']['p50']:>8} {r['latency_ms']['p99']:>8}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=1)
@@ -0,0 +1,260 @@
+# embed_backends.py
+"""
+Embedding backends. Every index records the id of the backend that embedded it (index_info["embed_model"],
+manifest["embed_model"]) and queries against that index are embedded by the same backend, so query and
+corpus vectors always come from one model.
+
+  openai   OpenAI embeddings API (EMBED_MODEL); id = the model name, e.g. "text-embedding-3-small"
+  local    sentence-embedding model on CPU; id = "local:<name>". <name> is a directory under LOCAL_EMBED_DIR
+           (or LOCAL_EMBED_MODEL given as a path) holding tokenizer.json and either model.onnx (ONNX Runtime)
+           or a CTranslate2 encoder (model.bin). Output: mean-pooled last hidden state, L2-normalised.
+  stub     deterministic hashed bag of words; id = "stub:<dim>". No network, no model files: for tests and
+           offline runs of the whole ingest -> search -> ask pipeline.
+
+embed(texts, dims) returns vectors shortened to `dims` (see project()). text-embedding-3 models are asked for
+that width directly (`dimensions`); every other backend embeds at full width and is projected.
+"""
+import os, re, time, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+
+from embed_scheduler import EmbedScheduler
+
+EMBED_BACKEND         = os.getenv("EMBED_BACKEND", "openai").strip().lower()      # openai | local | stub
+LOCAL_EMBED_DIR       = os.getenv("LOCAL_EMBED_DIR", os.path.join("models", "embeddings"))
+LOCAL_EMBED_MODEL     = os.getenv("LOCAL_EMBED_MODEL", "all-MiniLM-L6-v2")        # name under LOCAL_EMBED_DIR or a path
+LOCAL_EMBED_WORKERS   = int(os.getenv("LOCAL_EMBED_WORKERS", "2"))                # batches run in parallel
+LOCAL_EMBED_THREADS   = int(os.getenv("LOCAL_EMBED_THREADS", "0")) \
+    or max(1, (os.cpu_count() or 1) // max(1, LOCAL_EMBED_WORKERS))               # CPU threads per batch
+LOCAL_EMBED_BATCH     = int(os.getenv("LOCAL_EMBED_BATCH", "32"))                 # texts per forward pass
+LOCAL_EMBED_MAX_TOKENS = int(os.getenv("LOCAL_EMBED_MAX_TOKENS", "256"))          # longer texts are truncated
+STUB_EMBED_DIM        = int(os.getenv("STUB_EMBED_DIM", "384"))
+
+BACKENDS = ("openai", "local", "stub")
+
+def configured_backend_id(kind: str = EMBED_BACKEND, openai_model: str = "text-embedding-3-small") -> str:
+    """Id of the backend that new indexes are built with."""
+    if kind == "local":
+        return "local:" + os.path.basename(os.path.normpath(LOCAL_EMBED_MODEL))
+    if kind == "stub":
+        return f"stub:{STUB_EMBED_DIM}"
+    if kind != "openai":
+        raise ValueError(f"EMBED_BACKEND must be one of {BACKENDS}, not {kind!r}")
+    return openai_model
+
+def project(vecs: np.ndarray, dims: Optional[int]) -> np.ndarray:
+    """
+    First `dims` components re-normalised to unit length: what text-embedding-3's `dimensions` returns, and
+    how full-width vectors and queries are matched to a reduced-dimension index. None / >= width: unchanged.
+    """
+    if not dims or dims >= vecs.shape[1]:
+        return vecs
+    out = np.array(vecs[:, :dims], dtype="float32")
+    out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+    return out
+
+def backend_kind(backend_id: str) -> str:
+    return backend_id.split(":", 1)[0] if backend_id.startswith(("local:", "stub:")) else "openai"
+
+class _Throughput:
+    """Texts / tokens embedded and the wall time spent doing it."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.texts = 0
+        self.tokens = 0
+        self.seconds = 0.0
+
+    def add(self, texts: int, tokens: int, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.texts += texts
+            self.tokens += tokens
+            self.seconds += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = self.seconds
+            return {"calls": self.calls, "texts": self.texts, "tokens": self.tokens, "seconds": round(s, 3),
+                    "texts_per_s": round(self.texts / s, 1) if s else None,
+                    "tokens_per_s": round(self.tokens / s, 1) if s and self.tokens else None}
+
+class OpenAIBackend:
+    """EMBED_MODEL through the embeddings API; batching, rate limits and retries belong to the scheduler."""
+    kind = "openai"
+
+    def __init__(self, model: str, get_client: Callable[[], Any], count_tokens: Callable[[str], int]):
+        self.id = self.model = model
+        self.dim: Optional[int] = None
+        self.native_dims = model.startswith("text-embedding-3")  # API can return shortened vectors
+        self._get_client = get_client
+        self._count_tokens = count_tokens
+        self.scheduler = EmbedScheduler(self._request, count_tokens)
+        self._short: Dict[int, EmbedScheduler] = {}  # dims -> scheduler sharing the rate budget above
+        self.throughput = _Throughput()
+
+    def _request(self, batch: List[str], dims: Optional[int] = None) -> List[List[float]]:
+        # Retries are owned by the scheduler, so the SDK's own retry loop is turned off.
+        client = self._get_client().with_options(max_retries=0)
+        extra = {"dimensions": dims} if dims else {}
+        resp = client.embeddings.create(model=self.model, input=batch, **extra)
+        return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+
+    def _scheduler(self, dims: Optional[int]) -> EmbedScheduler:
+        if not dims:
+            return self.scheduler
+        if dims not in self._short:
+            sched = EmbedScheduler(lambda batch: self._request(batch, dims), self._count_tokens)
+            sched.budget = self.scheduler.budget  # one request / token budget per API key
+            self._short.setdefault(dims, sched)
+        return self._short[dims]
+
+    def embed(self, texts: List[str], dims: Optional[int] = None) -> np.ndarray:
+        self._get_client()  # fail fast on a missing key before any batch is scheduled
+        t0 = time.perf_counter()
+        native = dims if self.native_dims else None
+        out = np.array(self._scheduler(native).run(texts), dtype="float32")
+        self.throughput.add(len(texts), 0, time.perf_counter() - t0)
+        if len(out) and not native:
+            self.dim = out.shape[1]
+        return out if native else project(out, dims)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"id": self.id, "kind": self.kind, "dim": self.dim, "throughput": self.throughput.stats(),
+                "requests": self.scheduler.stats(),
+                "requests_by_dims": {d: s.stats() for d, s in self._short.items()} or None}
+
+def resolve_local_model(name: str) -> str:
+    """Directory of local model `name`: LOCAL_EMBED_MODEL when that path has this name, else LOCAL_EMBED_DIR/<name>."""
+    if os.path.basename(os.path.normpath(LOCAL_EMBED_MODEL)) == name and os.path.isdir(LOCAL_EMBED_MODEL):
+        return LOCAL_EMBED_MODEL
+    return os.path.join(LOCAL_EMBED_DIR, name)
+
+class LocalBackend:
+    """
+    Sentence-embedding model on CPU. Texts are sorted by token length and cut into LOCAL_EMBED_BATCH batches
+    (little padding per batch); LOCAL_EMBED_WORKERS batches run at once, each on LOCAL_EMBED_THREADS threads.
+    """
+    kind = "local"
+
+    def __init__(self, name: str, workers: int = LOCAL_EMBED_WORKERS, threads: int = LOCAL_EMBED_THREADS,
+                 batch: int = LOCAL_EMBED_BATCH, max_tokens: int = LOCAL_EMBED_MAX_TOKENS):
+        from tokenizers import Tokenizer  # ships with faster-whisper; only needed for this backend
+        self.id = "local:" + name
+        self.path = resolve_local_model(name)
+        tok_path = os.path.join(self.path, "tokenizer.json")
+        if not os.path.exists(tok_path):
+            raise RuntimeError(f"Local embedding model {self.id}: {tok_path} not found "
+                               f"(set LOCAL_EMBED_DIR / LOCAL_EMBED_MODEL)")
+        self.tokenizer = Tokenizer.from_file(tok_path)
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.batch = max(1, batch)
+        self.dim: Optional[int] = None
+        self.session = self.encoder = None
+        onnx_path = os.path.join(self.path, "model.onnx")
+        if os.path.exists(onnx_path):
+            import onnxruntime as ort
+            opts = ort.SessionOptions()
+            opts.intra_op_num_threads = threads
+            opts.inter_op_num_threads = 1
+            self.session = ort.InferenceSession(onnx_path, opts, providers=["CPUExecutionProvider"])
+            self._inputs = {i.name for i in self.session.get_inputs()}
+            self.runtime = "onnxruntime"
+        elif os.path.exists(os.path.join(self.path, "model.bin")):
+            import ctranslate2
+            self.encoder = ctranslate2.Encoder(self.path, device="cpu", inter_threads=workers, intra_threads=threads)
+            self.runtime = "ctranslate2"
+        else:
+            raise RuntimeError(f"Local embedding model {self.id}: no model.onnx or model.bin in {self.path}")
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="embed-local")
+        self.workers, self.threads = max(1, workers), threads
+        self.throughput = _Throughput()
+
+    def _forward(self, ids: List[List[int]]) -> np.ndarray:
+        lens = np.array([len(x) for x in ids])
+        mask = (np.arange(lens.max())[None, :] < lens[:, None])
+        if self.session is not None:
+            input_ids = np.zeros(mask.shape, dtype=np.int64)
+            for r, x in enumerate(ids):
+                input_ids[r, :len(x)] = x
+            feed = {"input_ids": input_ids, "attention_mask": mask.astype(np.int64)}
+            if "token_type_ids" in self._inputs:
+                feed["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = self.session.run(None, feed)[0]
+        else:
+            hidden = np.array(self.encoder.forward_batch(ids).last_hidden_state)
+        if hidden.ndim == 2:  # model exported with its pooling layer
+            pooled = hidden
+        else:
+            m = mask[:, :hidden.shape[1], None].astype(np.float32)
+            pooled = (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+        pooled = pooled.astype(np.float32)
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled
+
+    def embed(self, texts: List[str], dims: Optional[int] = None) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, dims or self.dim or 0), dtype="float32")
+        t0 = time.perf_counter()
+        ids = [e.ids or [0] for e in self.tokenizer.encode_batch(list(texts))]
+        order = sorted(range(len(ids)), key=lambda i: len(ids[i]))
+        batches = [order[i:i + self.batch] for i in range(0, len(order), self.batch)]
+        parts = list(self._pool.map(lambda b: self._forward([ids[i] for i in b]), batches))
+        out = np.empty((len(texts), parts[0].shape[1]), dtype="float32")
+        for b, vecs in zip(batches, parts):
+            out[b] = vecs
+        self.dim = out.shape[1]
+        self.throughput.add(len(texts), sum(len(x) for x in ids), time.perf_counter() - t0)
+        return project(out, dims)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"id": self.id, "kind": self.kind, "dim": self.dim, "runtime": self.runtime, "path": self.path,
+                "workers": self.workers, "threads_per_worker": self.threads, "batch": self.batch,
+                "throughput": self.throughput.stats()}
+
+_WORD = re.compile(r"\w+")
+
+@lru_cache(maxsize=65536)
+def _bucket(term: str, dim: int):
+    h = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dim, 1.0 if h >> 63 else -1.0
+
+class StubBackend:
+    """
+    Signed feature hashing of lower-cased words and word bigrams into `dim` buckets, L2-normalised. Identical
+    on every machine and run, and texts sharing words score higher, so retrieval tests have meaningful answers.
+    """
+    kind = "stub"
+
+    def __init__(self, dim: int = STUB_EMBED_DIM):
+        self.id = f"stub:{dim}"
+        self.dim = dim
+        self.throughput = _Throughput()
+
+    def embed(self, texts: List[str], dims: Optional[int] = None) -> np.ndarray:
+        t0 = time.perf_counter()
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        tokens = 0
+        for r, t in enumerate(texts):
+            words = _WORD.findall((t or "").lower()) or [""]
+            tokens += len(words)
+            for term in words + [a + " " + b for a, b in zip(words, words[1:])]:
+                j, sign = _bucket(term, self.dim)
+                out[r, j] += sign
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        self.throughput.add(len(texts), tokens, time.perf_counter() - t0)
+        return project(out, dims)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"id": self.id, "kind": self.kind, "dim": self.dim, "throughput": self.throughput.stats()}
+
+def make_backend(backend_id: str, get_client: Callable[[], Any], count_tokens: Callable[[str], int]):
+    kind = backend_kind(backend_id)
+    if kind == "local":
+        return LocalBackend(backend_id.split(":", 1)[1])
+    if kind == "stub":
+        return StubBackend(int(backend_id.split(":", 1)[1]))
+    return OpenAIBackend(backend_id, get_client, count_tokens)
@@ -0,0 +1,220 @@
+# embed_cache.py
+"""
+Persistent, content-addressed embedding cache.
+
+Layout (one directory per embedding model under EMBED_CACHE_DIR):
+  info.json   {model, dim, dtype}
+  keys.bin    32-byte sha256(text) records; record i describes arena row i
+  arena.bin   fixed-width vectors (float16 by default), read through np.memmap
+
+Appends and compaction hold an exclusive flock on keys.bin (POSIX) and lookups a shared one, so ingest and
+several uvicorn workers can share one cache: a compaction replaces arena.bin and keys.bin while it holds the
+lock, so no reader ever pairs the new arena with the old key offsets. When the arena grows past
+EMBED_CACHE_MB the least recently used entries (recency tracked in-process; insertion order across restarts)
+are compacted away.
+"""
+import os, json, hashlib, threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # Windows: single-process locking only
+    fcntl = None
+
+EMBED_CACHE_DIR   = os.getenv("EMBED_CACHE_DIR", os.path.join("data", "cache", "embeddings"))
+EMBED_CACHE_MB    = float(os.getenv("EMBED_CACHE_MB", "512"))        # 0 disables the cache
+EMBED_CACHE_DTYPE = os.getenv("EMBED_CACHE_DTYPE", "float16").strip().lower()  # float16 | float32
+
+KEY_BYTES = 32
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+class EmbeddingCache:
+    def __init__(self, model: str, root: str = EMBED_CACHE_DIR, max_mb: float = EMBED_CACHE_MB,
+                 dtype: str = EMBED_CACHE_DTYPE):
+        safe = "".join(c if c.isalnum() or c in "-_.@" else "_" for c in model)
+        self.dir = os.path.join(root, safe)
+        os.makedirs(self.dir, exist_ok=True)
+        self.model = model
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.dtype = np.dtype(dtype)
+        self.keys_path = os.path.join(self.dir, "keys.bin")
+        self.arena_path = os.path.join(self.dir, "arena.bin")
+        self.info_path = os.path.join(self.dir, "info.json")
+
+        self._lock = threading.Lock()
+        self._slots: Dict[bytes, int] = {}
+        self._used: Dict[int, int] = {}      # slot -> last-use tick
+        self._tick = 0
+        self._keys_read = 0                  # bytes of keys.bin already indexed
+        self._keys_ino: Optional[int] = None
+        self._arena: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._lock, self._locked_keys(exclusive=False):
+            self._refresh()
+
+    # ---------- internal ----------
+    def _read_info(self):
+        if self.dim is None and os.path.exists(self.info_path):
+            with open(self.info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            if info.get("dtype") != self.dtype.name:
+                raise RuntimeError(f"Embedding cache {self.dir} uses {info.get('dtype')}, not {self.dtype.name}")
+            self.dim = int(info["dim"])
+
+    def _refresh(self):
+        """Pick up records appended by other processes (or a compaction that replaced the files)."""
+        self._read_info()
+        if not os.path.exists(self.keys_path):
+            return
+        st = os.stat(self.keys_path)
+        if self._keys_ino is not None and st.st_ino != self._keys_ino:
+            self._slots.clear()
+            self._used.clear()
+            self._keys_read = 0
+            self._arena = None
+        self._keys_ino = st.st_ino
+        # only index rows whose vectors are fully in the arena
+        row_bytes = (self.dim or 0) * self.dtype.itemsize
+        arena_rows = os.path.getsize(self.arena_path) // row_bytes if row_bytes and os.path.exists(self.arena_path) else 0
+        end = min(st.st_size // KEY_BYTES, arena_rows) * KEY_BYTES
+        if end <= self._keys_read:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_read)
+            blob = f.read(end - self._keys_read)
+        first = self._keys_read // KEY_BYTES
+        for i in range(len(blob) // KEY_BYTES):
+            slot = first + i
+            self._slots[blob[i * KEY_BYTES:(i + 1) * KEY_BYTES]] = slot
+            self._tick += 1
+            self._used[slot] = self._tick
+        self._keys_read = end
+
+    def _rows(self) -> np.ndarray:
+        n = self._keys_read // KEY_BYTES
+        if self._arena is None or self._arena.shape[0] < n:
+            self._arena = np.memmap(self.arena_path, dtype=self.dtype, mode="r", shape=(n, self.dim))
+        return self._arena
+
+    @contextmanager
+    def _locked_keys(self, exclusive: bool = True):
+        """
+        keys.bin under an flock -- exclusive (opened for append) to write, shared to read -- retrying if a
+        compaction swapped the file meanwhile. Yields None to readers when nothing has been cached yet.
+        """
+        while True:
+            if not exclusive and not os.path.exists(self.keys_path):
+                yield None
+                return
+            f = open(self.keys_path, "ab" if exclusive else "rb")
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            if os.fstat(f.fileno()).st_ino == os.stat(self.keys_path).st_ino:
+                break
+            f.close()
+        try:
+            yield f
+        finally:
+            f.close()
+
+    def _compact(self):
+        """Keep the most recently used entries that fit in 3/4 of the budget."""
+        row_bytes = self.dim * self.dtype.itemsize
+        keep_n = max(0, (self.max_bytes * 3 // 4) // row_bytes)
+        by_slot = {s: k for k, s in self._slots.items()}
+        keep = sorted(sorted(self._used, key=self._used.get, reverse=True)[:keep_n])
+        rows = self._rows()
+        tmp_keys, tmp_arena = self.keys_path + ".tmp", self.arena_path + ".tmp"
+        with open(tmp_keys, "wb") as kf, open(tmp_arena, "wb") as af:
+            for s in keep:
+                kf.write(by_slot[s])
+                af.write(np.ascontiguousarray(rows[s]).tobytes())
+        self._arena = None
+        os.replace(tmp_arena, self.arena_path)
+        os.replace(tmp_keys, self.keys_path)
+        self.evictions += len(self._slots) - len(keep)
+        self._slots = {by_slot[s]: i for i, s in enumerate(keep)}
+        self._used = {i: self._used[s] for i, s in enumerate(keep)}
+        self._keys_read = len(keep) * KEY_BYTES
+        self._keys_ino = os.stat(self.keys_path).st_ino
+
+    # ---------- public ----------
+    def get_many(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        """Return (vectors-or-None per text, indices of misses)."""
+        keys = [text_key(t) for t in texts]
+        out: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing: List[int] = []
+        with self._lock, self._locked_keys(exclusive=False):
+            self._refresh()
+            rows = self._rows() if self._keys_read else None
+            for i, k in enumerate(keys):
+                slot = self._slots.get(k)
+                if slot is None or rows is None:
+                    missing.append(i)
+                    continue
+                self._tick += 1
+                self._used[slot] = self._tick
+                out[i] = np.asarray(rows[slot], dtype="float32")
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return out, missing
+
+    def put_many(self, texts: List[str], vecs: np.ndarray):
+        if not texts or self.max_bytes <= 0:
+            return
+        vecs = np.ascontiguousarray(vecs, dtype=self.dtype)
+        with self._lock, self._locked_keys() as kf:
+            self._refresh()
+            if self.dim is None:
+                self.dim = int(vecs.shape[1])
+                with open(self.info_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model, "dim": self.dim, "dtype": self.dtype.name}, f)
+            if vecs.shape[1] != self.dim:
+                return
+            fresh: Dict[bytes, int] = {}
+            for i, t in enumerate(texts):
+                k = text_key(t)
+                if k not in self._slots and k not in fresh:
+                    fresh[k] = i
+            if not fresh:
+                return
+            # vectors first, then keys: a reader never indexes a key whose vector isn't written yet.
+            # Drop any vectors a crashed writer left without keys so arena row i stays keys record i.
+            row_bytes = self.dim * self.dtype.itemsize
+            n_keys = os.path.getsize(self.keys_path) // KEY_BYTES
+            if os.path.getsize(self.keys_path) != n_keys * KEY_BYTES:
+                os.truncate(self.keys_path, n_keys * KEY_BYTES)
+            if os.path.exists(self.arena_path) and os.path.getsize(self.arena_path) > n_keys * row_bytes:
+                os.truncate(self.arena_path, n_keys * row_bytes)
+            with open(self.arena_path, "ab") as af:
+                af.write(vecs[list(fresh.values())].tobytes())
+            kf.write(b"".join(fresh.keys()))
+            kf.flush()
+            self._refresh()
+            if os.path.getsize(self.arena_path) > self.max_bytes:
+                self._compact()
+
+    def round_trip(self, vecs: np.ndarray) -> np.ndarray:
+        """Vectors as they would come back from the cache, so hits and misses are bit-identical."""
+        return np.asarray(vecs, dtype=self.dtype).astype("float32")
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "model": self.model,
+            "entries": len(self._slots),
+            "bytes": os.path.getsize(self.arena_path) if os.path.exists(self.arena_path) else 0,
+            "max_bytes": self.max_bytes,
+            "dtype": self.dtype.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
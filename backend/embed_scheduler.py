@@ -0,0 +1,160 @@
+# embed_scheduler.py
+"""
+Token-aware batching + concurrency for embedding requests.
+
+Texts are packed in order into batches bounded by EMBED_BATCH_TOKENS / EMBED_BATCH_ITEMS, up to
+EMBED_CONCURRENCY batches are in flight at once, and every request first takes its tokens from a shared
+per-minute budget (EMBED_RPM / EMBED_TPM). Failed requests that are worth retrying (429, 5xx, timeouts,
+connection errors) back off with full jitter, honouring Retry-After when the server sends one.
+Output order always matches input order.
+
+The scheduler only needs a `request_fn(texts) -> vectors` and a token counter, so it can be pointed at a
+local fake embeddings server (OPENAI_BASE_URL) or a plain function.
+"""
+import os, time, random, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Dict, Any, Tuple
+
+try:
+    import openai  # type: ignore
+    _RETRYABLE_TYPES: tuple = (openai.APIConnectionError, openai.APITimeoutError)
+except Exception:  # pragma: no cover
+    _RETRYABLE_TYPES = ()
+
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "60000"))
+EMBED_BATCH_ITEMS  = int(os.getenv("EMBED_BATCH_ITEMS", "512"))
+EMBED_CONCURRENCY  = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_RPM          = float(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM          = float(os.getenv("EMBED_TPM", "1000000"))
+EMBED_MAX_RETRIES  = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", "0.5"))
+EMBED_BACKOFF_MAX  = float(os.getenv("EMBED_BACKOFF_MAX", "30"))
+
+class RateBudget:
+    """Two token buckets (requests/min, tokens/min) shared by every in-flight request."""
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm, self.tpm = rpm, tpm
+        self._req, self._tok = float(rpm), float(tpm)
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        dt, self._t = now - self._t, now
+        self._req = min(self.rpm, self._req + dt * self.rpm / 60.0)
+        self._tok = min(self.tpm, self._tok + dt * self.tpm / 60.0)
+
+    def acquire(self, tokens: int):
+        tokens = min(tokens, self.tpm)  # an oversize batch must still be able to go eventually
+        while True:
+            with self._lock:
+                self._refill()
+                if self._req >= 1 and self._tok >= tokens:
+                    self._req -= 1
+                    self._tok -= tokens
+                    return
+                wait = max((1 - self._req) * 60.0 / self.rpm, (tokens - self._tok) * 60.0 / self.tpm, 0.01)
+            time.sleep(wait)
+
+def is_retryable(e: Exception) -> bool:
+    if _RETRYABLE_TYPES and isinstance(e, _RETRYABLE_TYPES):
+        return True
+    status = getattr(e, "status_code", None)
+    return status in (408, 409, 429) or (isinstance(status, int) and status >= 500)
+
+def _retry_after(e: Exception) -> Optional[float]:
+    resp = getattr(e, "response", None)
+    headers = getattr(resp, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class EmbedScheduler:
+    def __init__(self, request_fn: Callable[[List[str]], List[List[float]]], count_tokens: Callable[[str], int],
+                 max_batch_tokens: int = EMBED_BATCH_TOKENS, max_batch_items: int = EMBED_BATCH_ITEMS,
+                 concurrency: int = EMBED_CONCURRENCY, rpm: float = EMBED_RPM, tpm: float = EMBED_TPM,
+                 max_retries: int = EMBED_MAX_RETRIES, backoff_base: float = EMBED_BACKOFF_BASE,
+                 backoff_max: float = EMBED_BACKOFF_MAX):
+        self.request_fn = request_fn
+        self.count_tokens = count_tokens
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.concurrency = max(1, concurrency)
+        self.budget = RateBudget(rpm, tpm)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.retry_reasons: Dict[str, int] = {}  # exception type / HTTP status -> retries
+        self.backoff_s = 0.0                     # time spent sleeping between attempts
+        self.tokens = 0
+
+    def pack(self, texts: List[str]) -> List[Tuple[List[int], int]]:
+        """Greedy in-order packing into (indices, tokens) batches, bounded by tokens and item count."""
+        batches: List[Tuple[List[int], int]] = []
+        cur: List[int] = []
+        cur_tokens = 0
+        for i, t in enumerate(texts):
+            n = self.count_tokens(t)
+            if cur and (cur_tokens + n > self.max_batch_tokens or len(cur) >= self.max_batch_items):
+                batches.append((cur, cur_tokens))
+                cur, cur_tokens = [], 0
+            cur.append(i)
+            cur_tokens += n
+        if cur:
+            batches.append((cur, cur_tokens))
+        return batches
+
+    def _send(self, batch: List[str], tokens: int) -> List[List[float]]:
+        """One embeddings request for `batch` (`tokens` as counted by pack), retried with backoff."""
+        for attempt in range(self.max_retries + 1):
+            self.budget.acquire(tokens)
+            try:
+                vecs = self.request_fn(batch)
+                if len(vecs) != len(batch):
+                    raise RuntimeError(f"Embedding response has {len(vecs)} vectors for {len(batch)} inputs")
+                with self._stats_lock:
+                    self.requests += 1
+                    self.tokens += tokens
+                return vecs
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                delay = min(delay, self.backoff_max)
+                reason = str(getattr(e, "status_code", None) or type(e).__name__)
+                with self._stats_lock:
+                    self.retries += 1
+                    self.retry_reasons[reason] = self.retry_reasons.get(reason, 0) + 1
+                    self.backoff_s += delay
+                time.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    def run(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = self.pack(texts)
+        out: List[Any] = [None] * len(texts)
+        if len(batches) == 1 or self.concurrency == 1:
+            results = (self._send([texts[i] for i in b], n) for b, n in batches)
+            for (b, _), vecs in zip(batches, results):
+                for i, v in zip(b, vecs):
+                    out[i] = v
+            return out
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as ex:
+            futs = [(b, ex.submit(self._send, [texts[i] for i in b], n)) for b, n in batches]
+            for b, fut in futs:
+                for i, v in zip(b, fut.result()):
+                    out[i] = v
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {"requests": self.requests, "retries": self.retries, "retry_reasons": dict(self.retry_reasons),
+                    "backoff_s": round(self.backoff_s, 3), "tokens": self.tokens,
+                    "concurrency": self.concurrency, "max_batch_tokens": self.max_batch_tokens}
@@ -0,0 +1,91 @@
+# index_versions.py
+"""
+Versioned serving snapshots, shared by ingest.py (publish) and app.py (load / hot-swap).
+
+data/index/
+  CURRENT                    name of the active version (replaced atomically)
+  versions/<version>/        immutable once published:
+    index.faiss, index_info.json, chunks/, text/
+    vectors.f32              hard link to the working vectors.f32 (copied where links are unsupported);
+                             ingest only appends to or atomically replaces that file, so the first
+                             index_info["rows"] rows seen through the link never change
+
+A data/index without CURRENT is served from its top-level files as before (legacy layout).
+"""
+import os, time, shutil
+from contextlib import contextmanager
+from typing import List, Optional
+
+try:
+    import fcntl  # type: ignore
+except Exception:  # pragma: no cover  (Windows)
+    fcntl = None
+
+VERSIONS = "versions"
+CURRENT = "CURRENT"
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))  # published versions kept on disk
+
+def new_version_id() -> str:
+    """UTC timestamp to the microsecond, so names sort in publish order."""
+    t = time.time()
+    return time.strftime("%Y%m%d-%H%M%S", time.gmtime(t)) + f"-{int(t * 1e6) % 1_000_000:06d}"
+
+def version_dir(idx_dir: str, version: str) -> str:
+    return os.path.join(idx_dir, VERSIONS, version)
+
+def read_current(idx_dir: str) -> Optional[str]:
+    path = os.path.join(idx_dir, CURRENT)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        v = f.read().strip()
+    return v if v and os.path.isdir(version_dir(idx_dir, v)) else None
+
+def current_mtime(idx_dir: str) -> Optional[int]:
+    try:
+        return os.stat(os.path.join(idx_dir, CURRENT)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def list_versions(idx_dir: str) -> List[str]:
+    root = os.path.join(idx_dir, VERSIONS)
+    if not os.path.isdir(root):
+        return []
+    return sorted(v for v in os.listdir(root) if not v.endswith(".tmp") and os.path.isdir(os.path.join(root, v)))
+
+def link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+@contextmanager
+def index_lock(idx_dir: str):
+    """Exclusive lock on data/index across processes (uvicorn workers); a no-op where fcntl is unavailable."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(idx_dir, exist_ok=True)
+    with open(os.path.join(idx_dir, ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def publish(idx_dir: str, version: str):
+    """Point CURRENT at a fully written version directory."""
+    tmp = os.path.join(idx_dir, CURRENT + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(idx_dir, CURRENT))
+
+def prune(idx_dir: str, keep: int = INDEX_KEEP_VERSIONS):
+    """Delete all but the newest `keep` versions (never the current one). Servers still holding an old
+    version keep working on POSIX because their open files / mmaps outlive the directory entries."""
+    cur = read_current(idx_dir)
+    old = [v for v in list_versions(idx_dir) if v != cur]
+    for v in old[:max(0, len(old) - max(0, keep - 1))]:
+        shutil.rmtree(version_dir(idx_dir, v), ignore_errors=True)
@@ -1,13 +1,24 @@
 # ingest.py
-import os, json, time
-from typing import Dict, Any, List, Tuple, Optional
+import os, json, time, hashlib, argparse, threading, queue, shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Tuple, Optional, Iterator
 import numpy as np
 import faiss
 
 from rag_core import (
-    extract_text_from_pdf, chunk_text, tag_text,
-    ORGANISMS, STRESSORS, PLATFORMS, embed_texts
+    extract_text_from_pdf, chunk_text, FACET_TAGGER, EMBED_MODEL, EMBED_BACKEND_ID, EMBED_DIMS, embed_texts,
+    get_embed_backend
 )
+from embed_backends import BACKENDS, backend_kind, configured_backend_id, project
+from vector_index import (
+    INDEX_TYPE, INDEX_TYPES, INDEX_STORAGE, INDEX_STORAGES, index_params, build_index as build_faiss_index,
+    recall_report, synthetic_queries, write_index_info, code_bytes, RerankIndex
+)
+from meta_store import write_chunk_store, ChunkStore, new_doc_counts, count_row, doc_counts, stats_from_counts
+from text_index import write_text_index
+from index_versions import CURRENT, new_version_id, version_dir, read_current, link_or_copy, publish, prune
+from shards import INDEX_SHARDS, write_shards
 from importlib.metadata import version, PackageNotFoundError
 try:
     LIB_VER = version("ctranslate2")  # or whichever package you were checking
@@ -18,6 +29,18 @@ DATA_DIR = "data/pdfs"
 IDX_DIR  = "data/index"
 META_PATH = os.path.join(IDX_DIR, "meta.jsonl")
 FAISS_PATH = os.path.join(IDX_DIR, "index.faiss")
+VECTORS_PATH = os.path.join(IDX_DIR, "vectors.f32")   # raw normalised float32 rows, row i == meta line i
+MANIFEST_PATH = os.path.join(IDX_DIR, "manifest.json")
+REPORT_PATH = os.path.join(IDX_DIR, "index_report.json")
+INDEX_INFO_PATH = os.path.join(IDX_DIR, "index_info.json")
+# index.faiss, index_info.json, chunks/ and text/ are served from versions/<v>/ (see index_versions.py);
+# the top-level paths are the pre-versioning layout, removed once a version is published.
+CHUNKS_DIR = os.path.join(IDX_DIR, "chunks")   # columnar, mmap-able copy of meta.jsonl for the app
+TEXT_DIR = os.path.join(IDX_DIR, "text")       # inverted index over chunk texts (/library full-text search)
+MANIFEST_VERSION = 2
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or (os.cpu_count() or 1)
+EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "256"))   # chunks embedded + committed per step
+PARSE_QUEUE = int(os.getenv("INGEST_PARSE_QUEUE", "8"))     # parsed PDFs buffered ahead of the embedder
 
 def ensure_dirs():
     os.makedirs(DATA_DIR, exist_ok=True)
@@ -34,73 +57,578 @@ def guess_title_year(path: str, pages: List[Tuple[int,str]]) -> Tuple[str, Optio
         if year: break
     return title, year
 
-def run_ingest():
-    ensure_dirs()
-    pdfs = [os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.lower().endswith(".pdf")]
-    if not pdfs:
-        print(f"No PDFs found in {DATA_DIR}. Place files and retry.")
-        return
+# ----------------- Manifest -----------------
+def file_sha256(path: str, block: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(block), b""):
+            h.update(buf)
+    return h.hexdigest()
 
-    records: List[Dict[str, Any]] = []
-    texts_for_embed: List[str] = []
-    cursor = 0
+def empty_manifest(embed_model: str = EMBED_BACKEND_ID) -> Dict[str, Any]:
+    """
+    rows/meta_bytes: committed length of vectors.f32 / meta.jsonl (anything past it is an unfinished batch).
+    docs: {path: {size, mtime, sha256, chunk_ids: [start, end), stats}} for fully committed PDFs
+          (stats: the document's counts for chunks/stats.json, see meta_store.new_doc_counts).
+    pending: the PDF whose chunks were only partly committed when the last run stopped.
+    embed_model: id of the embedding backend every stored vector came from (see embed_backends.py).
+    dims: reduced width the vectors were shortened to (None = the model's full width); dim is the stored width.
+    """
+    return {"version": MANIFEST_VERSION, "embed_model": embed_model, "dims": None, "dim": None,
+            "rows": 0, "meta_bytes": 0, "indexed_rows": 0, "index": None, "docs": {}, "pending": None}
+
+def load_manifest(embed_model: str = EMBED_BACKEND_ID) -> Dict[str, Any]:
+    if not os.path.exists(MANIFEST_PATH):
+        return empty_manifest(embed_model)
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            man = json.load(f)
+    except Exception:
+        return empty_manifest(embed_model)
+    if man.get("embed_model") != embed_model:
+        # Vectors from another model can't be reused.
+        print(f"Stored vectors come from {man.get('embed_model')}, not {embed_model}; re-embedding everything.")
+        return empty_manifest(embed_model)
+    if man.get("version") == 1:
+        return _migrate_v1(man)
+    if man.get("version") != MANIFEST_VERSION:
+        return empty_manifest(embed_model)
+    return man
+
+def _migrate_v1(old: Dict[str, Any]) -> Dict[str, Any]:
+    """v1 kept vectors only inside index.faiss; export them once to vectors.f32 instead of re-embedding."""
+    man = empty_manifest(old["embed_model"])
+    if not (os.path.exists(FAISS_PATH) and os.path.exists(META_PATH)):
+        return man
+    index = faiss.read_index(FAISS_PATH)
+    rows = max((d["chunk_ids"][1] for d in old["docs"].values()), default=0)
+    if index.ntotal != rows:
+        return man
+    with open(VECTORS_PATH, "wb") as f:
+        for s in range(0, rows, 65536):
+            f.write(index.reconstruct_n(s, min(65536, rows - s)).astype("float32").tobytes())
+    man.update(dim=index.d, rows=rows, meta_bytes=os.path.getsize(META_PATH), indexed_rows=rows, docs=old["docs"])
+    print(f"Migrated manifest v1 -> v{MANIFEST_VERSION} ({rows} vectors exported to {VECTORS_PATH})")
+    return man
+
+def _replace_atomic(path: str, write_fn):
+    """write_fn(tmp_path) then rename over `path`, so readers never see a half-written file."""
+    tmp = path + ".tmp"
+    write_fn(tmp)
+    os.replace(tmp, path)
 
-    print(f"Found {len(pdfs)} PDFs")
+def _write_text(path: str, lines):
+    def w(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+    _replace_atomic(path, w)
+
+def save_manifest(man: Dict[str, Any]):
+    _write_text(MANIFEST_PATH, [json.dumps(man, ensure_ascii=False, indent=1)])
+
+def diff_manifest(pdfs: List[str], man: Dict[str, Any]) -> Tuple[Dict[str, Dict[str, Any]], List[str], List[str], List[str]]:
+    """
+    Compare PDFs on disk against the manifest.
+    Returns (stat entries for every pdf, new/changed paths, unchanged paths, removed paths).
+    size+mtime match is trusted; otherwise the content hash decides (a touched but identical file is unchanged).
+    """
+    docs = man["docs"]
+    entries: Dict[str, Dict[str, Any]] = {}
+    dirty, clean = [], []
     for p in pdfs:
-        pages = extract_text_from_pdf(p)
-        if not any(t for _, t in pages):
-            print(f"Skip (no text): {p}")
-            continue
+        st = os.stat(p)
+        entry = {"size": st.st_size, "mtime": st.st_mtime}
+        old = docs.get(p)
+        if old and old["size"] == entry["size"] and old["mtime"] == entry["mtime"]:
+            entry["sha256"] = old["sha256"]
+        else:
+            entry["sha256"] = file_sha256(p)
+        entries[p] = entry
+        if old and old["sha256"] == entry["sha256"]:
+            clean.append(p)
+        else:
+            dirty.append(p)
+    removed = [p for p in docs if p not in entries]
+    return entries, dirty, clean, removed
+
+# ----------------- Vector / meta store -----------------
+def open_store(man: Dict[str, Any]) -> Dict[str, Any]:
+    """Check vectors.f32 + meta.jsonl against the manifest and cut off any uncommitted tail."""
+    if man["rows"] == 0:
+        for p in (VECTORS_PATH, META_PATH):
+            if os.path.exists(p):
+                os.remove(p)
+        return man
+    vec_bytes = man["rows"] * man["dim"] * 4
+    if not (os.path.exists(VECTORS_PATH) and os.path.exists(META_PATH)) \
+            or os.path.getsize(VECTORS_PATH) < vec_bytes or os.path.getsize(META_PATH) < man["meta_bytes"]:
+        print("Vector store out of sync with manifest; rebuilding from scratch.")
+        return open_store(empty_manifest(man["embed_model"]))
+    if os.path.getsize(VECTORS_PATH) > vec_bytes or os.path.getsize(META_PATH) > man["meta_bytes"]:
+        print(f"Discarding uncommitted rows past {man['rows']} (previous run did not finish)")
+        os.truncate(VECTORS_PATH, vec_bytes)
+        os.truncate(META_PATH, man["meta_bytes"])
+    return man
+
+def compact_store(man: Dict[str, Any], dead: List[Tuple[int, int]]):
+    """Stream-copy vectors.f32 + meta.jsonl without the dead [start, end) id ranges, renumbering ids."""
+    dead = sorted((s, e) for s, e in dead if e > s)
+    if not dead:
+        return
+    rows, dim = man["rows"], man["dim"]
+
+    def shift(i: int) -> int:
+        return sum(e - s for s, e in dead if e <= i)
+
+    keep, prev = [], 0
+    for s, e in dead:
+        if s > prev:
+            keep.append((prev, s))
+        prev = e
+    if prev < rows:
+        keep.append((prev, rows))
+
+    vec = np.memmap(VECTORS_PATH, dtype="float32", mode="r", shape=(rows, dim))
+    def write_vectors(tmp):
+        with open(tmp, "wb") as f:
+            for a, b in keep:
+                for s in range(a, b, 65536):
+                    f.write(np.ascontiguousarray(vec[s:min(b, s + 65536)]).tobytes())
+    _replace_atomic(VECTORS_PATH, write_vectors)
+    del vec
+
+    def write_meta(tmp):
+        with open(META_PATH, "r", encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
+            ki, new_id = 0, 0
+            for i, line in enumerate(src):
+                while ki < len(keep) and i >= keep[ki][1]:
+                    ki += 1
+                if ki >= len(keep) or i < keep[ki][0]:
+                    continue
+                r = json.loads(line)
+                r["id"] = new_id
+                dst.write(json.dumps(r, ensure_ascii=False) + "\n")
+                new_id += 1
+    _replace_atomic(META_PATH, write_meta)
+
+    for d in man["docs"].values():
+        s, e = d["chunk_ids"]
+        d["chunk_ids"] = [s - shift(s), e - shift(s)]
+    if man.get("pending"):
+        s, e = man["pending"]["chunk_ids"]
+        man["pending"]["chunk_ids"] = [s - shift(s), e - shift(s)]
+    man["rows"] = rows - sum(e - s for s, e in dead)
+    man["meta_bytes"] = os.path.getsize(META_PATH)
+    man["indexed_rows"] = -1
+
+def resize_store(man: Dict[str, Any], dims: Optional[int]) -> Dict[str, Any]:
+    """
+    Match the stored vectors to `dims` (None = full width). Narrower than stored: every row is truncated and
+    re-normalised instead of re-embedded, into a new vectors.f32 (published versions keep the old one through
+    their hard link). Wider than stored: the texts have to be embedded again.
+    """
+    if man.get("dims") == dims:
+        return man
+    if man["rows"] == 0:
+        man["dims"] = dims
+        return man
+    if dims and dims <= man["dim"]:
+        old = man["dim"]
+        if dims < old:
+            vec = _vectors(man)
+            def write_vectors(tmp):
+                with open(tmp, "wb") as f:
+                    for s in range(0, man["rows"], 65536):
+                        f.write(project(np.asarray(vec[s:s + 65536]), dims).tobytes())
+            _replace_atomic(VECTORS_PATH, write_vectors)
+            del vec
+        man.update(dim=dims, dims=dims, indexed_rows=-1)
+        save_manifest(man)
+        print(f"[dims] {man['rows']} stored vectors {old}-d -> {dims}-d (truncated + re-normalised, not re-embedded)")
+        return man
+    print(f"Stored vectors are {man['dim']}-d; {dims or 'full width'} needs the texts embedded again.")
+    man = empty_manifest(man["embed_model"])
+    man["dims"] = dims
+    return open_store(man)
+
+def _vectors(man: Dict[str, Any]) -> np.memmap:
+    return np.memmap(VECTORS_PATH, dtype="float32", mode="r", shape=(man["rows"], man["dim"]))
+
+def _remove_legacy():
+    """Drop the pre-versioning top-level serving files once CURRENT points at a version."""
+    for p in (FAISS_PATH, INDEX_INFO_PATH):
+        if os.path.exists(p):
+            os.remove(p)
+    shutil.rmtree(CHUNKS_DIR, ignore_errors=True)
+    shutil.rmtree(TEXT_DIR, ignore_errors=True)
+
+def build_index(man: Dict[str, Any], params: Dict[str, Any], shards: int = 1):
+    """
+    Build a new serving version (index.faiss of the configured type over vectors.f32, chunk store, text index)
+    in versions/<v>.tmp, move it into place and publish it through CURRENT. A running app swaps to it
+    without restarting (file watcher or POST /admin/reload). With shards > 1 the vectors are split by document
+    into shards/<s>/, each with its own index (see shards.py), and None is returned instead of one index.
+    """
+    v = new_version_id()
+    out = version_dir(IDX_DIR, v)
+    tmp = out + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    # queries against this version are embedded by the same backend (app.py reads embed_model back)
+    info = {"embed_model": man["embed_model"], "embed_backend": backend_kind(man["embed_model"]),
+            "dims": man.get("dims"), "built_at": time.time(), "version": v}
+    index = None
+    if shards > 1:
+        print(f"Building {shards} {params['type']} shards over {man['rows']} vectors")
+        write_shards(_vectors(man), META_PATH, tmp, shards, params["type"], FACET_TAGGER.labels, info,
+                     params.get("storage", "f32"))
+    else:
+        print(f"Building {params['type']} index over {man['rows']} vectors {params}")
+        index = build_faiss_index(_vectors(man), params)
+        print(f"Saving index -> {out}/index.faiss")
+        faiss.write_index(index, os.path.join(tmp, "index.faiss"))
+        vec_path = os.path.join(tmp, os.path.basename(VECTORS_PATH))
+        link_or_copy(VECTORS_PATH, vec_path)
+        # lets the app serve a flat index straight from the linked vectors.f32
+        info["vectors"] = {"path": os.path.basename(VECTORS_PATH), "ino": os.stat(vec_path).st_ino}
+
+    print(f"Writing chunk store -> {out}/chunks")
+    backfill_doc_counts(man)
+    stats = stats_from_counts([d["stats"] for d in man["docs"].values()], FACET_TAGGER.labels)
+    write_chunk_store(META_PATH, os.path.join(tmp, "chunks"), FACET_TAGGER.labels, stats=stats)
+    print(f"Writing text index -> {out}/text")
+    store = ChunkStore(os.path.join(tmp, "chunks"))
+    write_text_index(store, os.path.join(tmp, "text"))
+    store.close()
+    write_index_info(os.path.join(tmp, "index_info.json"), params | info | {
+        "rows": man["rows"], "dim": man["dim"], "shards": shards,
+    })
+    os.replace(tmp, out)
+    publish(IDX_DIR, v)
+    print(f"Published index version {v}")
+    _remove_legacy()
+    prune(IDX_DIR)
+
+    man["indexed_rows"] = man["rows"]
+    man["index"] = params
+    man["shards"] = shards
+    man["index_version"] = v
+    return index
+
+def backfill_doc_counts(man: Dict[str, Any]):
+    """
+    Per-document stats counts for manifest entries that have none (written before they were kept) or were
+    counted under other facets: one pass over meta.jsonl for just those documents.
+    """
+    facets = list(FACET_TAGGER.labels)
+    todo = {p: new_doc_counts(facets) for p, d in man["docs"].items() if (d.get("stats") or {}).get("facets") != facets}
+    if not todo:
+        return
+    with open(META_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                counts = todo.get(r.get("doc_path"))
+                if counts is not None:
+                    count_row(counts, r)
+    for p, counts in todo.items():
+        man["docs"][p]["stats"] = counts
+    print(f"[stats] counted {len(todo)} documents from meta.jsonl")
+
+def write_report(man: Dict[str, Any], index, eval_queries: Optional[str] = None, n: int = 200, k: int = 10):
+    """recall@k vs exact search + p50/p99 latency on eval or synthetic queries -> index_report.json."""
+    if man["rows"] < k:
+        return
+    vec = _vectors(man)
+    if eval_queries:
+        with open(eval_queries, "r", encoding="utf-8") as f:
+            qs = [l.strip() for l in f if l.strip()]
+        queries = embed_texts(qs, man["embed_model"], man.get("dims"))
+        faiss.normalize_L2(queries)
+        source = eval_queries
+    else:
+        queries = synthetic_queries(vec, n)
+        source = "synthetic (midpoints of random stored vectors)"
+    if man["index"].get("storage"):
+        index = RerankIndex(index, vec)  # report what the app serves: compressed first pass + exact re-rank
+    report = recall_report(index, vec, queries, k) | {
+        "storage": man["index"].get("storage", "f32"), "code_bytes": code_bytes(man["index"], man["dim"]),
+        "queries_from": source,
+    }
+    _write_text(REPORT_PATH, [json.dumps(report, indent=1)])
+    print(f"[report] {report['type']} ({report['storage']}): recall@{k}={report['recall_at_k']} "
+          f"p50={report['latency_ms']['p50']}ms p99={report['latency_ms']['p99']}ms -> {REPORT_PATH}")
+
+def _append_durable(path: str, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
 
+# ----------------- Parsing -----------------
+def parse_pdf(p: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Extract, tag and chunk one PDF. Runs in a worker process; ids are assigned by the caller."""
+    t0 = time.perf_counter()
+    pages = extract_text_from_pdf(p)
+    records: List[Dict[str, Any]] = []
+    if not any(t for _, t in pages):
+        print(f"Skip (no text): {p}")
+    else:
         title, year = guess_title_year(p, pages)
         full_text = "\n".join([t for _, t in pages])
-        organism = tag_text(full_text, ORGANISMS)
-        stressor = tag_text(full_text, STRESSORS)
-        platform = tag_text(full_text, PLATFORMS)
+        doc_tags = FACET_TAGGER.tag(full_text)
 
         for page_no, page_txt in pages:
             if not page_txt.strip():
                 continue
             chunks = chunk_text(page_txt)
             for ch in chunks:
-                rec = {
-                    "id": cursor,
+                # chunk-level facets; a facet the chunk never mentions falls back to the document's
+                tags = {f: (t if t[0] else doc_tags[f]) for f, t in FACET_TAGGER.tag(ch).items()}
+                records.append({
                     "doc_path": p,
                     "doc_title": title,
                     "year": year,
                     "page_start": page_no,
                     "page_end": page_no,
-                    "organism": organism,
-                    "stressor": stressor,
-                    "platform": platform,
+                    "organism": tags["organism"][0],
+                    "stressor": tags["stressor"][0],
+                    "platform": tags["platform"][0],
+                    "facet_bits": [tags[f][1] for f in FACET_TAGGER.names],
                     "text": ch
-                }
-                records.append(rec)
-                texts_for_embed.append(ch)
-                cursor += 1
+                })
+    stats = {"pid": os.getpid(), "pages": len(pages), "chunks": len(records), "secs": time.perf_counter() - t0}
+    return records, stats
 
-    if not records:
-        print("No content parsed. Exiting.")
+def parse_pdfs(paths: List[str], workers: int = INGEST_WORKERS) -> Iterator[Tuple[str, List[Dict[str, Any]], Dict[str, Any]]]:
+    """
+    Yield (path, records, stats) in input order. With workers > 1 PDFs are parsed in a process pool;
+    results are consumed in submission order, so chunk ids stay reproducible regardless of worker timing.
+    At most 2*workers PDFs are in flight, which keeps memory bounded when the consumer is slower.
+    """
+    if workers <= 1 or len(paths) <= 1:
+        for p in paths:
+            yield (p, *parse_pdf(p))
         return
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as ex:
+        inflight: deque = deque()
+        for p in paths:
+            inflight.append((p, ex.submit(parse_pdf, p)))
+            if len(inflight) >= 2 * workers:
+                q, fut = inflight.popleft()
+                yield (q, *fut.result())
+        while inflight:
+            q, fut = inflight.popleft()
+            yield (q, *fut.result())
+
+_DONE = object()
+
+def _produce(paths: List[str], workers: int, out: queue.Queue, stop: threading.Event):
+    """Producer thread: parse PDFs ahead of the embedder into a bounded queue."""
+    def put(item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    try:
+        for item in parse_pdfs(paths, workers):
+            if stop.is_set():
+                return
+            put(item)
+    except BaseException as e:
+        put(e)
+    finally:
+        put(_DONE)
+
+def stream_parsed(paths: List[str], workers: int) -> Iterator[Tuple[str, List[Dict[str, Any]], Dict[str, Any]]]:
+    out: queue.Queue = queue.Queue(maxsize=PARSE_QUEUE)
+    stop = threading.Event()
+    t = threading.Thread(target=_produce, args=(paths, workers, out, stop), daemon=True)
+    t.start()
+    try:
+        while True:
+            item = out.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def _accumulate(per: Dict[int, Dict[str, float]], s: Dict[str, Any]):
+    agg = per.setdefault(s["pid"], {"docs": 0, "pages": 0, "chunks": 0, "secs": 0.0})
+    agg["docs"] += 1
+    agg["pages"] += s["pages"]
+    agg["chunks"] += s["chunks"]
+    agg["secs"] += s["secs"]
+
+def report_throughput(per: Dict[int, Dict[str, float]], wall: float):
+    for pid, a in sorted(per.items()):
+        busy = max(a["secs"], 1e-9)
+        print(f"[parse] worker {pid}: {a['docs']} docs, {a['pages']} pages, {a['chunks']} chunks in {a['secs']:.1f}s "
+              f"-> {a['pages']/busy:.1f} pages/s, {a['chunks']/busy:.1f} chunks/s")
+    pages = sum(a["pages"] for a in per.values())
+    chunks = sum(a["chunks"] for a in per.values())
+    wall = max(wall, 1e-9)
+    print(f"[parse] total: {len(per)} workers, {pages} pages, {chunks} chunks in {wall:.1f}s wall "
+          f"-> {pages/wall:.1f} pages/s, {chunks/wall:.1f} chunks/s")
+
+# ----------------- Streaming embed + commit -----------------
+class StoreWriter:
+    """
+    Consumer side of the pipeline: packs parsed chunks into EMBED_BATCH batches, embeds each one and
+    appends vectors + meta lines durably, then records the new committed length in the manifest.
+    A crash loses at most the batch in flight; the next run truncates to the manifest and resumes.
+    A committed document's entry also carries its stats counts, taken from its own chunks only.
+    """
+    def __init__(self, man: Dict[str, Any], entries: Dict[str, Dict[str, Any]]):
+        self.man = man
+        self.entries = entries
+        self.open_docs: deque = deque()   # (path, start, end) not yet fully committed
+        self.counts: Dict[str, Dict[str, Any]] = {}
+        self.batch: List[Dict[str, Any]] = []
+        self.next_id = man["rows"]
+        self.embedded = 0
 
-    print(f"Embedding {len(records)} chunks...")
-    embs = embed_texts(texts_for_embed)
-    faiss.normalize_L2(embs)
-    dim = embs.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(embs)
+    def add_doc(self, p: str, recs: List[Dict[str, Any]]):
+        pend = self.man.get("pending")
+        skip = 0
+        start = self.next_id
+        if pend and pend["path"] == p:
+            start = pend["chunk_ids"][0]
+            skip = pend["chunk_ids"][1] - start
+        for i, r in enumerate(recs):
+            r["id"] = start + i
+        self.open_docs.append((p, start, start + len(recs)))
+        self.counts[p] = doc_counts(recs, list(FACET_TAGGER.labels))
+        self.batch.extend(recs[skip:])
+        self.next_id = start + len(recs)
+        while len(self.batch) >= EMBED_BATCH:
+            self.commit(self.batch[:EMBED_BATCH])
+            del self.batch[:EMBED_BATCH]
 
-    print(f"Saving index -> {FAISS_PATH}")
-    faiss.write_index(index, FAISS_PATH)
+    def flush(self):
+        self.commit(self.batch)
+        self.batch = []
 
-    print(f"Writing metadata -> {META_PATH}")
-    with open(META_PATH, "w", encoding="utf-8") as f:
-        for r in records:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    def commit(self, batch: List[Dict[str, Any]]):
+        man = self.man
+        if batch:
+            embs = embed_texts([r["text"] for r in batch], man["embed_model"], man.get("dims"))
+            faiss.normalize_L2(embs)
+            if man["dim"] is None:
+                man["dim"] = int(embs.shape[1])
+            elif embs.shape[1] != man["dim"]:
+                raise RuntimeError(f"{man['embed_model']} returned {embs.shape[1]}-d vectors; the store holds {man['dim']}-d")
+            meta_blob = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch).encode("utf-8")
+            _append_durable(VECTORS_PATH, embs.astype("float32").tobytes())
+            _append_durable(META_PATH, meta_blob)
+            man["rows"] += len(batch)
+            man["meta_bytes"] += len(meta_blob)
+            self.embedded += len(batch)
+            print(f"[embed] committed {man['rows']} rows (+{len(batch)})")
+
+        rows = man["rows"]
+        while self.open_docs and self.open_docs[0][2] <= rows:
+            p, s, e = self.open_docs.popleft()
+            man["docs"][p] = self.entries[p] | {"chunk_ids": [s, e], "stats": self.counts.pop(p)}
+            if man.get("pending") and man["pending"]["path"] == p:
+                man["pending"] = None
+        if self.open_docs and self.open_docs[0][1] < rows:
+            p, s, _ = self.open_docs[0]
+            man["pending"] = {"path": p, "sha256": self.entries[p]["sha256"], "chunk_ids": [s, rows]}
+        save_manifest(man)
+
+def run_ingest(full: bool = False, workers: int = INGEST_WORKERS, index_type: str = INDEX_TYPE,
+               eval_queries: Optional[str] = None, shards: int = INDEX_SHARDS, embed_model: str = EMBED_BACKEND_ID,
+               storage: str = INDEX_STORAGE, dims: Optional[int] = EMBED_DIMS):
+    ensure_dirs()
+    pdfs = sorted(os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.lower().endswith(".pdf"))
+
+    man = open_store(empty_manifest(embed_model) if full else load_manifest(embed_model))
+    man = resize_store(man, dims)
+    print(f"Embedding backend: {embed_model}{f' at {dims} dims' if dims else ''}")
+
+    entries, dirty, clean, removed = diff_manifest(pdfs, man)
+    print(f"Found {len(pdfs)} PDFs: {len(dirty)} new/changed, {len(clean)} unchanged, {len(removed)} removed")
+
+    # Chunks of removed/changed PDFs (and of a partly committed PDF that has since changed) are tombstoned.
+    dead = [tuple(man["docs"][p]["chunk_ids"]) for p in removed + dirty if p in man["docs"]]
+    for p in removed + dirty:
+        man["docs"].pop(p, None)
+    pend = man.get("pending")
+    if pend and (pend["path"] not in entries or entries[pend["path"]]["sha256"] != pend["sha256"]):
+        dead.append(tuple(pend["chunk_ids"]))
+        man["pending"] = None
+    compact_store(man, dead)
+    for p in clean:
+        # refresh stat info so the next run can skip hashing; chunk ids and stats counts carry over
+        old = man["docs"][p]
+        man["docs"][p] = entries[p] | {k: old[k] for k in ("chunk_ids", "stats") if k in old}
+
+    if man.get("pending"):
+        # resume the partly committed PDF first so its ids continue where the last run stopped
+        dirty.remove(man["pending"]["path"])
+        dirty.insert(0, man["pending"]["path"])
+        print(f"Resuming {man['pending']['path']} at chunk {man['pending']['chunk_ids'][1]}")
+
+    writer = StoreWriter(man, entries)
+    per: Dict[int, Dict[str, float]] = {}
+    t_parse = time.perf_counter()
+    for p, recs, stats in stream_parsed(dirty, workers):
+        _accumulate(per, stats)
+        writer.add_doc(p, recs)
+    writer.flush()
+    if per:
+        report_throughput(per, time.perf_counter() - t_parse)
+    if writer.embedded:
+        tp = get_embed_backend(embed_model).stats()["throughput"]
+        print(f"[embed] {embed_model}: {tp['texts']} texts in {tp['seconds']}s "
+              f"({tp['texts_per_s']} texts/s, {tp['tokens_per_s']} tokens/s)")
+
+    if man["rows"] == 0:
+        _remove_legacy()
+        if os.path.exists(os.path.join(IDX_DIR, CURRENT)):
+            os.remove(os.path.join(IDX_DIR, CURRENT))
+        print("No content parsed. Exiting.")
+        return
+    params = index_params(index_type, man["rows"], storage)
+    if man["indexed_rows"] == man["rows"] and man.get("index") == params and man.get("shards", 1) == shards \
+            and man.get("index_version") and read_current(IDX_DIR) == man["index_version"]:
+        print("Index is up to date.")
+        return
 
-    print(f"Done. {index.ntotal} vectors indexed.")
+    index = build_index(man, params, shards)
+    save_manifest(man)
+    if index is not None:
+        write_report(man, index, eval_queries)
+    print(f"Done. {man['rows']} vectors indexed{f' in {shards} shards' if shards > 1 else ''} "
+          f"({writer.embedded} newly embedded).")
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Build / refresh the FAISS index from data/pdfs")
+    ap.add_argument("--full", action="store_true", help="ignore the manifest and rebuild everything")
+    ap.add_argument("--workers", type=int, default=INGEST_WORKERS,
+                    help="parser processes (default: INGEST_WORKERS or CPU count)")
+    ap.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE,
+                    help="FAISS index to build (default: INDEX_TYPE or flat)")
+    ap.add_argument("--storage", choices=INDEX_STORAGES, default=INDEX_STORAGE,
+                    help="vector codes kept in the index; compressed ones are re-ranked exactly (default: INDEX_STORAGE or f32)")
+    ap.add_argument("--shards", type=int, default=INDEX_SHARDS,
+                    help="split the index into N shards by document (default: INDEX_SHARDS or 1)")
+    ap.add_argument("--embed-backend", choices=BACKENDS, default=None,
+                    help="embedding backend for this index (default: EMBED_BACKEND or openai); switching re-embeds")
+    ap.add_argument("--dims", type=int, default=EMBED_DIMS or 0,
+                    help="store vectors shortened to N dims, projecting wider stored ones (default: EMBED_DIMS or full)")
+    ap.add_argument("--eval-queries", default=None,
+                    help="text file with one query per line for the recall/latency report (default: synthetic)")
+    args = ap.parse_args()
     t0 = time.time()
-    run_ingest()
+    run_ingest(full=args.full, workers=args.workers, index_type=args.index_type, eval_queries=args.eval_queries,
+               shards=max(1, args.shards), storage=args.storage, dims=args.dims or None,
+               embed_model=configured_backend_id(args.embed_backend, EMBED_MODEL) if args.embed_backend else EMBED_BACKEND_ID)
     print(f"Ingest finished in {time.time()-t0:.1f}s")
@@ -0,0 +1,54 @@
+# mem_usage.py
+"""
+Per-process memory accounting from /proc (Linux; None elsewhere).
+
+Pages count as shared once another process maps them too -- with INDEX_LOAD=mmap, the other uvicorn workers
+serving the same index files -- and as private otherwise (Python objects, FAISS structures read into RAM).
+"""
+import os
+from typing import Any, Dict, Optional
+
+_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Anonymous")
+
+def _mb(kb: int) -> float:
+    return round(kb / 1024, 1)
+
+def _add(acc: Dict[str, int], line: str):
+    key, _, rest = line.partition(":")
+    if key in _FIELDS:
+        acc[key] = acc.get(key, 0) + int(rest.split()[0])
+
+def _summary(kb: Dict[str, int]) -> Dict[str, float]:
+    return {
+        "rss_mb": _mb(kb.get("Rss", 0)),
+        "pss_mb": _mb(kb.get("Pss", 0)),
+        "private_mb": _mb(kb.get("Private_Clean", 0) + kb.get("Private_Dirty", 0)),
+        "shared_mb": _mb(kb.get("Shared_Clean", 0) + kb.get("Shared_Dirty", 0)),
+    }
+
+def memory_usage(mapped_under: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Resident memory of this process split into private / shared pages (pss = this process' fair share).
+    With `mapped_under`, also the part that is mapped from files below that directory.
+    """
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            total: Dict[str, int] = {}
+            for line in f:
+                _add(total, line)
+    except OSError:
+        return None
+    out: Dict[str, Any] = {"pid": os.getpid(), **_summary(total), "anon_mb": _mb(total.get("Anonymous", 0))}
+    if mapped_under:
+        root = os.path.realpath(mapped_under) + os.sep
+        files: Dict[str, int] = {}
+        inside = False
+        with open("/proc/self/smaps", "r") as f:
+            for line in f:
+                head = line.split(None, 5)
+                if "-" in head[0] and not head[0].endswith(":"):  # mapping header: range perms offset dev inode [path]
+                    inside = len(head) == 6 and head[5].strip().startswith(root)
+                elif inside:
+                    _add(files, line)
+        out["index_files"] = _summary(files)
+    return out
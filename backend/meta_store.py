@@ -0,0 +1,446 @@
+# meta_store.py
+"""
+Compact, memory-mapped chunk metadata, written by ingest next to index.faiss and opened read-only by the app.
+
+data/index/chunks/
+  labels.json      {facet: [label, ...]}          vocabulary order used by the codes / bitsets
+  docs.json        [{"path", "title"}, ...]         one entry per document; chunks refer to it by id
+  doc.npy          int32   document id per chunk
+  page.npy         int32   page per chunk
+  year.npy         int16   publication year (-1 = unknown)
+  <facet>.npy      int8    top label code per facet (-1 = none)
+  facet_bits.npy   uint32  [N, n_facets] multi-label bitsets
+  text_off.npy     int64   N+1 byte offsets into text.bin
+  text.bin         utf-8 chunk texts back to back
+  stats.json       facet / document counts and cross-facet breakdowns (see compute_stats)
+
+Columns are opened with np.load(mmap_mode="r"), so startup cost does not depend on corpus size and every
+worker process shares the same page cache. Text is only decoded for rows that are actually returned.
+"""
+import os, re, json, mmap, threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+STORE_VERSION = 1
+_PAIR_FACETS = ("organism", "stressor")
+_COMBO_MASKS = 32  # multi-facet filter masks kept (LRU); single-label masks are bounded by the vocabulary
+
+def _ranked(labels: List[str], counts: np.ndarray) -> List[Tuple[str, int]]:
+    order = np.argsort(-counts, kind="stable")
+    return [(labels[i], int(counts[i])) for i in order if counts[i] > 0]
+
+def _year(r: Dict[str, Any]) -> int:
+    try:
+        return int(r.get("year"))
+    except (TypeError, ValueError):
+        return -1
+
+def _render_stats(labels: Dict[str, List[str]], chunks: int, n_docs: int, facet_counts: Dict[str, np.ndarray],
+                  doc_counts: Dict[str, np.ndarray], grid: Optional[np.ndarray],
+                  years: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    """stats.json from label-indexed count vectors; years: {year: {"chunks", "documents", facet: counts}}."""
+    out: Dict[str, Any] = {"chunks": int(chunks), "documents": int(n_docs), "facets": {}, "documents_by_facet": {}}
+    for f in labels:
+        out["facets"][f] = _ranked(labels[f], facet_counts[f])
+        out["documents_by_facet"][f] = _ranked(labels[f], doc_counts[f])
+    a, b = _PAIR_FACETS
+    if grid is not None:
+        out[f"{a}_x_{b}"] = {labels[a][i]: dict(_ranked(labels[b], grid[i])) for i in np.flatnonzero(grid.sum(1))}
+    by_year: Dict[str, Any] = {}
+    for y in sorted(years):
+        e = years[y]
+        entry: Dict[str, Any] = {"chunks": int(e["chunks"]), "documents": int(e["documents"])}
+        for f in labels:
+            entry[f] = dict(_ranked(labels[f], e[f]))
+        by_year[str(y) if y >= 0 else "unknown"] = entry
+    out["by_year"] = by_year
+    return out
+
+def compute_stats(doc: np.ndarray, year: np.ndarray, codes: Dict[str, np.ndarray],
+                  labels: Dict[str, List[str]], n_docs: int) -> Dict[str, Any]:
+    """
+    Counts over the top label of each chunk, computed with bincounts over the columns:
+    per facet (chunks and distinct documents), organism x stressor, and per publication year.
+    """
+    facet_counts, doc_counts = {}, {}
+    for f in labels:
+        c = np.asarray(codes[f]).astype(np.int64)
+        L = len(labels[f])
+        has = c >= 0
+        facet_counts[f] = np.bincount(c[has], minlength=L)
+        # distinct (doc, label) pairs -> documents per label
+        pairs = np.unique(np.asarray(doc)[has].astype(np.int64) * max(L, 1) + c[has])
+        doc_counts[f] = np.bincount(pairs % max(L, 1), minlength=L)
+
+    grid = None
+    a, b = _PAIR_FACETS
+    if a in labels and b in labels:
+        ca, cb = np.asarray(codes[a]).astype(np.int64), np.asarray(codes[b]).astype(np.int64)
+        La, Lb = len(labels[a]), len(labels[b])
+        has = (ca >= 0) & (cb >= 0)
+        grid = np.bincount(ca[has] * Lb + cb[has], minlength=La * Lb).reshape(La, Lb)
+
+    years: Dict[int, Dict[str, Any]] = {}
+    yr = np.asarray(year).astype(np.int64)
+    for y in np.unique(yr):
+        sel = yr == y
+        e: Dict[str, Any] = {"chunks": int(sel.sum()), "documents": int(len(np.unique(np.asarray(doc)[sel])))}
+        for f in labels:
+            c = np.asarray(codes[f])[sel].astype(np.int64)
+            e[f] = np.bincount(c[c >= 0], minlength=len(labels[f]))
+        years[int(y)] = e
+    return _render_stats(labels, int(doc.shape[0]), n_docs, facet_counts, doc_counts, grid, years)
+
+def new_doc_counts(facets: List[str]) -> Dict[str, Any]:
+    """
+    One document's share of stats.json, kept in the ingest manifest so the stats of a new index version are
+    the sum of these (see stats_from_counts) instead of a pass over every chunk:
+    {"facets": [...], "years": {year: {"chunks": n, facet: {label: n}}}, "pairs": {organism: {stressor: n}}}.
+    Labels are stored as strings, so a changed vocabulary only drops the ones it no longer knows.
+    """
+    return {"facets": list(facets), "years": {}, "pairs": {}}
+
+def count_row(counts: Dict[str, Any], r: Dict[str, Any]):
+    """Add one meta.jsonl row to a document's counts."""
+    e = counts["years"].setdefault(str(_year(r)), {"chunks": 0})
+    e["chunks"] += 1
+    for f in counts["facets"]:
+        lab = r.get(f)
+        if lab:
+            per = e.setdefault(f, {})
+            per[lab] = per.get(lab, 0) + 1
+    a, b = (r.get(f) for f in _PAIR_FACETS)
+    if a and b and all(f in counts["facets"] for f in _PAIR_FACETS):
+        per = counts["pairs"].setdefault(a, {})
+        per[b] = per.get(b, 0) + 1
+
+def doc_counts(rows: List[Dict[str, Any]], facets: List[str]) -> Dict[str, Any]:
+    counts = new_doc_counts(facets)
+    for r in rows:
+        count_row(counts, r)
+    return counts
+
+def stats_from_counts(per_doc: List[Dict[str, Any]], labels: Dict[str, List[str]]) -> Dict[str, Any]:
+    """stats.json (same as compute_stats over the written store) from the per-document counts."""
+    code = {f: {lab: i for i, lab in enumerate(labels[f])} for f in labels}
+    facet_counts = {f: np.zeros(len(labels[f]), dtype=np.int64) for f in labels}
+    doc_totals = {f: np.zeros(len(labels[f]), dtype=np.int64) for f in labels}
+    a, b = _PAIR_FACETS
+    grid = np.zeros((len(labels[a]), len(labels[b])), dtype=np.int64) if a in labels and b in labels else None
+    years: Dict[int, Dict[str, Any]] = {}
+    chunks = n_docs = 0
+    for counts in per_doc:
+        if not counts["years"]:
+            continue  # a document without chunks is not in the store
+        n_docs += 1
+        seen = {f: np.zeros(len(labels[f]), dtype=bool) for f in labels}
+        for y, e in counts["years"].items():
+            agg = years.setdefault(int(y), {"chunks": 0, "documents": 0,
+                                            **{f: np.zeros(len(labels[f]), dtype=np.int64) for f in labels}})
+            agg["chunks"] += e["chunks"]
+            agg["documents"] += 1
+            chunks += e["chunks"]
+            for f in labels:
+                for lab, n in e.get(f, {}).items():
+                    i = code[f].get(lab)
+                    if i is not None:
+                        agg[f][i] += n
+                        facet_counts[f][i] += n
+                        seen[f][i] = True
+        for f in labels:
+            doc_totals[f] += seen[f]
+        if grid is not None:
+            for la, per in counts["pairs"].items():
+                i = code[a].get(la)
+                for lb, n in per.items():
+                    j = code[b].get(lb)
+                    if i is not None and j is not None:
+                        grid[i, j] += n
+    return _render_stats(labels, chunks, n_docs, facet_counts, doc_totals, grid, years)
+
+def write_chunk_store(meta_path: str, out_dir: str, labels: Dict[str, List[str]],
+                      stats: Optional[Dict[str, Any]] = None):
+    """
+    Stream meta.jsonl into the columnar layout (written to out_dir.tmp, then renamed). `stats` are written as
+    given (ingest sums them from per-document counts); without them they are computed from the new columns.
+    """
+    tmp = out_dir + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    facets = list(labels)
+    code = {f: {lab: i for i, lab in enumerate(labels[f])} for f in facets}
+    doc_ids: Dict[str, int] = {}
+    docs: List[Dict[str, Any]] = []
+    doc_col, page_col, year_col = array("i"), array("i"), array("h")
+    facet_cols = {f: array("b") for f in facets}
+    bits_col = array("I")
+    offs = array("q", [0])
+    with open(meta_path, "r", encoding="utf-8") as src, open(os.path.join(tmp, "text.bin"), "wb") as tf:
+        for line in src:
+            if not line.strip():
+                continue
+            r = json.loads(line)
+            p = r.get("doc_path") or ""
+            if p not in doc_ids:
+                doc_ids[p] = len(docs)
+                docs.append({"path": p, "title": r.get("doc_title") or ""})
+            doc_col.append(doc_ids[p])
+            page_col.append(int(r.get("page_start") or 0))
+            year_col.append(_year(r))
+            for f in facets:
+                facet_cols[f].append(code[f].get(r.get(f), -1))
+            bits = r.get("facet_bits")
+            for fi, f in enumerate(facets):
+                if bits is not None:
+                    bits_col.append(bits[fi])
+                else:
+                    c = code[f].get(r.get(f))
+                    bits_col.append(0 if c is None else 1 << c)
+            blob = (r.get("text") or "").encode("utf-8")
+            tf.write(blob)
+            offs.append(offs[-1] + len(blob))
+
+    n = len(doc_col)
+    np.save(os.path.join(tmp, "doc.npy"), np.frombuffer(doc_col, dtype=np.int32) if n else np.zeros(0, np.int32))
+    np.save(os.path.join(tmp, "page.npy"), np.frombuffer(page_col, dtype=np.int32) if n else np.zeros(0, np.int32))
+    np.save(os.path.join(tmp, "year.npy"), np.frombuffer(year_col, dtype=np.int16) if n else np.zeros(0, np.int16))
+    for f in facets:
+        np.save(os.path.join(tmp, f"{f}.npy"), np.frombuffer(facet_cols[f], dtype=np.int8) if n else np.zeros(0, np.int8))
+    bits = np.frombuffer(bits_col, dtype=np.uint32).reshape(n, len(facets)) if n else np.zeros((0, len(facets)), np.uint32)
+    np.save(os.path.join(tmp, "facet_bits.npy"), bits)
+    np.save(os.path.join(tmp, "text_off.npy"), np.frombuffer(offs, dtype=np.int64))
+    with open(os.path.join(tmp, "docs.json"), "w", encoding="utf-8") as f:
+        json.dump(docs, f, ensure_ascii=False)
+    with open(os.path.join(tmp, "labels.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": STORE_VERSION, "rows": n, "labels": labels}, f, ensure_ascii=False)
+    if stats is None:
+        stats = compute_stats(
+            np.load(os.path.join(tmp, "doc.npy"), mmap_mode="r"), np.load(os.path.join(tmp, "year.npy"), mmap_mode="r"),
+            {f: np.load(os.path.join(tmp, f"{f}.npy"), mmap_mode="r") for f in facets}, labels, len(docs))
+    with open(os.path.join(tmp, "stats.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False)
+
+    if os.path.exists(out_dir):
+        old = out_dir + ".old"
+        os.replace(out_dir, old)
+        os.replace(tmp, out_dir)
+        for name in os.listdir(old):
+            os.remove(os.path.join(old, name))
+        os.rmdir(old)
+    else:
+        os.replace(tmp, out_dir)
+
+class ChunkStore:
+    """
+    Read-only view over a chunk store directory. Indexing returns the same dicts meta.jsonl holds;
+    the filter / sort / count primitives work on numpy id arrays and never build per-row dicts.
+    """
+    def __init__(self, path: Optional[str], labels: Optional[Dict[str, List[str]]] = None):
+        self.path = path
+        if path is None:
+            # empty store (no index built yet)
+            self.labels = labels or {}
+            self.facets = list(self.labels)
+            self.docs: List[Dict[str, Any]] = []
+            self.doc = np.zeros(0, np.int32)
+            self.page = np.zeros(0, np.int32)
+            self.year = np.zeros(0, np.int16)
+            self.codes = {f: np.zeros(0, np.int8) for f in self.facets}
+            self.facet_bits = np.zeros((0, len(self.facets)), np.uint32)
+            self.text_off = np.zeros(1, np.int64)
+            self._text_f = None
+            self._text: Any = b""
+            self._init_docs()
+            self.stats = compute_stats(self.doc, self.year, self.codes, self.labels, 0)
+            return
+        with open(os.path.join(path, "labels.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        self.labels = info["labels"]
+        self.facets = list(self.labels)
+        with open(os.path.join(path, "docs.json"), "r", encoding="utf-8") as f:
+            self.docs = json.load(f)
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.doc = load("doc")
+        self.page = load("page")
+        self.year = load("year")
+        self.codes = {f: load(f) for f in self.facets}
+        self.facet_bits = load("facet_bits")
+        self.text_off = load("text_off")
+        self._text_f = open(os.path.join(path, "text.bin"), "rb")
+        size = os.fstat(self._text_f.fileno()).st_size
+        self._text = mmap.mmap(self._text_f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._init_docs()
+        stats_path = os.path.join(path, "stats.json")
+        if os.path.exists(stats_path):
+            with open(stats_path, "r", encoding="utf-8") as f:
+                self.stats = json.load(f)
+        else:  # store written before stats.json existed
+            self.stats = compute_stats(self.doc, self.year, self.codes, self.labels, len(self.docs))
+
+    def _init_docs(self):
+        self._masks: Dict[tuple, np.ndarray] = {}  # (facet, label) -> row mask, known labels only
+        self._combos: "OrderedDict[tuple, np.ndarray]" = OrderedDict()  # ((facet, label), ...) -> row mask
+        self._masks_lock = threading.Lock()
+        paths = [d["path"] for d in self.docs]
+        self._doc_id = {p: i for i, p in enumerate(paths)}
+        # rank of each document's path, so sorting chunks by path is an integer argsort
+        self._path_rank = np.empty(len(paths), dtype=np.int32)
+        self._path_rank[np.argsort(np.array(paths, dtype=object), kind="stable")] = np.arange(len(paths), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return int(self.doc.shape[0])
+
+    def text(self, i: int) -> str:
+        return self._text[int(self.text_off[i]):int(self.text_off[i + 1])].decode("utf-8")
+
+    def label(self, facet: str, i: int) -> Optional[str]:
+        c = int(self.codes[facet][i])
+        return self.labels[facet][c] if c >= 0 else None
+
+    def row(self, i: int, text: bool = True) -> Dict[str, Any]:
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        d = self.docs[int(self.doc[i])]
+        y = int(self.year[i])
+        page = int(self.page[i])
+        r: Dict[str, Any] = {
+            "id": i,
+            "doc_path": d["path"],
+            "doc_title": d["title"],
+            "year": str(y) if y >= 0 else None,
+            "page_start": page,
+            "page_end": page,
+        }
+        for f in self.facets:
+            r[f] = self.label(f, i)
+        r["facet_bits"] = [int(b) for b in self.facet_bits[i]]
+        if text:
+            r["text"] = self.text(i)
+        return r
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        return self.row(int(i))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self.iter_rows()
+
+    def iter_rows(self, text: bool = True) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self.row(i, text=text)
+
+    def rows(self, ids, text: bool = True) -> List[Dict[str, Any]]:
+        return [self.row(int(i), text=text) for i in ids]
+
+    # ---------- vectorised primitives ----------
+    def all_ids(self) -> np.ndarray:
+        return np.arange(len(self), dtype=np.int64)
+
+    def label_bit(self, facet: str, label: str) -> int:
+        labels = self.labels.get(facet, [])
+        return 1 << labels.index(label) if label in labels else 0
+
+    def facet_mask(self, facet: str, label: str) -> np.ndarray:
+        """
+        Boolean row mask of chunks carrying `label` (cached per label; the store is immutable). Labels outside
+        the vocabulary match nothing and are not cached, so arbitrary filter values cannot grow the cache.
+        """
+        bit = self.label_bit(facet, label) if facet in self.facets else 0
+        if not bit:
+            return np.zeros(len(self), dtype=bool)
+        key = (facet, label)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = (self.facet_bits[:, self.facets.index(facet)] & bit) != 0
+            with self._masks_lock:
+                mask = self._masks.setdefault(key, mask)
+        return mask
+
+    def filter_mask(self, organism: Optional[str] = None, stressor: Optional[str] = None,
+                    platform: Optional[str] = None) -> Optional[np.ndarray]:
+        """AND of the requested facet masks (recent combinations cached), or None when no filter is set."""
+        wanted = {"organism": organism, "stressor": stressor, "platform": platform}
+        parts = [(f, wanted[f]) for f in self.facets if wanted.get(f)]
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return self.facet_mask(*parts[0])
+        if not all(self.label_bit(f, label) for f, label in parts):
+            return np.zeros(len(self), dtype=bool)
+        key = tuple(parts)
+        with self._masks_lock:
+            mask = self._combos.get(key)
+            if mask is not None:
+                self._combos.move_to_end(key)
+                return mask
+        mask = self.facet_mask(*parts[0])
+        for f, label in parts[1:]:
+            mask = mask & self.facet_mask(f, label)
+        with self._masks_lock:
+            self._combos[key] = mask
+            while len(self._combos) > _COMBO_MASKS:
+                self._combos.popitem(last=False)
+        return mask
+
+    def filter_ids(self, ids: np.ndarray, organism: Optional[str] = None, stressor: Optional[str] = None,
+                   platform: Optional[str] = None) -> np.ndarray:
+        """Keep ids whose multi-label facet bitsets contain every requested label (order preserved)."""
+        mask = self.filter_mask(organism, stressor, platform)
+        return ids if mask is None else ids[mask[ids]]
+
+    def ids_for_paths(self, paths: List[str]) -> np.ndarray:
+        doc_ids = [self._doc_id[p] for p in paths if p in self._doc_id]
+        return np.nonzero(np.isin(self.doc, doc_ids))[0]
+
+    def match_text(self, ids: np.ndarray, needle: str) -> np.ndarray:
+        """
+        Case-insensitive (casefold) substring match on title / path (per document) or chunk text. An ASCII
+        needle is found by the regex engine directly over the mmap'd text blob, skipping to the next chunk after
+        each hit; that folds ASCII case only, so "strasse" does not find "Straße". A needle with non-ASCII
+        characters is compared against the casefolded text of each chunk in `ids`.
+        """
+        ascii_needle = needle.isascii()
+        needle = needle.casefold().strip()
+        if not needle:
+            return ids
+        doc_hit = np.array([needle in d["title"].casefold() or needle in d["path"].casefold() for d in self.docs],
+                           dtype=bool)
+        hit = np.zeros(len(self), dtype=bool)
+        if doc_hit.any():
+            hit |= doc_hit[self.doc]
+        if not ascii_needle:
+            for i in ids[~hit[ids]].tolist():
+                hit[i] = needle in self.text(i).casefold()
+            return ids[hit[ids]]
+        rx = re.compile(re.escape(needle.encode("utf-8")), re.IGNORECASE)
+        pos, end = 0, len(self._text)
+        while pos < end:
+            m = rx.search(self._text, pos)
+            if m is None:
+                break
+            i = int(np.searchsorted(self.text_off, m.start(), side="right")) - 1
+            if m.end() <= self.text_off[i + 1]:
+                hit[i] = True
+                pos = int(self.text_off[i + 1])
+            else:  # match straddles two chunks
+                pos = m.start() + 1
+        return ids[hit[ids]]
+
+    def sort_ids(self, ids: np.ndarray, by: str, desc: bool = False) -> np.ndarray:
+        """Stable sort by 'year' (unknown years last when descending) or 'path'."""
+        key = self.year[ids].astype(np.int32) if by == "year" else self._path_rank[self.doc[ids]]
+        if desc:
+            key = -key
+        return ids[np.argsort(key, kind="stable")]
+
+    def facet_counts(self, facet: str, ids: Optional[np.ndarray] = None) -> List[Tuple[str, int]]:
+        """(label, chunk count) for the top label of each chunk, most common first."""
+        codes = self.codes[facet] if ids is None else self.codes[facet][ids]
+        counts = np.bincount(codes[codes >= 0].astype(np.int64), minlength=len(self.labels[facet]))
+        return _ranked(self.labels[facet], counts)
+
+    def close(self):
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
+        if self._text_f is not None:
+            self._text_f.close()
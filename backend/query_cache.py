@@ -0,0 +1,160 @@
+# query_cache.py
+"""
+In-process LRU + TTL cache of query embeddings, in front of embed_texts().
+
+Queries are normalised (NFKC, whitespace collapsed) into the cache key, and the key is what gets embedded, so
+"Bone loss " and "Bone  loss" share one entry. Case is kept: "ISS" and "iss" are separate entries, and
+case-sensitive terms such as gene names reach the model intact. A miss can be served by an optional shared tier so every
+uvicorn worker benefits: Redis when QUERY_CACHE_REDIS_URL is set (and the redis package is installed);
+the on-disk embedding cache (embed_cache.py) sits behind that in embed_texts() either way.
+"""
+import os, time, hashlib, threading, unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+try:
+    import redis  # type: ignore
+except Exception:  # pragma: no cover
+    redis = None
+
+QUERY_CACHE_SIZE      = int(os.getenv("QUERY_CACHE_SIZE", "2048"))     # entries; 0 disables the cache
+QUERY_CACHE_TTL       = float(os.getenv("QUERY_CACHE_TTL", "3600"))    # seconds; 0 = no expiry
+QUERY_CACHE_REDIS_URL = os.getenv("QUERY_CACHE_REDIS_URL", "").strip()
+
+def normalize_query(q: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", q or "").split())
+
+class QueryEmbeddingCache:
+    def __init__(self, embed: Callable[[List[str]], np.ndarray], model: str, size: int = QUERY_CACHE_SIZE,
+                 ttl: float = QUERY_CACHE_TTL, redis_url: str = QUERY_CACHE_REDIS_URL):
+        self.embed = embed
+        self.model = model
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                print("[query-cache] QUERY_CACHE_REDIS_URL set but redis is not installed; using the local cache only")
+            else:
+                self._redis = redis.Redis.from_url(redis_url)
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.errors = 0
+
+    def _shared_key(self, norm: str) -> str:
+        return f"qemb:{self.model}:{hashlib.sha256(norm.encode('utf-8')).hexdigest()}"
+
+    def _count(self, counter: str, n: int = 1):
+        with self._lock:  # request threads share the counters
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def _get_local(self, norm: str) -> Optional[np.ndarray]:
+        with self._lock:
+            e = self._lru.get(norm)
+            if e is None:
+                return None
+            if self.ttl and time.monotonic() - e[0] > self.ttl:
+                del self._lru[norm]
+                self.expired += 1
+                return None
+            self._lru.move_to_end(norm)
+            return e[1]
+
+    def _put_local(self, norm: str, vec: np.ndarray):
+        with self._lock:
+            self._lru[norm] = (time.monotonic(), vec)
+            self._lru.move_to_end(norm)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def _get_shared(self, norm: str) -> Optional[np.ndarray]:
+        if self._redis is None:
+            return None
+        try:
+            raw = self._redis.get(self._shared_key(norm))
+        except Exception:
+            self._count("errors")  # shared tier down: fall through to embedding
+            return None
+        return None if raw is None else np.frombuffer(raw, dtype="float32").copy()
+
+    def _put_shared(self, norm: str, vec: np.ndarray):
+        if self._redis is None:
+            return
+        try:
+            key = self._shared_key(norm)
+            if self.ttl:
+                self._redis.setex(key, int(self.ttl), vec.astype("float32").tobytes())
+            else:
+                self._redis.set(key, vec.astype("float32").tobytes())
+        except Exception:
+            self._count("errors")
+
+    def get(self, query: str) -> np.ndarray:
+        """(1, dim) float32 embedding of the query, cached under its normalised form."""
+        norm = normalize_query(query)
+        vec = self._get_local(norm)
+        if vec is not None:
+            self._count("hits")
+            return vec[None, :]
+        vec = self._get_shared(norm)
+        if vec is not None:
+            self._count("shared_hits")
+        else:
+            self._count("misses")
+            vec = np.asarray(self.embed([norm]), dtype="float32")[0]
+            self._put_shared(norm, vec)
+        vec.setflags(write=False)  # shared between requests
+        self._put_local(norm, vec)
+        return vec[None, :]
+
+    def get_many(self, queries: List[str]) -> np.ndarray:
+        """(n, dim) embeddings; everything not cached locally or in the shared tier goes out in one call."""
+        norms = [normalize_query(q) for q in queries]
+        found: Dict[str, np.ndarray] = {}
+        missing: List[str] = []
+        for norm in dict.fromkeys(norms):
+            vec = self._get_local(norm)
+            if vec is not None:
+                self._count("hits")
+            else:
+                vec = self._get_shared(norm)
+                if vec is not None:
+                    self._count("shared_hits")
+                else:
+                    missing.append(norm)
+                    continue
+            found[norm] = vec
+        if missing:
+            self._count("misses", len(missing))
+            vecs = np.asarray(self.embed(missing), dtype="float32")
+            for norm, vec in zip(missing, vecs):
+                self._put_shared(norm, vec)
+                found[norm] = vec
+        for norm, vec in found.items():
+            vec.setflags(write=False)
+            self._put_local(norm, vec)
+        return np.stack([found[n] for n in norms])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._lru)
+            hits, shared_hits, misses = self.hits, self.shared_hits, self.misses
+            expired, errors = self.expired, self.errors
+        total = hits + shared_hits + misses
+        return {
+            "entries": entries,
+            "max_entries": self.size,
+            "ttl_s": self.ttl,
+            "shared": "redis" if self._redis is not None else None,
+            "hits": hits,
+            "shared_hits": shared_hits,
+            "misses": misses,
+            "expired": expired,
+            "shared_errors": errors,
+            "hit_rate": round((hits + shared_hits) / total, 4) if total else None,
+        }
@@ -1,16 +1,21 @@
 # rag_core.py
-import os, re, json, math
+import os, re, json, math, bisect, hashlib, threading
 from typing import List, Dict, Any, Tuple, Optional
 import numpy as np
 import fitz  # PyMuPDF
 import tiktoken
 from dotenv import load_dotenv
 from openai import OpenAI
-# Load .env as early as possible (so OPENAI_API_KEY is present)
+# Load .env as early as possible (so OPENAI_API_KEY and the EMBED_* settings read below are present)
 load_dotenv()
+from embed_cache import EmbeddingCache, EMBED_CACHE_MB
+from embed_backends import EMBED_BACKEND, configured_backend_id, make_backend, project
+from query_cache import QueryEmbeddingCache, QUERY_CACHE_SIZE
 
 # ---- Config (env overrides allowed) ----
-EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")  # OpenAI model of the openai backend
+EMBED_BACKEND_ID = configured_backend_id(EMBED_BACKEND, EMBED_MODEL)  # what ingest embeds new indexes with
+EMBED_DIMS = int(os.getenv("EMBED_DIMS", "0")) or None  # width new indexes store (truncate + re-normalise); 0 = full
 CHAT_MODEL  = os.getenv("CHAT_MODEL",  "gpt-4o-mini")
 CHUNK_TOKENS  = 900
 CHUNK_OVERLAP = 200
@@ -54,45 +59,65 @@ PLATFORMS: Dict[str, List[str]] = {
 def tokenize_len(text: str) -> int:
     return len(_enc.encode(text))
 
+# Section headings / blank lines: preferred chunk boundaries
+_PIECE_SPLIT = re.compile(r"\n\s*(?=[A-Z][A-Za-z0-9 ()\-]{2,50}\n)|\n{2,}")
+
 def chunk_text(text: str, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP) -> List[str]:
-    candidates = re.split(r"\n\s*(?=[A-Z][A-Za-z0-9 ()\-]{2,50}\n)|\n{2,}", text)
-    chunks, buff = [], ""
-    for piece in candidates:
-        piece = piece.strip()
-        if not piece:
+    """
+    Split a page into chunks of at most ~max_tokens tokens, each repeating the last `overlap` tokens
+    of the previous chunk. The page is tokenised once; sections (headings / blank lines) are packed
+    greedily by token offsets and oversized sections are cut at word starts, so the cost is linear
+    in the page length.
+    """
+    ids = _enc.encode_ordinary(text)
+    if not ids:
+        return [text[:2000]]
+    text, offs = _enc.decode_with_offsets(ids)
+    n = len(ids)
+    overlap = max(0, min(overlap, max_tokens // 2))
+    budget = max(1, max_tokens - overlap)
+
+    def char_at(j: int) -> int:
+        return offs[j] if j < n else len(text)
+
+    def word_start(j: int, lo: int, hi: int, step: int) -> int:
+        """Nearest token index from j towards the other bound that begins a word (j if none)."""
+        k = j
+        while lo <= k <= hi:
+            if k == 0 or k >= n or text[offs[k]:offs[k] + 1].isspace():
+                return k
+            k += step
+        return j
+
+    cuts = sorted({bisect.bisect_left(offs, m.end()) for m in _PIECE_SPLIT.finditer(text)} | {n})
+    bodies: List[Tuple[int, int]] = []
+    s = e = 0
+    for c in cuts:
+        if c - s <= budget:
+            e = c
+            continue
+        if e > s:
+            bodies.append((s, e))
+            s = e
+        while c - s > budget:
+            # never back to s itself: with a budget of 1 the window would stop moving
+            cut = word_start(s + budget, s + max(1, budget // 2), s + budget, -1)
+            bodies.append((s, cut))
+            s = cut
+        e = c
+    if e > s:
+        bodies.append((s, e))
+
+    chunks: List[str] = []
+    for s, e in bodies:
+        body = text[char_at(s):char_at(e)].strip()
+        if not body:
             continue
-        if tokenize_len(buff + ("\n" if buff else "") + piece) <= max_tokens:
-            buff = (buff + ("\n" if buff else "") + piece).strip()
-        else:
-            if buff:
-                chunks.append(buff)
-            if tokenize_len(piece) <= max_tokens:
-                buff = piece
-            else:
-                words = piece.split()
-                start = 0
-                step = 300
-                while start < len(words):
-                    sub = " ".join(words[start:start+step])
-                    chunks.append(sub)
-                    start += (step - max(0, overlap // 3))
-                buff = ""
-    if buff:
-        chunks.append(buff)
-
-    final: List[str] = []
-    for i, c in enumerate(chunks):
-        if i == 0:
-            final.append(c)
-        else:
-            prev = final[-1]
-            tail = " ".join(prev.split()[-120:])
-            merged = (tail + "\n" + c).strip()
-            if tokenize_len(merged) <= max_tokens:
-                final[-1] = merged
-            else:
-                final.append(c)
-    return final or [text[:2000]]
+        start = s
+        if chunks and overlap:
+            start = word_start(max(0, s - overlap), max(0, s - overlap), s, 1)
+        chunks.append(text[char_at(start):char_at(e)].strip())
+    return chunks or [text[:2000]]
 
 def extract_text_from_pdf(path: str) -> List[Tuple[int, str]]:
     doc = fitz.open(path)
@@ -103,24 +128,162 @@ def extract_text_from_pdf(path: str) -> List[Tuple[int, str]]:
     doc.close()
     return pages
 
+# ----------------- Facet tagging -----------------
+FACETS: Dict[str, Dict[str, List[str]]] = {"organism": ORGANISMS, "stressor": STRESSORS, "platform": PLATFORMS}
+FACET_MIN_SHARE = float(os.getenv("FACET_MIN_SHARE", "0.15"))  # min share of a facet's hits for a label to be set
+
+_INFLECTED = r"(?=(?:s|es|ed|ing)?(?!\w))"  # plural / past / gerund endings a vocabulary term may carry
+
+class FacetTagger:
+    """
+    All vocabulary terms compiled into one regex alternation, so a text is scanned once for every
+    facet. Terms start on a word boundary and end on one, optionally after an inflection (-s, -es, -ed, -ing) for
+    terms longer than three characters: "humans" and "launched" match, "rat" in "rate" or "iss" in "mission" do not.
+    Each facet's labels are weighted by their share of term hits; labels above FACET_MIN_SHARE form a
+    bitset (bit i = i-th label of the vocabulary).
+    """
+    def __init__(self, facets: Dict[str, Dict[str, List[str]]], min_share: float = FACET_MIN_SHARE):
+        self.names = list(facets)
+        self.labels = {f: list(v) for f, v in facets.items()}
+        self.min_share = min_share
+        self._hits: Dict[str, List[Tuple[int, int]]] = {}
+        for fi, f in enumerate(self.names):
+            for li, (label, terms) in enumerate(facets[f].items()):
+                for t in terms:
+                    self._hits.setdefault(t.lower(), []).append((fi, li))
+        alts = []
+        for t in sorted(self._hits, key=len, reverse=True):
+            pat = re.escape(t)
+            if t[0].isalnum():
+                pat = r"(?<!\w)" + pat
+            if t[-1].isalnum():
+                # lookahead, so the match (the _hits key) stays the bare term
+                pat = pat + (_INFLECTED if len(t) > 3 else r"(?!\w)")
+            alts.append(pat)
+        self._rx = re.compile("|".join(alts))
+
+    def weights(self, text: str) -> Dict[str, Dict[str, float]]:
+        counts = [[0] * len(self.labels[f]) for f in self.names]
+        for m in self._rx.finditer((text or "").lower()):
+            for fi, li in self._hits[m.group(0)]:
+                counts[fi][li] += 1
+        out: Dict[str, Dict[str, float]] = {}
+        for fi, f in enumerate(self.names):
+            total = sum(counts[fi])
+            out[f] = {self.labels[f][li]: c / total for li, c in enumerate(counts[fi]) if c} if total else {}
+        return out
+
+    def tag(self, text: str) -> Dict[str, Tuple[Optional[str], int]]:
+        """facet -> (top label or None, bitset of labels with at least min_share of the hits)."""
+        out: Dict[str, Tuple[Optional[str], int]] = {}
+        for f, w in self.weights(text).items():
+            # ties go to vocabulary order, like the old tag_text
+            top = max(w, key=lambda k: (w[k], -self.labels[f].index(k))) if w else None
+            out[f] = (top, self.bits(f, [k for k, v in w.items() if v >= self.min_share]))
+        return out
+
+    def bits(self, facet: str, labels: List[str]) -> int:
+        b = 0
+        for lab in labels:
+            if lab in self.labels[facet]:
+                b |= 1 << self.labels[facet].index(lab)
+        return b
+
+    def decode(self, facet: str, bits: int) -> List[str]:
+        return [lab for i, lab in enumerate(self.labels[facet]) if bits >> i & 1]
+
+FACET_TAGGER = FacetTagger(FACETS)
+_single_taggers: Dict[int, FacetTagger] = {}
+
 def tag_text(t: str, vocab: Dict[str, List[str]]) -> Optional[str]:
-    low = t.lower()
-    best, score = None, 0
-    for key, terms in vocab.items():
-        s = sum(1 for w in terms if w in low)
-        if s > score:
-            best, score = key, s
-    return best
-
-def embed_texts(texts: List[str]) -> np.ndarray:
-    # Create client on demand (ensures key exists now)
-    client = get_client()
-    out = []
-    B = 64
-    for i in range(0, len(texts), B):
-        resp = client.embeddings.create(model=EMBED_MODEL, input=texts[i:i+B])
-        out.extend([d.embedding for d in resp.data])
-    return np.array(out, dtype="float32")
+    """Best label of `vocab` for `t` (None when no term occurs)."""
+    tagger = _single_taggers.get(id(vocab))
+    if tagger is None:
+        tagger = _single_taggers[id(vocab)] = FacetTagger({"_": vocab})
+    return tagger.tag(t)["_"][0]
+
+_backends: Dict[str, Any] = {}
+_backends_lock = threading.Lock()  # a local model is loaded once even when the first queries race
+_embed_caches: Dict[str, EmbeddingCache] = {}
+_query_caches: Dict[str, QueryEmbeddingCache] = {}
+_caches_lock = threading.Lock()  # one cache per model even when the first requests race (each opens files / Redis)
+
+def get_embed_backend(model: Optional[str] = None):
+    """
+    Backend for the embed_model id an index records (see embed_backends.py); default EMBED_BACKEND_ID.
+    Ids of indexes built before backends existed are OpenAI model names and resolve to the openai backend.
+    """
+    model = model or EMBED_BACKEND_ID
+    backend = _backends.get(model)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(model)
+            if backend is None:
+                backend = _backends[model] = make_backend(model, get_client, tokenize_len)
+    return backend
+
+def get_embed_cache(model: Optional[str] = None) -> Optional[EmbeddingCache]:
+    """Shared on-disk embedding cache of one backend (None when EMBED_CACHE_MB=0 or for the stub)."""
+    model = model or EMBED_BACKEND_ID
+    if EMBED_CACHE_MB <= 0 or model.startswith("stub:"):  # the stub is cheaper than a cache lookup
+        return None
+    cache = _embed_caches.get(model)
+    if cache is None:
+        with _caches_lock:
+            cache = _embed_caches.get(model)
+            if cache is None:
+                cache = _embed_caches[model] = EmbeddingCache(model)
+    return cache
+
+def embed_texts(texts: List[str], model: Optional[str] = None, dims: Optional[int] = None) -> np.ndarray:
+    """
+    Embed texts with backend `model` at width `dims` (None = full), serving repeats from the on-disk cache
+    and only computing misses. Backends that can't shorten natively embed (and cache) at full width.
+    """
+    backend = get_embed_backend(model)
+    if dims and not getattr(backend, "native_dims", False):
+        return project(embed_texts(texts, backend.id), dims)
+    cache = get_embed_cache(f"{backend.id}@{dims}" if dims else backend.id)
+    if cache is None:
+        return backend.embed(texts, dims)
+    found, missing = cache.get_many(texts)
+    if missing:
+        # identical texts within one call are only embedded once
+        uniq = list(dict.fromkeys(texts[i] for i in missing))
+        vecs = cache.round_trip(backend.embed(uniq, dims))
+        cache.put_many(uniq, vecs)
+        by_text = dict(zip(uniq, vecs))
+        for i in missing:
+            found[i] = by_text[texts[i]]
+    if not found:
+        return np.zeros((0, cache.dim or 0), dtype="float32")
+    return np.stack(found).astype("float32")
+
+def get_query_cache(model: Optional[str] = None) -> Optional[QueryEmbeddingCache]:
+    """Per-process query embedding cache of one backend (None when QUERY_CACHE_SIZE=0)."""
+    model = model or EMBED_BACKEND_ID
+    if QUERY_CACHE_SIZE <= 0:
+        return None
+    cache = _query_caches.get(model)
+    if cache is None:
+        with _caches_lock:
+            cache = _query_caches.get(model)
+            if cache is None:
+                cache = _query_caches[model] = QueryEmbeddingCache(lambda t: embed_texts(t, model), model)
+    return cache
+
+def embed_query(q: str, model: Optional[str] = None, dims: Optional[int] = None) -> np.ndarray:
+    """
+    (1, dims) embedding of a search query; repeats are served from memory without a network call. Queries
+    are cached at full width and projected, so indexes of any width share one cache entry.
+    """
+    cache = get_query_cache(model)
+    return project(cache.get(q) if cache is not None else embed_texts([q], model), dims)
+
+def embed_queries(qs: List[str], model: Optional[str] = None, dims: Optional[int] = None) -> np.ndarray:
+    """(n, dims) embeddings of many search queries with a single backend call for the uncached ones."""
+    cache = get_query_cache(model)
+    return project(cache.get_many(qs) if cache is not None else embed_texts(qs, model), dims)
 
 def build_prompt(question: str, contexts: List[Dict[str, Any]]) -> List[Dict[str, str]]:
     """
@@ -184,3 +347,18 @@ def build_prompt(question: str, contexts: List[Dict[str, Any]]) -> List[Dict[str
     )
 
     return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+def _string_literals(code) -> List[str]:
+    """String constants of a code object and the comprehensions nested in it, in source order."""
+    out: List[str] = []
+    for c in code.co_consts:
+        if isinstance(c, str):
+            out.append(c)
+        elif hasattr(c, "co_consts"):
+            out.extend(_string_literals(c))
+    return out
+
+# Hash of build_prompt's template strings (docstring excluded): the same in every process, and it only changes
+# when the prompt text does. Part of the answer cache key.
+PROMPT_VERSION = hashlib.sha256("\x00".join(
+    t for t in _string_literals(build_prompt.__code__) if t != build_prompt.__doc__).encode("utf-8")).hexdigest()[:12]
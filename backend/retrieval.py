@@ -0,0 +1,151 @@
+# retrieval.py
+"""
+One retrieval pipeline for /search, /search/batch, /ask, /ask-simple and the mindmap / story context.
+
+A candidate source (dense, lexical or hybrid; see app._candidates) hands over ranked (scores, ids) arrays and
+every later stage works on those arrays against the columnar chunk store:
+
+  filter       drop index padding (-1) and rows outside the facet mask
+  rescore      optional facet bonus: + FACET_BONUS per facet whose top label equals the guessed one, stable re-sort
+  dedupe       first hit per (doc, page), via one int64 key per row and np.unique
+  truncate     top_k
+  materialise  row dicts for the survivors only
+
+RetrievalEngine.retrieve() repeats the source with a doubled k until top_k distinct pages survive or the
+source is exhausted. Each stage is timed per request (Selection.timings, ms) and aggregated for /search/stats.
+"""
+import os, time, threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+FACET_BONUS = float(os.getenv("FACET_BONUS", "0.05"))  # score added per matching guessed facet (ask-simple)
+STAGES = ("embed", "candidates", "filter", "rescore", "dedupe", "truncate", "materialise")
+
+Fetch = Callable[[int], Tuple[np.ndarray, np.ndarray]]  # k -> (scores, ids), best first
+
+class Selection:
+    __slots__ = ("ids", "scores", "k", "timings")
+
+    def __init__(self, ids: np.ndarray, scores: np.ndarray, k: int, timings: Dict[str, float]):
+        self.ids, self.scores, self.k, self.timings = ids, scores, k, timings
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+def _lap(timings: Dict[str, float], stage: str, t0: float) -> float:
+    t = time.perf_counter()
+    timings[stage] = timings.get(stage, 0.0) + (t - t0) * 1000.0
+    return t
+
+def page_keys(meta, ids: np.ndarray) -> np.ndarray:
+    """One int64 per row identifying its (doc, page)."""
+    return (meta.doc[ids].astype(np.int64) << 32) | (meta.page[ids].astype(np.int64) & 0xFFFFFFFF)
+
+def first_per_page(meta, ids: np.ndarray) -> np.ndarray:
+    """Positions in `ids` of the first row of each (doc, page), in their original order."""
+    if len(ids) == 0:
+        return np.zeros(0, dtype=np.int64)
+    _, first = np.unique(page_keys(meta, ids), return_index=True)
+    first.sort()
+    return first
+
+def facet_bonus(meta, ids: np.ndarray, guess: Dict[str, Optional[str]], bonus: float = FACET_BONUS) -> np.ndarray:
+    """Per-row bonus: `bonus` for every facet whose top label is the guessed one (guesses outside the vocabulary
+    never match)."""
+    out = np.zeros(len(ids), dtype=np.float32)
+    for facet, label in guess.items():
+        labels = meta.labels.get(facet, [])
+        if label and label in labels and facet in meta.codes:
+            out += (meta.codes[facet][ids] == labels.index(label)) * np.float32(bonus)
+    return out
+
+class RetrievalEngine:
+    def __init__(self, window: int = 4096):
+        self._lock = threading.Lock()
+        self._ms: Dict[str, deque] = {s: deque(maxlen=window) for s in STAGES + ("total",)}
+        self.requests = 0
+        self.widened = 0
+
+    # ---------- stages ----------
+    def select(self, meta, scores: Optional[np.ndarray], ids: np.ndarray, top_k: int,
+               allowed: Optional[np.ndarray] = None, guess: Optional[Dict[str, Optional[str]]] = None,
+               dedupe: bool = True, timings: Optional[Dict[str, float]] = None, k: int = 0) -> Selection:
+        """Filter, re-score, dedupe and truncate one ranked candidate list. `scores` may be None for
+        unranked id lists (library order); reported scores are always the source's, not the bonus-adjusted ones."""
+        timings = {} if timings is None else timings
+        t = time.perf_counter()
+        ids = np.asarray(ids, dtype=np.int64)
+        scores = np.zeros(len(ids), dtype=np.float32) if scores is None else np.asarray(scores)
+        keep = ids >= 0
+        if allowed is not None:
+            keep &= allowed[np.where(keep, ids, 0)]
+        if not keep.all():
+            ids, scores = ids[keep], scores[keep]
+        t = _lap(timings, "filter", t)
+        if guess and any(guess.values()) and len(ids):
+            order = np.argsort(-(scores + facet_bonus(meta, ids, guess)), kind="stable")
+            ids, scores = ids[order], scores[order]
+            t = _lap(timings, "rescore", t)
+        if dedupe:
+            first = first_per_page(meta, ids)
+            ids, scores = ids[first], scores[first]
+            t = _lap(timings, "dedupe", t)
+        ids, scores = ids[:top_k], scores[:top_k]
+        _lap(timings, "truncate", t)
+        return Selection(ids, scores, k or len(ids), timings)
+
+    def retrieve(self, meta, fetch: Fetch, top_k: int, k: int, limit: int, allowed: Optional[np.ndarray] = None,
+                 guess: Optional[Dict[str, Optional[str]]] = None, first: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                 timings: Optional[Dict[str, float]] = None) -> Selection:
+        """
+        Up to top_k rows, one per page. k grows until enough pages survive, `limit` rows (everything the filter
+        allows) have been ranked or the source returns fewer than k. `first` is an already fetched k-list.
+        """
+        timings = {} if timings is None else timings
+        if first is not None:
+            k = max(k, len(first[1]))
+        while True:
+            if first is not None:
+                scores, ids = first
+                first = None
+            else:
+                t = time.perf_counter()
+                scores, ids = fetch(k)
+                _lap(timings, "candidates", t)
+            sel = self.select(meta, scores, ids, top_k, allowed, guess, timings=timings, k=k)
+            if len(sel) >= top_k or k >= limit or np.count_nonzero(np.asarray(ids) >= 0) < k:
+                return sel
+            with self._lock:
+                self.widened += 1
+            k *= 2
+
+    def rows(self, meta, sel: Selection, text: bool = True) -> List[Dict[str, Any]]:
+        """Row dicts (plus "score") for the selected ids; ends the request's timing."""
+        t = time.perf_counter()
+        out = meta.rows(sel.ids, text=text)
+        for r, s in zip(out, sel.scores.tolist()):
+            r["score"] = s
+        _lap(sel.timings, "materialise", t)
+        self.record(sel.timings)
+        return out
+
+    # ---------- accounting ----------
+    def record(self, timings: Dict[str, float]):
+        with self._lock:
+            self.requests += 1
+            for stage, ms in timings.items():
+                if stage in self._ms:
+                    self._ms[stage].append(ms)
+            self._ms["total"].append(sum(timings.values()))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ms = {s: np.array(v) for s, v in self._ms.items() if v}
+            return {
+                "requests": self.requests,
+                "widened": self.widened,
+                "stage_ms": {s: {"calls": len(v),
+                                 "p50": round(float(np.percentile(v, 50)), 3),
+                                 "p99": round(float(np.percentile(v, 99)), 3)} for s, v in ms.items()},
+            }
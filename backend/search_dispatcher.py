@@ -0,0 +1,149 @@
+# search_dispatcher.py
+"""
+Micro-batching of concurrent single-query vector searches.
+
+Request threads hand their 1 x d query to SearchDispatcher.search() and wait. A query that arrives while no other
+search is in flight is searched at once on the request thread (nothing to batch it with, so no window to pay).
+Otherwise a dispatcher thread takes the first queued query, keeps collecting for up to MICROBATCH_WINDOW_MS (or
+until MICROBATCH_MAX queries) while other searches are still in flight, then
+runs one matrix search per group of queries sharing the same search parameters / filter and fans the rows
+back out. Each query carries the index snapshot its request is pinned to, so queries from before and after an
+index hot-swap are never mixed in one search. When more than MICROBATCH_QUEUE queries are waiting, new ones are
+searched inline instead.
+"""
+import os, time, queue, threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+
+MICROBATCH           = os.getenv("MICROBATCH", "1").strip().lower() not in ("0", "false", "no", "off")
+MICROBATCH_WINDOW_MS = float(os.getenv("MICROBATCH_WINDOW_MS", "2"))
+MICROBATCH_MAX       = int(os.getenv("MICROBATCH_MAX", "64"))
+MICROBATCH_QUEUE     = int(os.getenv("MICROBATCH_QUEUE", "1024"))
+
+class _Pending:
+    __slots__ = ("q", "k", "ef_search", "nprobe", "allowed", "filters", "snap", "t0", "done", "D", "I", "error")
+
+    def __init__(self, q, k, ef_search, nprobe, allowed, snap, filters=None):
+        self.q, self.k, self.ef_search, self.nprobe, self.allowed = q, k, ef_search, nprobe, allowed
+        self.snap, self.filters = snap, filters
+        self.t0 = time.perf_counter()
+        self.done = threading.Event()
+        self.D = self.I = self.error = None
+
+    def key(self):
+        # the filter values, not the mask object: the chunk store only keeps recent masks, so the same filter can
+        # come back as a new array; without values, fall back to the mask's identity
+        if self.allowed is None:
+            f = None
+        elif self.filters is not None:
+            f = tuple(self.filters)
+        else:
+            f = id(self.allowed)
+        return (id(self.snap), self.ef_search, self.nprobe, f)
+
+class SearchDispatcher:
+    def __init__(self, search_fn: Callable[..., Any], window_ms: float = MICROBATCH_WINDOW_MS,
+                 max_batch: int = MICROBATCH_MAX, max_queue: int = MICROBATCH_QUEUE):
+        self.search_fn = search_fn  # (Q, k, ef_search, nprobe, allowed, snap) -> (D, I)
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._q: "queue.Queue[_Pending]" = queue.Queue(maxsize=max(1, max_queue))
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.inline = 0
+        self.solo = 0                            # searched at once: no other search in flight
+        self._active = 0                         # searches between entering search() and getting their result
+        self.sizes: Dict[int, int] = {}          # power-of-two bucket upper bound -> batches
+        self._waits: deque = deque(maxlen=4096)  # ms between enqueue and result
+        threading.Thread(target=self._run, name="search-dispatcher", daemon=True).start()
+
+    def search(self, q: np.ndarray, k: int, ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+               allowed: Optional[np.ndarray] = None, snap: Any = None, filters: Optional[tuple] = None):
+        """`filters` (organism, stressor, platform) names the filter behind `allowed` for grouping."""
+        with self._lock:
+            solo = self._active == 0 and self._q.empty()
+            self._active += 1
+            if solo:
+                self.solo += 1
+        try:
+            if solo:
+                return self.search_fn(q, k, ef_search, nprobe, allowed, snap)
+            p = _Pending(q, k, ef_search, nprobe, allowed, snap, filters)
+            try:
+                self._q.put_nowait(p)
+            except queue.Full:
+                with self._lock:
+                    self.inline += 1
+                return self.search_fn(q, k, ef_search, nprobe, allowed, snap)
+            p.done.wait()
+            if p.error is not None:
+                raise p.error
+            return p.D, p.I
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _collect(self) -> List[_Pending]:
+        first = self._q.get()
+        batch = [first]
+        deadline = first.t0 + self.window
+        while len(batch) < self.max_batch:
+            with self._lock:
+                others = self._active > len(batch) + self._q.qsize()  # in flight, not queued: may join
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self._q.get(timeout=timeout) if timeout > 0 and others else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            groups: Dict[Any, List[_Pending]] = {}
+            for p in batch:
+                groups.setdefault(p.key(), []).append(p)
+            for members in groups.values():
+                head = members[0]
+                k = max(p.k for p in members)
+                try:
+                    D, I = self.search_fn(np.vstack([p.q for p in members]), k, head.ef_search, head.nprobe, head.allowed,
+                                          head.snap)
+                    for r, p in enumerate(members):
+                        p.D, p.I = D[r:r + 1, :p.k], I[r:r + 1, :p.k]
+                except Exception as e:  # surface the failure in every waiting request
+                    for p in members:
+                        p.error = e
+                now = time.perf_counter()
+                self._record([(now - p.t0) * 1000 for p in members])
+                for p in members:
+                    p.done.set()
+
+    def _record(self, waits: List[float]):
+        n = len(waits)
+        bucket = 1 << (n - 1).bit_length()
+        with self._lock:
+            self.batches += 1
+            self.queries += n
+            self.sizes[bucket] = self.sizes.get(bucket, 0) + 1
+            self._waits.extend(waits)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = np.array(self._waits) if self._waits else None
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "max_queue": self._q.maxsize,
+                "queued": self._q.qsize(),
+                "batches": self.batches,
+                "queries": self.queries,
+                "inline": self.inline,
+                "solo": self.solo,
+                "mean_batch": round(self.queries / self.batches, 3) if self.batches else None,
+                "batch_size_histogram": {f"<={b}": n for b, n in sorted(self.sizes.items())},
+                "wait_ms": {"p50": round(float(np.percentile(waits, 50)), 3),
+                            "p99": round(float(np.percentile(waits, 99)), 3)} if waits is not None else None,
+            }
@@ -0,0 +1,119 @@
+# shard_server.py
+"""
+Serves one index shard over HTTP for scatter-gather search (see shards.py).
+
+  python shard_server.py --shard 0 --port 8101        one shard of the version data/index/CURRENT names
+  python shard_server.py --all --port 8101            every shard as its own subprocess on ports 8101, 8102, ...
+
+Point the app at the servers with SHARD_URLS=http://127.0.0.1:8101,http://127.0.0.1:8102,... (shard order).
+Like the app, each server follows CURRENT and swaps to a newly published version; until app and shard agree
+on the version the shard's answers are refused and the app reports degraded results. The servers have no
+authentication: bind them to localhost or a private network.
+"""
+import os, sys, time, signal, argparse, threading, subprocess
+from typing import List, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from index_versions import read_current, current_mtime, version_dir
+from shards import LocalShard, shard_dir, encode_array, decode_array
+
+IDX_DIR = "data/index"
+INDEX_LOAD = os.getenv("INDEX_LOAD", "mmap").strip().lower()
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "5"))
+
+class ShardSearchRequest(BaseModel):
+    q: str                  # base64 float32, nq x d, L2-normalised
+    nq: int
+    d: int
+    k: int
+    filters: Optional[List[Optional[str]]] = None
+    ef_search: Optional[int] = None
+    nprobe: Optional[int] = None
+    version: Optional[str] = None
+
+def create_app(shard: int, idx_dir: str = IDX_DIR) -> FastAPI:
+    app = FastAPI(title=f"Index shard {shard}")
+    state = {"shard": None, "mtime": None}
+
+    def load():
+        state["mtime"] = current_mtime(idx_dir)
+        v = read_current(idx_dir)
+        path = shard_dir(version_dir(idx_dir, v), shard) if v else None
+        if path is None or not os.path.isdir(path):
+            print(f"[shard {shard}] no shard directory for version {v}")
+            return
+        t0 = time.perf_counter()
+        state["shard"] = LocalShard(path, INDEX_LOAD)
+        print(f"[shard {shard}] version {v} | rows={state['shard'].ntotal} | loaded in {time.perf_counter() - t0:.2f}s")
+
+    def watch():
+        while INDEX_WATCH_INTERVAL > 0:
+            time.sleep(INDEX_WATCH_INTERVAL)
+            if current_mtime(idx_dir) != state["mtime"]:
+                try:
+                    load()
+                except Exception as e:
+                    print(f"[shard {shard}] reload failed: {e}")
+
+    load()
+    threading.Thread(target=watch, name="index-watcher", daemon=True).start()
+
+    @app.get("/shard/info")
+    def info():
+        s = state["shard"]
+        return {"shard": shard, "version": s.version if s else None, "rows": s.ntotal if s else 0}
+
+    @app.post("/shard/search")
+    def search(req: ShardSearchRequest):
+        s = state["shard"]  # one reference per request, like the app's pinned snapshot
+        if s is None:
+            return JSONResponse({"error": "shard not loaded"}, status_code=503)
+        if req.version is not None and req.version != s.version:
+            return JSONResponse({"error": f"serving version {s.version}, asked for {req.version}"}, status_code=409)
+        q = decode_array(req.q, "float32", (req.nq, req.d))
+        D, I = s.search(q, req.k, tuple(req.filters) if req.filters else None, req.ef_search, req.nprobe)
+        return {"k": D.shape[1], "D": encode_array(D.astype("float32")), "I": encode_array(I.astype("int64")),
+                "version": s.version}
+
+    return app
+
+def spawn_all(host: str, port: int, idx_dir: str) -> int:
+    """One subprocess per shard of the current version; returns when they have all exited."""
+    v = read_current(idx_dir)
+    root = os.path.join(version_dir(idx_dir, v), "shards") if v else None
+    if root is None or not os.path.isdir(root):
+        print("The current index version is not sharded (ingest --shards N).")
+        return 1
+    n = len([d for d in os.listdir(root) if d.isdigit()])
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--shard", str(s), "--host", host,
+                               "--port", str(port + s), "--index-dir", idx_dir]) for s in range(n)]
+    print("SHARD_URLS=" + ",".join(f"http://{host}:{port + s}" for s in range(n)))
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for p in procs:
+            p.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+    return 0
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Serve index shards for scatter-gather search")
+    ap.add_argument("--shard", type=int, default=None, help="shard number to serve")
+    ap.add_argument("--all", action="store_true", help="serve every shard, one subprocess each on consecutive ports")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8101, help="port (first port with --all)")
+    ap.add_argument("--index-dir", default=IDX_DIR)
+    args = ap.parse_args()
+    if args.all:
+        sys.exit(spawn_all(args.host, args.port, args.index_dir))
+    if args.shard is None:
+        ap.error("--shard or --all is required")
+    import uvicorn
+    uvicorn.run(create_app(args.shard, args.index_dir), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,204 @@
+# shards.py
+"""
+Index shards partitioned by document, and scatter-gather dense search over them.
+
+versions/<v>/shards/<s>/        one per shard (ingest --shards N / INDEX_SHARDS), each self-contained:
+  meta.jsonl, vectors.f32         the shard's rows; every chunk of a document lands in shard_of(doc_path, N)
+  index.faiss, index_info.json    FAISS index over those rows only
+  chunks/                         chunk store of meta.jsonl (facet masks for filtered search)
+  ids.npy                         shard row -> global chunk id (row of the version's chunks/)
+
+The version root keeps the global chunks/ and text/, so /library, /stats and lexical search are unchanged.
+Dense search sends each query to every shard -- in-process (LocalShard) or shard_server.py processes listed
+in SHARD_URLS (RemoteShard) -- and merges the per-shard top-k by score. Shards that fail, run past
+SHARD_TIMEOUT_MS or serve another index version are left out and the result is flagged degraded.
+"""
+import os, json, base64, hashlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import httpx
+
+try:
+    import faiss  # type: ignore
+except Exception:  # pragma: no cover
+    faiss = None
+
+from vector_index import (
+    index_params, build_index as build_faiss_index, load_index, read_index_info, write_index_info, search_filtered
+)
+from meta_store import ChunkStore, write_chunk_store
+
+INDEX_SHARDS     = int(os.getenv("INDEX_SHARDS", "1"))           # shards written by ingest; 1 = one index
+SHARD_URLS       = [u.strip().rstrip("/") for u in os.getenv("SHARD_URLS", "").split(",") if u.strip()]
+SHARD_TIMEOUT_MS = float(os.getenv("SHARD_TIMEOUT_MS", "2000"))  # per scatter-gather call
+_SLICE = 65536  # rows copied per write when splitting vectors.f32
+
+Filters = Tuple[Optional[str], Optional[str], Optional[str]]  # (organism, stressor, platform)
+
+def shard_of(doc_path: str, n: int) -> int:
+    return int.from_bytes(hashlib.sha1(doc_path.encode("utf-8")).digest()[:8], "big") % n
+
+def shard_dir(root: str, s: int) -> str:
+    return os.path.join(root, "shards", str(s))
+
+# ---------- build (ingest) ----------
+def write_shards(vec: np.ndarray, meta_path: str, root: str, n: int, kind: str, labels: Dict[str, Any],
+                 info: Dict[str, Any], storage: str = "f32"):
+    """Split the rows of `vec` / meta.jsonl into n shard directories below `root` and index each one."""
+    dirs = [shard_dir(root, s) for s in range(n)]
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+    assign = []
+    outs = [open(os.path.join(d, "meta.jsonl"), "w", encoding="utf-8") for d in dirs]
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            for line in f:
+                s = shard_of(json.loads(line).get("doc_path") or "", n)
+                assign.append(s)
+                outs[s].write(line)
+    finally:
+        for o in outs:
+            o.close()
+    assign = np.asarray(assign, dtype=np.int32)
+
+    dim = vec.shape[1]
+    for s, d in enumerate(dirs):
+        ids = np.flatnonzero(assign == s).astype(np.int64)
+        np.save(os.path.join(d, "ids.npy"), ids)
+        vec_path = os.path.join(d, "vectors.f32")
+        with open(vec_path, "wb") as f:
+            for i in range(0, len(ids), _SLICE):
+                f.write(np.ascontiguousarray(vec[ids[i:i + _SLICE]], dtype="float32").tobytes())
+        write_chunk_store(os.path.join(d, "meta.jsonl"), os.path.join(d, "chunks"), labels)
+        params = index_params(kind if len(ids) else "flat", len(ids), storage)
+        sv = np.memmap(vec_path, dtype="float32", mode="r", shape=(len(ids), dim)) if len(ids) \
+            else np.zeros((0, dim), "float32")
+        faiss.write_index(build_faiss_index(sv, params), os.path.join(d, "index.faiss"))
+        write_index_info(os.path.join(d, "index_info.json"), info | params | {
+            "rows": len(ids), "dim": dim, "shard": s, "shards": n,
+            "vectors": {"path": "vectors.f32", "ino": os.stat(vec_path).st_ino},
+        })
+        print(f"  shard {s}: {len(ids)} rows ({params['type']}, {params.get('storage', 'f32')})")
+
+# ---------- search ----------
+def encode_array(a: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(a).tobytes()).decode("ascii")
+
+def decode_array(s: str, dtype: str, shape: Sequence[int]) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(s), dtype=dtype).reshape(shape)
+
+class LocalShard:
+    """One shard directory loaded in this process; search() returns global chunk ids."""
+    def __init__(self, path: str, load_mode: str = "mmap"):
+        self.path = path
+        self.info = read_index_info(os.path.join(path, "index_info.json"))
+        self.shard = self.info.get("shard")
+        self.version = self.info.get("version")
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.meta = ChunkStore(os.path.join(path, "chunks"))
+        vec_path = os.path.join(path, "vectors.f32")
+        self.index = load_index(os.path.join(path, "index.faiss"), vec_path, self.info, load_mode)
+        self.vectors = np.memmap(vec_path, dtype="float32", mode="r", shape=(self.index.ntotal, self.index.d)) \
+            if self.index.ntotal else None
+        self.ntotal = self.index.ntotal
+
+    def search(self, q: np.ndarray, k: int, filters: Optional[Filters] = None,
+               ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+        if self.ntotal == 0:
+            return np.empty((len(q), 0), "float32"), np.empty((len(q), 0), "int64")
+        allowed = self.meta.filter_mask(*filters) if filters else None
+        D, I = search_filtered(self.index, q, min(k, self.ntotal), allowed, self.vectors, ef_search, nprobe)
+        return D, np.where(I >= 0, self.ids[np.maximum(I, 0)], -1)
+
+class RemoteShard:
+    """A shard served by shard_server.py; answers are rejected unless they come from `version`."""
+    def __init__(self, url: str, shard: int, version: Optional[str], client: httpx.Client):
+        self.url, self.shard, self.version, self.client = url, shard, version, client
+        self.ntotal = 0
+        try:
+            info = client.get(f"{url}/shard/info").json()
+            self.ntotal = int(info.get("rows", 0))
+            if info.get("shard") != shard or info.get("version") != version:
+                print(f"[shards] {url} serves shard {info.get('shard')} @ {info.get('version')}, "
+                      f"expected shard {shard} @ {version}")
+        except Exception as e:
+            print(f"[shards] {url} unreachable: {e}")
+
+    def search(self, q: np.ndarray, k: int, filters: Optional[Filters] = None,
+               ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+        q = np.ascontiguousarray(q, dtype="float32")
+        r = self.client.post(f"{self.url}/shard/search", json={
+            "q": encode_array(q), "nq": len(q), "d": q.shape[1], "k": k, "filters": list(filters) if filters else None,
+            "ef_search": ef_search, "nprobe": nprobe, "version": self.version,
+        })
+        r.raise_for_status()
+        out = r.json()
+        cols = out["k"]
+        return decode_array(out["D"], "float32", (len(q), cols)), decode_array(out["I"], "int64", (len(q), cols))
+
+def merge_topk(parts: List[Tuple[np.ndarray, np.ndarray]], nq: int, k: int):
+    """Per query, the k best (score, id) pairs across shard results; padded with -1 ids like FAISS."""
+    parts = [(D, I) for D, I in parts if D.shape[1]]
+    if not parts:
+        return np.empty((nq, 0), "float32"), np.empty((nq, 0), "int64")
+    D = np.concatenate([p[0] for p in parts], axis=1).astype("float32")
+    I = np.concatenate([p[1] for p in parts], axis=1).astype("int64")
+    D[I < 0] = -np.inf
+    order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+    D, I = np.take_along_axis(D, order, 1), np.take_along_axis(I, order, 1)
+    D[I < 0] = -np.inf
+    return D, I
+
+class ShardSet:
+    """Scatter-gather over all shards of one index version."""
+    def __init__(self, shards: List[Any], timeout_ms: float = SHARD_TIMEOUT_MS, client: Optional[httpx.Client] = None):
+        self.shards = shards
+        self.timeout = timeout_ms / 1000.0
+        self.client = client
+        self.ntotal = sum(s.ntotal for s in shards)
+        self.remote = any(isinstance(s, RemoteShard) for s in shards)
+        self._pool = ThreadPoolExecutor(max_workers=max(4, 4 * len(shards)), thread_name_prefix="shard")
+        self.calls = 0
+        self.degraded = 0
+
+    def search(self, q: np.ndarray, k: int, filters: Optional[Filters] = None,
+               ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+        """(D, I, missing shard numbers); a shard that errors or misses the deadline is skipped."""
+        futs = {self._pool.submit(s.search, q, k, filters, ef_search, nprobe): n for n, s in enumerate(self.shards)}
+        done, _ = wait(futs, timeout=self.timeout)
+        parts, missing = [], []
+        for f, n in futs.items():
+            if f in done and f.exception() is None:
+                parts.append(f.result())
+            else:
+                missing.append(n)
+                if f in done:
+                    print(f"[shards] shard {n} failed: {f.exception()}")
+        self.calls += 1
+        self.degraded += bool(missing)
+        D, I = merge_topk(parts, len(q), k)
+        return D, I, sorted(missing)
+
+    def close(self):
+        """Stop the fan-out threads and close the shard servers' connections (searches still running are dropped)."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self.client is not None:
+            self.client.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"shards": len(self.shards), "remote": self.remote, "timeout_ms": self.timeout * 1000,
+                "calls": self.calls, "degraded": self.degraded}
+
+def open_shards(root: str, n: int, version: Optional[str], load_mode: str = "mmap",
+                urls: Optional[List[str]] = None, timeout_ms: float = SHARD_TIMEOUT_MS) -> ShardSet:
+    """Shard servers from `urls` (one per shard, in shard order) when given, else the shard directories in-process."""
+    urls = SHARD_URLS if urls is None else urls
+    if urls and len(urls) != n:
+        print(f"[shards] SHARD_URLS lists {len(urls)} servers for {n} shards; searching the shards in-process")
+        urls = []
+    if urls:
+        client = httpx.Client(timeout=timeout_ms / 1000.0,
+                              limits=httpx.Limits(max_connections=64, max_keepalive_connections=32))
+        return ShardSet([RemoteShard(u, s, version, client) for s, u in enumerate(urls)], timeout_ms, client)
+    return ShardSet([LocalShard(shard_dir(root, s), load_mode) for s in range(n)], timeout_ms)
@@ -0,0 +1,19 @@
+# tests/conftest.py
+"""Tests import the backend modules the way the app does: flat, from backend/ (run `python -m pytest tests`)."""
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def write_pdf():
+    """write_pdf(path, pages): a small text PDF, one page per string."""
+    import fitz
+
+    def write(path, pages):
+        doc = fitz.open()
+        for text in pages:
+            doc.new_page().insert_text((72, 72), text, fontsize=9)
+        doc.save(str(path))
+        doc.close()
+    return write
@@ -0,0 +1,74 @@
+# tests/test_chunker.py
+"""
+chunk_text contract: every chunk fits in max_tokens, consecutive chunks share exactly `overlap` tokens when words
+are single tokens, the text is covered in order without repeats beyond the overlap (so the window always
+moves forward), cuts fall on word starts, and section breaks are preferred cut points.
+"""
+import random
+import pytest
+
+from rag_core import chunk_text, tokenize_len, CHUNK_TOKENS, CHUNK_OVERLAP
+
+CANDIDATES = ("the cell bone mice space data gene time rate loss flight study group level cells blood heart "
+              "muscle plant root light water body test model effect change growth").split()
+WORDS = [w for w in CANDIDATES if tokenize_len(" " + w) == 1 and tokenize_len(w) == 1]
+LONG = ["microgravitational", "osteoclastogenesis", "radioprotective", "mechanotransduction", "bone", "mice"]
+
+def _text(n: int, vocab, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(vocab) for _ in range(n))
+
+def _unique_text(n: int) -> str:
+    """n single-token words cycling through WORDS in order."""
+    return " ".join(WORDS[i % len(WORDS)] for i in range(n))
+
+@pytest.mark.parametrize("max_tokens,overlap", [(CHUNK_TOKENS, CHUNK_OVERLAP), (50, 10), (7, 3), (2, 1), (1, 0)])
+def test_single_token_words(max_tokens, overlap):
+    assert len(WORDS) >= 10
+    words = _text(3000, WORDS).split()
+    chunks = chunk_text(" ".join(words), max_tokens, overlap)
+    ov = min(overlap, max_tokens // 2)
+    rebuilt = []
+    for i, c in enumerate(chunks):
+        cw = c.split()
+        assert tokenize_len(c) <= max_tokens
+        if i == 0:
+            rebuilt += cw
+        else:
+            prev = chunks[i - 1].split()
+            assert cw[:ov] == prev[len(prev) - ov:]  # exactly `overlap` tokens repeated
+            assert len(cw) > ov                        # and something new: forward progress
+            rebuilt += cw[ov:]
+    assert rebuilt == words  # in order, nothing lost, no word split
+
+@pytest.mark.parametrize("max_tokens,overlap", [(60, 15), (20, 5), (12, 4)])
+def test_multi_token_words_are_cut_at_word_starts(max_tokens, overlap):
+    words = _text(2000, LONG, seed=1).split()
+    chunks = chunk_text(" ".join(words), max_tokens, overlap)
+    pos = 0
+    for i, c in enumerate(chunks):
+        cw = c.split()
+        assert tokenize_len(c) <= max_tokens
+        assert all(w in LONG for w in cw)  # whole words only
+        if i:
+            prev = chunks[i - 1].split()
+            k = next(k for k in range(min(len(prev), len(cw)), -1, -1) if prev[len(prev) - k:] == cw[:k])
+            assert tokenize_len(" ".join(cw[:k])) <= overlap
+            cw = cw[k:]
+        assert cw and words[pos:pos + len(cw)] == cw
+        pos += len(cw)
+    assert pos == len(words)
+
+def test_sections_are_preferred_cut_points():
+    sections = [_unique_text(30) for _ in range(6)]
+    text = "\n\n".join(sections)
+    chunks = chunk_text(text, 100, 0)
+    assert len(chunks) > 1
+    for c in chunks:
+        assert tokenize_len(c) <= 100
+        parts = [p.strip() for p in c.split("\n\n")]
+        assert all(p in sections for p in parts)  # no section cut in the middle
+
+def test_short_and_empty_text():
+    assert chunk_text("bone loss in mice", 900, 200) == ["bone loss in mice"]
+    assert chunk_text("", 900, 200) == [""]
@@ -0,0 +1,113 @@
+# tests/test_embed_scheduler.py
+"""
+EmbedScheduler against a fake request_fn: token/item-bounded packing, input order under concurrency,
+retry with backoff (429 / 5xx, Retry-After), no retry on 400, and waits on the per-minute budgets.
+"""
+import time, random, threading
+import pytest
+
+from embed_scheduler import EmbedScheduler, RateBudget
+
+def _tokens(t: str) -> int:
+    return len(t.split())
+
+class FakeHTTPError(Exception):
+    def __init__(self, status_code: int, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("R", (), {"headers": {"retry-after": retry_after} if retry_after is not None else {}})()
+
+class FakeServer:
+    """Embeds text i as [i]; fails the first `failures` calls with the given errors."""
+    def __init__(self, failures=(), delay=0.0):
+        self.failures = list(failures)
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.calls.append(list(texts))
+            err = self.failures.pop(0) if self.failures else None
+        if self.delay:
+            time.sleep(random.uniform(0, self.delay))
+        if err is not None:
+            raise err
+        return [[float(t.split()[0])] for t in texts]
+
+def _sched(server, **kw):
+    kw = {"max_batch_tokens": 10, "max_batch_items": 4, "concurrency": 4, "rpm": 1e6, "tpm": 1e9,
+          "max_retries": 3, "backoff_base": 0.001, "backoff_max": 0.01} | kw
+    return EmbedScheduler(server, _tokens, **kw)
+
+def test_pack_respects_token_and_item_limits():
+    texts = [" ".join([str(i)] * (1 + i % 5)) for i in range(40)]
+    s = _sched(FakeServer())
+    batches = s.pack(texts)
+    assert [i for b, _ in batches for i in b] == list(range(40))
+    for b, n in batches:
+        assert n == sum(_tokens(texts[i]) for i in b)
+        assert len(b) <= 4 and (n <= 10 or len(b) == 1)
+
+def test_output_order_matches_input_under_concurrency():
+    texts = [f"{i} word" for i in range(200)]
+    server = FakeServer(delay=0.005)
+    s = _sched(server)
+    assert s.run(texts) == [[float(i)] for i in range(200)]
+    assert len(server.calls) > 4
+    st = s.stats()
+    assert st["requests"] == len(server.calls) and st["tokens"] == 400 and st["retries"] == 0
+
+def test_retry_then_succeed():
+    server = FakeServer([FakeHTTPError(429), FakeHTTPError(503)])
+    s = _sched(server, concurrency=1)
+    assert s.run(["1 a", "2 b"]) == [[1.0], [2.0]]
+    st = s.stats()
+    assert len(server.calls) == 3 and st["requests"] == 1 and st["tokens"] == 4
+    assert st["retries"] == 2 and st["retry_reasons"] == {"429": 1, "503": 1}
+    assert 0 <= st["backoff_s"] <= 0.02
+
+def test_retry_after_is_honoured():
+    server = FakeServer([FakeHTTPError(429, retry_after="0.2")])
+    s = _sched(server, concurrency=1, backoff_max=5)
+    t0 = time.monotonic()
+    s.run(["1 a"])
+    assert time.monotonic() - t0 >= 0.2
+    assert s.stats()["backoff_s"] == pytest.approx(0.2)
+
+def test_gives_up_on_400():
+    server = FakeServer([FakeHTTPError(400)])
+    s = _sched(server, concurrency=1)
+    with pytest.raises(FakeHTTPError):
+        s.run(["1 a"])
+    assert len(server.calls) == 1 and s.stats()["retries"] == 0 and s.stats()["requests"] == 0
+
+def test_gives_up_after_max_retries():
+    server = FakeServer([FakeHTTPError(500)] * 10)
+    s = _sched(server, concurrency=1, max_retries=2)
+    with pytest.raises(FakeHTTPError):
+        s.run(["1 a"])
+    assert len(server.calls) == 3 and s.stats()["retries"] == 2
+
+def test_token_budget_waits_for_refill():
+    budget = RateBudget(rpm=1e6, tpm=6000)  # 100 tokens/s
+    budget.acquire(6000)
+    t0 = time.monotonic()
+    budget.acquire(20)
+    assert time.monotonic() - t0 >= 0.15
+
+def test_request_budget_waits_for_refill():
+    budget = RateBudget(rpm=600, tpm=1e9)  # 10 requests/s
+    for _ in range(600):
+        budget.acquire(1)
+    t0 = time.monotonic()
+    budget.acquire(1)
+    assert time.monotonic() - t0 >= 0.08
+
+def test_scheduler_spends_the_token_budget():
+    texts = [f"{i} " + "x " * 9 for i in range(6)]  # 10 tokens each, one per batch
+    s = _sched(FakeServer(), tpm=3000, concurrency=2)  # 50 tokens/s, starts with 3000
+    s.budget._tok = 20.0
+    t0 = time.monotonic()
+    assert s.run(texts) == [[float(i)] for i in range(6)]
+    assert time.monotonic() - t0 >= 0.7  # 60 tokens needed, 20 in the bucket, refilled at 50/s
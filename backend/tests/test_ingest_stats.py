@@ -0,0 +1,75 @@
+# tests/test_ingest_stats.py
+"""
+/stats counts are summed from per-document counts in the manifest at ingest; after every re-ingest (new,
+removed and changed PDFs, which compact the store) they must equal a full compute_stats over the chunk store.
+"""
+import os, json
+import pytest
+
+from meta_store import ChunkStore, compute_stats
+
+STUB = "stub:64"
+PDFS = {
+    "a.pdf": ["Mice on the International Space Station, 2021.", "Microgravity and bone loss in mice during spaceflight."],
+    "b.pdf": ["Arabidopsis under ionizing radiation, 2019.", "Radiation and root growth of Arabidopsis on the ISS."],
+    "c.pdf": ["Astronaut crew members after launch and landing, 2021.", "Human bed rest as a ground analog."],
+    "d.pdf": ["Yeast in a clinostat.", "Random positioning machine results for yeast cells and zebrafish."],
+}
+
+def _current_stats():
+    import ingest
+    chunks = os.path.join(ingest.version_dir(ingest.IDX_DIR, ingest.read_current(ingest.IDX_DIR)), "chunks")
+    store = ChunkStore(chunks)
+    try:
+        full = compute_stats(store.doc, store.year, store.codes, store.labels, len(store.docs))
+    finally:
+        store.close()
+    with open(os.path.join(chunks, "stats.json"), encoding="utf-8") as f:
+        return json.load(f), json.loads(json.dumps(full))
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch, write_pdf):
+    pdfs = tmp_path / "data" / "pdfs"
+    os.makedirs(pdfs)
+    for name, pages in PDFS.items():
+        write_pdf(pdfs / name, pages)
+    monkeypatch.chdir(tmp_path)
+    import ingest
+    return ingest, pdfs
+
+def test_incremental_stats_match_a_full_recount(corpus, write_pdf):
+    ingest, pdfs = corpus
+    run = lambda: ingest.run_ingest(embed_model=STUB, workers=1)
+
+    run()
+    got, full = _current_stats()
+    assert got == full and got["documents"] == 4
+
+    os.remove(pdfs / "b.pdf")  # removed: its rows are compacted away
+    run()
+    got, full = _current_stats()
+    assert got == full and got["documents"] == 3
+    assert "arabidopsis" not in dict(got["facets"]["organism"])
+
+    write_pdf(pdfs / "a.pdf", ["Rats exposed to galactic cosmic radiation, 2020."])  # changed
+    write_pdf(pdfs / "e.pdf", ["Drosophila flown on the Space Shuttle, 2018."])       # new
+    run()
+    got, full = _current_stats()
+    assert got == full and got["documents"] == 4
+    assert set(got["by_year"]) >= {"2018", "2020", "2021"}
+
+def test_manifest_without_counts_is_backfilled(corpus):
+    ingest, _ = corpus
+    ingest.run_ingest(embed_model=STUB, workers=1)
+    with open(ingest.MANIFEST_PATH, encoding="utf-8") as f:
+        man = json.load(f)
+    for d in man["docs"].values():
+        d.pop("stats")
+    man["index_version"] = None  # force a rebuild
+    with open(ingest.MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(man, f)
+    ingest.run_ingest(embed_model=STUB, workers=1)
+    got, full = _current_stats()
+    assert got == full
+    with open(ingest.MANIFEST_PATH, encoding="utf-8") as f:
+        assert all("stats" in d for d in json.load(f)["docs"].values())
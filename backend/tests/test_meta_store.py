@@ -0,0 +1,45 @@
+# tests/test_meta_store.py
+"""ChunkStore.match_text: case-insensitive for ASCII and non-ASCII needles, on chunk text and titles."""
+import os, json
+import numpy as np
+import pytest
+
+from meta_store import ChunkStore, write_chunk_store
+
+LABELS = {"organism": ["rodent"], "stressor": ["radiation"], "platform": ["ISS"]}
+ROWS = [
+    ("a.pdf", "Ökologie der Raumfahrt", "Bone loss in MICE aboard the ISS."),
+    ("a.pdf", "Ökologie der Raumfahrt", "Expression of the ΑΒΓ gene cluster."),
+    ("b.pdf", "Plant roots", "Die ÖKOLOGIE von Wurzeln unter Strahlung."),
+    ("b.pdf", "Plant roots", "Straße tests and nothing else."),
+]
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    d = tmp_path_factory.mktemp("store")
+    meta = d / "meta.jsonl"
+    with open(meta, "w", encoding="utf-8") as f:
+        for i, (path, title, text) in enumerate(ROWS):
+            f.write(json.dumps({"id": i, "doc_path": path, "doc_title": title, "page_start": 1, "text": text}) + "\n")
+    write_chunk_store(str(meta), str(d / "chunks"), LABELS)
+    st = ChunkStore(str(d / "chunks"))
+    yield st
+    st.close()
+
+def _match(store, needle):
+    return store.match_text(np.arange(len(store)), needle).tolist()
+
+def test_ascii_needle_ignores_case(store):
+    assert _match(store, "bone LOSS") == [0]
+    assert _match(store, "iss") == [0]
+
+def test_non_ascii_needle_ignores_case(store):
+    assert _match(store, "ökologie") == [0, 1, 2]  # rows 0-1 by title, row 2 by text
+    assert _match(store, "αβγ") == [1]
+    assert _match(store, "STRASSE") == []  # ASCII needle: bytes scan, "ß" is not expanded
+    assert _match(store, "straße") == [3]
+    assert _match(store, "STRAẞE") == [3]
+
+def test_match_is_restricted_to_ids(store):
+    assert store.match_text(np.array([1, 2]), "ökologie").tolist() == [1, 2]
+    assert store.match_text(np.array([3]), "ökologie").tolist() == []
@@ -0,0 +1,92 @@
+# tests/test_pipeline.py
+"""
+The whole pipeline offline: ingest two generated PDFs with the stub embedding backend, then /search and /ask
+through TestClient with a fake chat client. Queries must be embedded by the backend recorded in the index
+(index_info["embed_model"]), whatever backend the process is configured with.
+"""
+import os, json
+import pytest
+from fastapi.testclient import TestClient
+
+STUB = "stub:384"
+PDFS = {
+    "mice.pdf": ["Hindlimb unloading of mice on the International Space Station (ISS), 2021.",
+                 "Microgravity caused bone loss and muscle atrophy in mice after thirty days in orbit."],
+    "plants.pdf": ["Arabidopsis seedlings grown under ionizing radiation, 2019.",
+                   "Radiation exposure altered root growth and DNA repair genes in Arabidopsis plants."],
+}
+
+class _FakeChat:
+    """Stands in for the OpenAI client: records the prompts, answers with a fixed text."""
+    def __init__(self):
+        self.calls = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kw):
+        self.calls.append(kw)
+        msg = type("M", (), {"content": "stub answer [1]"})()
+        return type("R", (), {"choices": [type("C", (), {"message": msg})()]})()
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory, write_pdf):
+    root = tmp_path_factory.mktemp("pipeline")
+    os.makedirs(root / "data" / "pdfs")
+    for name, pages in PDFS.items():
+        write_pdf(root / "data" / "pdfs" / name, pages)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(root)  # ingest and the app use data/ relative to the working directory
+        import ingest, app, rag_core
+        ingest.run_ingest(embed_model=STUB, workers=1)
+        # the process default is the OpenAI backend: any query embedded with it instead of the index's
+        # backend would need the network and fail
+        mp.setattr(rag_core, "EMBED_BACKEND_ID", rag_core.EMBED_MODEL)
+        chat = _FakeChat()
+        mp.setattr(app, "BOOT_MODE", "full")
+        mp.setattr(app, "get_client", lambda: chat)
+        mp.setattr(app.limiter, "enabled", False)
+        with TestClient(app.app) as c:
+            c.chat = chat
+            yield c
+
+def test_ingest_records_the_stub_backend(client):
+    info = client.get("/").json()
+    assert info["index_loaded"] and info["vectors"] > 0
+    assert info["embed_model"] == STUB
+    assert info["embed_dims"] == 384
+
+@pytest.mark.parametrize("mode", ["lexical", "dense", "hybrid"])
+def test_search_finds_the_matching_document(client, mode):
+    r = client.get("/search", params={"q": "microgravity bone loss mice", "top_k": 3, "mode": mode})
+    assert r.status_code == 200
+    results = r.json()["results"]
+    assert results and os.path.basename(results[0]["path"]) == "mice.pdf"
+
+def test_ask_grounds_the_answer_on_retrieved_chunks(client):
+    r = client.post("/ask", json={"question": "How does radiation affect Arabidopsis roots?", "top_k": 2,
+                                  "mode": "dense"})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["answer"] == "stub answer [1]"
+    assert os.path.basename(body["sources"][0]["path"]) == "plants.pdf"
+    prompt = client.chat.calls[-1]["messages"][-1]["content"]
+    assert "Radiation exposure altered root growth" in prompt
+
+def test_queries_use_the_backend_recorded_in_the_index(client):
+    import app
+    root = app._snap().root
+    path = os.path.join(root, "index_info.json")
+    with open(path, encoding="utf-8") as f:
+        info = json.load(f)
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(info | {"embed_model": "stub:64"}, f)
+        app.reload_index(force=True)
+        assert client.get("/").json()["embed_model"] == "stub:64"
+        with pytest.raises(RuntimeError, match="64-d query vectors for a 384-d index"):
+            client.get("/search", params={"q": "microgravity", "mode": "dense"})
+    finally:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        app.reload_index(force=True)
+    assert client.get("/search", params={"q": "microgravity", "mode": "dense"}).status_code == 200
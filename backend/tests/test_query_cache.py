@@ -0,0 +1,29 @@
+# tests/test_query_cache.py
+"""Query-embedding cache keys: whitespace and NFKC variants share an entry, case does not."""
+import numpy as np
+
+from query_cache import QueryEmbeddingCache, normalize_query
+
+def _cache():
+    seen = []
+    def embed(texts):
+        seen.extend(texts)
+        return np.array([[float(sum(map(ord, t))), float(len(t))] for t in texts], dtype="float32")
+    return QueryEmbeddingCache(embed, "test", size=16, ttl=0, redis_url=""), seen
+
+def test_case_is_part_of_the_key():
+    c, seen = _cache()
+    a, b = c.get("ISS"), c.get("iss")
+    assert seen == ["ISS", "iss"]
+    assert not np.array_equal(a, b)
+    assert np.array_equal(c.get("ISS"), a) and np.array_equal(c.get("iss"), b)
+    assert c.stats()["hits"] == 2 and c.stats()["entries"] == 2
+
+def test_whitespace_and_width_variants_share_an_entry():
+    assert normalize_query("  Bone\tloss ") == normalize_query("Bone  loss") == "Bone loss"
+    assert normalize_query("ＩＳＳ") == "ISS"
+    c, seen = _cache()
+    out = c.get_many(["Bone loss ", "Bone  loss", "bone loss", "ＩＳＳ", "ISS"])
+    assert seen == ["Bone loss", "bone loss", "ISS"]  # the key is what gets embedded
+    assert np.array_equal(out[0], out[1]) and np.array_equal(out[3], out[4])
+    assert not np.array_equal(out[0], out[2])
@@ -0,0 +1,40 @@
+# tests/test_search_dispatcher.py
+"""Micro-batching: a lone search runs at once without the window; concurrent ones are batched and fanned out."""
+import time, threading
+import numpy as np
+
+from search_dispatcher import SearchDispatcher
+
+def _search(Q, k, ef_search, nprobe, allowed, snap):
+    time.sleep(0.002)
+    ids = np.asarray(Q[:, :1], dtype="int64") + np.arange(k)  # row i answers with ids from its own query value
+    return np.zeros((len(Q), k), dtype="float32"), ids
+
+def test_lone_search_skips_the_window():
+    d = SearchDispatcher(_search, window_ms=200)
+    t0 = time.perf_counter()
+    for i in range(5):
+        _, I = d.search(np.full((1, 4), i, dtype="float32"), 3)
+        assert I.tolist() == [[i, i + 1, i + 2]]
+    assert time.perf_counter() - t0 < 0.5
+    st = d.stats()
+    assert st["solo"] == 5 and st["batches"] == 0
+
+def test_concurrent_searches_are_batched():
+    d = SearchDispatcher(_search, window_ms=5)
+    errors = []
+    def worker(w):
+        for i in range(20):
+            v = w * 100 + i
+            _, I = d.search(np.full((1, 4), v, dtype="float32"), 2)
+            if I.tolist() != [[v, v + 1]]:
+                errors.append((v, I.tolist()))
+    ts = [threading.Thread(target=worker, args=(w,)) for w in range(8)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    st = d.stats()
+    assert not errors
+    assert st["solo"] + st["queries"] + st["inline"] == 160
+    assert st["mean_batch"] > 1
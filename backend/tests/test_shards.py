@@ -0,0 +1,155 @@
+# tests/test_shards.py
+"""
+Scatter-gather over shard_server.py subprocesses: merged top-k must equal exact search over the whole corpus,
+and a shard that stops answering (SIGSTOP) must be left out after SHARD_TIMEOUT_MS with the result flagged.
+"""
+import os, sys, json, time, signal, socket, subprocess
+import numpy as np
+import httpx
+import pytest
+
+from shards import write_shards, open_shards, shard_of
+from index_versions import version_dir, publish
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+N_SHARDS, DOCS, PAGES, PER_PAGE, DIM = 3, 12, 4, 3, 16
+LABELS = {"organism": ["rodent", "human"], "stressor": ["radiation"], "platform": ["ISS"]}
+VERSION = "test-v1"
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _exact(vec, q, k, rows=None):
+    """Exact inner-product top-k ids per query, restricted to `rows` (global ids) when given."""
+    rows = np.arange(len(vec)) if rows is None else rows
+    S = q @ vec[rows].T
+    return rows[np.argsort(-S, axis=1, kind="stable")[:, :k]]
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    idx_dir = str(tmp_path_factory.mktemp("index"))
+    root = version_dir(idx_dir, VERSION)
+    os.makedirs(root)
+    rng = np.random.default_rng(0)
+    rows = []
+    for d in range(DOCS):
+        for p in range(PAGES):
+            for c in range(PER_PAGE):
+                rows.append({"doc_path": f"data/pdfs/doc{d}.pdf", "doc_title": f"Doc {d}", "year": "2020",
+                             "page_start": p + 1, "page_end": p + 1, "organism": LABELS["organism"][d % 2],
+                             "stressor": "radiation", "platform": "ISS", "text": f"doc {d} page {p} chunk {c}"})
+    meta_path = os.path.join(idx_dir, "meta.jsonl")
+    with open(meta_path, "w", encoding="utf-8") as f:
+        for r in rows:
+            f.write(json.dumps(r) + "\n")
+    vec = rng.standard_normal((len(rows), DIM)).astype("float32")
+    vec /= np.linalg.norm(vec, axis=1, keepdims=True)
+    write_shards(vec, meta_path, root, N_SHARDS, "flat", LABELS, {"version": VERSION})
+    publish(idx_dir, VERSION)
+    shard = np.array([shard_of(r["doc_path"], N_SHARDS) for r in rows])
+    assert len(set(shard)) == N_SHARDS, "every shard needs rows for the timeout test to mean anything"
+    return {"idx_dir": idx_dir, "root": root, "vec": vec, "rows": rows, "shard": shard}
+
+@pytest.fixture(scope="module")
+def servers(corpus):
+    ports = [_free_port() for _ in range(N_SHARDS)]
+    env = os.environ | {"INDEX_WATCH_INTERVAL": "0"}
+    procs = [subprocess.Popen([sys.executable, "shard_server.py", "--shard", str(s), "--port", str(p),
+                               "--index-dir", corpus["idx_dir"]], cwd=BACKEND, env=env)
+             for s, p in enumerate(ports)]
+    urls = [f"http://127.0.0.1:{p}" for p in ports]
+    try:
+        deadline = time.time() + 60
+        for u in urls:
+            while True:
+                try:
+                    if httpx.get(f"{u}/shard/info", timeout=1).json().get("version") == VERSION:
+                        break
+                except httpx.HTTPError:
+                    pass
+                assert time.time() < deadline, f"{u} did not come up"
+                time.sleep(0.2)
+        yield {"urls": urls, "procs": procs}
+    finally:
+        for p in procs:
+            if hasattr(signal, "SIGCONT"):
+                p.send_signal(signal.SIGCONT)
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+
+def _queries(corpus, n=8):
+    rng = np.random.default_rng(1)
+    q = rng.standard_normal((n, DIM)).astype("float32")
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+def test_remote_merge_matches_exact(corpus, servers):
+    ss = open_shards(corpus["root"], N_SHARDS, VERSION, urls=servers["urls"], timeout_ms=10000)
+    try:
+        q = _queries(corpus)
+        D, I, missing = ss.search(q, 10)
+        assert missing == []
+        assert np.array_equal(I, _exact(corpus["vec"], q, 10))
+        np.testing.assert_allclose(D, np.take_along_axis(q @ corpus["vec"].T, I, 1), rtol=1e-5, atol=1e-6)
+        assert ss.stats()["degraded"] == 0
+    finally:
+        ss.close()
+
+def test_remote_filtered_merge(corpus, servers):
+    ss = open_shards(corpus["root"], N_SHARDS, VERSION, urls=servers["urls"], timeout_ms=10000)
+    try:
+        q = _queries(corpus)
+        _, I, missing = ss.search(q, 10, ("human", None, None))
+        allowed = np.flatnonzero([r["organism"] == "human" for r in corpus["rows"]])
+        assert missing == []
+        assert np.array_equal(I, _exact(corpus["vec"], q, 10, allowed))
+    finally:
+        ss.close()
+
+def test_in_process_matches_remote(corpus, servers):
+    local = open_shards(corpus["root"], N_SHARDS, VERSION, urls=[])
+    remote = open_shards(corpus["root"], N_SHARDS, VERSION, urls=servers["urls"], timeout_ms=10000)
+    try:
+        q = _queries(corpus)
+        assert np.array_equal(local.search(q, 7)[1], remote.search(q, 7)[1])
+    finally:
+        local.close()
+        remote.close()
+
+@pytest.mark.skipif(not hasattr(signal, "SIGSTOP"), reason="needs SIGSTOP/SIGCONT")
+def test_stalled_shard_is_left_out(corpus, servers):
+    stalled = 1
+    proc = servers["procs"][stalled]
+    ss = open_shards(corpus["root"], N_SHARDS, VERSION, urls=servers["urls"], timeout_ms=500)
+    proc.send_signal(signal.SIGSTOP)
+    try:
+        q = _queries(corpus)
+        t0 = time.perf_counter()
+        D, I, missing = ss.search(q, 10)
+        took = time.perf_counter() - t0
+        assert missing == [stalled]
+        assert took < 5, "the stalled shard must not hold the search past its deadline"
+        # merged top-k of the shards that answered, i.e. exact search without the stalled shard's rows
+        alive = np.flatnonzero(corpus["shard"] != stalled)
+        assert np.array_equal(I, _exact(corpus["vec"], q, 10, alive))
+        assert not np.isin(I, np.flatnonzero(corpus["shard"] == stalled)).any()
+        assert ss.stats()["degraded"] == 1
+    finally:
+        proc.send_signal(signal.SIGCONT)
+        ss.close()
+    # the shard answers again once resumed
+    ss = open_shards(corpus["root"], N_SHARDS, VERSION, urls=servers["urls"], timeout_ms=10000)
+    try:
+        assert ss.search(_queries(corpus), 10)[2] == []
+    finally:
+        ss.close()
+
+def test_close_releases_threads_and_connections(corpus, servers):
+    ss = open_shards(corpus["root"], N_SHARDS, VERSION, urls=servers["urls"], timeout_ms=10000)
+    ss.search(_queries(corpus, 1), 3)
+    ss.close()
+    assert ss.client.is_closed
+    with pytest.raises(RuntimeError):
+        ss._pool.submit(lambda: None)
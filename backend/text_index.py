@@ -0,0 +1,243 @@
+# text_index.py
+"""
+Positional inverted index over chunk texts (plus document title / file name), written by ingest next to the
+chunk store and memory-mapped by the app for /library full-text queries.
+
+data/index/text/
+  text_index.json  {"version", "rows", "terms", "avgdl"}
+  terms.txt        sorted vocabulary, one term per line (term id = line number)
+  post_off.npy     int64   V+1 offsets into the postings arrays per term
+  post_doc.npy     int32   chunk ids, ascending within each term
+  post_tf.npy      int32   term frequency per posting
+  pos_off.npy      int64   P+1 offsets into positions.npy per posting
+  positions.npy    int32   token positions within the chunk
+  doc_len.npy      int32   tokens per chunk (BM25 length normalisation)
+
+Query syntax: bare words, "quoted phrases" and prefix* terms. Every clause must match (mode="all") or any
+clause may match (mode="any"); results are ranked by BM25.
+"""
+import os, re, json, math, bisect
+from array import array
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+TEXT_INDEX_VERSION = 1
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+PREFIX_MAX_TERMS = int(os.getenv("TEXT_PREFIX_MAX_TERMS", "64"))  # most frequent expansions of a prefix* term
+
+_TOKEN = re.compile(r"[^\W_]+")
+_CLAUSE = re.compile(r'"([^"]*)"|(\S+)')
+
+def tokenize(s: str) -> List[str]:
+    return _TOKEN.findall((s or "").lower())
+
+def _doc_tokens(title: str, path: str) -> List[str]:
+    name = os.path.splitext(os.path.basename(path or ""))[0]
+    toks = tokenize(title)
+    have = set(toks)
+    return toks + [t for t in tokenize(name) if t not in have]
+
+def write_text_index(store, out_dir: str):
+    """Build the index from a ChunkStore (chunk text + document title / file name), written via out_dir.tmp."""
+    tmp = out_dir + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    head = [_doc_tokens(d["title"], d["path"]) for d in store.docs]
+    post: Dict[str, Tuple[array, array, array]] = {}
+    doc_len = array("i")
+    for i in range(len(store)):
+        h = head[int(store.doc[i])]
+        body = tokenize(store.text(i))
+        doc_len.append(len(h) + len(body))
+        seen: Dict[str, List[int]] = {}
+        for p, t in enumerate(h):
+            seen.setdefault(t, []).append(p)
+        for p, t in enumerate(body, len(h) + 1):  # gap so phrases don't span title and text
+            seen.setdefault(t, []).append(p)
+        for t, ps in seen.items():
+            e = post.get(t)
+            if e is None:
+                e = post[t] = (array("i"), array("i"), array("i"))
+            e[0].append(i)
+            e[1].append(len(ps))
+            e[2].extend(ps)
+
+    terms = sorted(post)
+    post_off = np.zeros(len(terms) + 1, dtype=np.int64)
+    post_off[1:] = np.cumsum([len(post[t][0]) for t in terms])
+    pos_parts = [np.frombuffer(post[t][2], dtype=np.int32) for t in terms]
+    post_tf = np.concatenate([np.frombuffer(post[t][1], dtype=np.int32) for t in terms]) if terms else np.zeros(0, np.int32)
+    pos_off = np.zeros(len(post_tf) + 1, dtype=np.int64)
+    pos_off[1:] = np.cumsum(post_tf)
+    np.save(os.path.join(tmp, "post_off.npy"), post_off)
+    np.save(os.path.join(tmp, "post_doc.npy"),
+            np.concatenate([np.frombuffer(post[t][0], dtype=np.int32) for t in terms]) if terms else np.zeros(0, np.int32))
+    np.save(os.path.join(tmp, "post_tf.npy"), post_tf)
+    np.save(os.path.join(tmp, "pos_off.npy"), pos_off)
+    np.save(os.path.join(tmp, "positions.npy"), np.concatenate(pos_parts) if terms else np.zeros(0, np.int32))
+    dl = np.frombuffer(doc_len, dtype=np.int32) if len(doc_len) else np.zeros(0, np.int32)
+    np.save(os.path.join(tmp, "doc_len.npy"), dl)
+    with open(os.path.join(tmp, "terms.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(terms))
+    with open(os.path.join(tmp, "text_index.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": TEXT_INDEX_VERSION, "rows": len(store), "terms": len(terms),
+                   "avgdl": float(dl.mean()) if len(dl) else 0.0}, f)
+
+    if os.path.exists(out_dir):
+        old = out_dir + ".old"
+        os.replace(out_dir, old)
+        os.replace(tmp, out_dir)
+        for name in os.listdir(old):
+            os.remove(os.path.join(old, name))
+        os.rmdir(old)
+    else:
+        os.replace(tmp, out_dir)
+
+class TextIndex:
+    """Read-only BM25 / phrase / prefix search over a text index directory."""
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "text_index.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        self.rows = info["rows"]
+        self.avgdl = info["avgdl"] or 1.0
+        with open(os.path.join(path, "terms.txt"), "r", encoding="utf-8") as f:
+            self.terms = f.read().split("\n") if info["terms"] else []
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.post_off = load("post_off")
+        self.post_doc = load("post_doc")
+        self.post_tf = load("post_tf")
+        self.pos_off = load("pos_off")
+        self.positions = load("positions")
+        self.doc_len = load("doc_len")
+
+    def __len__(self) -> int:
+        return self.rows
+
+    # ---------- vocabulary ----------
+    def term_id(self, term: str) -> Optional[int]:
+        i = bisect.bisect_left(self.terms, term)
+        return i if i < len(self.terms) and self.terms[i] == term else None
+
+    def prefix_ids(self, prefix: str) -> List[int]:
+        lo = bisect.bisect_left(self.terms, prefix)
+        hi = bisect.bisect_left(self.terms, prefix + "\uffff")
+        ids = np.arange(lo, hi)
+        if len(ids) > PREFIX_MAX_TERMS:
+            df = self.post_off[ids + 1] - self.post_off[ids]
+            ids = np.sort(ids[np.argsort(-df, kind="stable")[:PREFIX_MAX_TERMS]])
+        return [int(i) for i in ids]
+
+    # ---------- scoring ----------
+    def _bm25(self, tf: np.ndarray, df: int, docs: np.ndarray) -> np.ndarray:
+        idf = math.log(1.0 + (self.rows - df + 0.5) / (df + 0.5))
+        tf = tf.astype(np.float32)
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_len[docs] / self.avgdl)
+        return idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+    def _postings(self, tid: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        s, e = int(self.post_off[tid]), int(self.post_off[tid + 1])
+        return self.post_doc[s:e], self.post_tf[s:e], s
+
+    def _term_clause(self, tids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """(chunk ids, BM25 contribution) of one term, or of a prefix expansion treated as one term."""
+        if not tids:
+            return np.zeros(0, np.int32), np.zeros(0, np.float32)
+        if len(tids) == 1:
+            docs, tf, _ = self._postings(tids[0])
+            return np.asarray(docs), self._bm25(np.asarray(tf), len(docs), docs)
+        parts = [self._postings(t) for t in tids]
+        docs = np.concatenate([p[0] for p in parts])
+        tf = np.concatenate([p[1] for p in parts])
+        order = np.argsort(docs, kind="stable")
+        docs, tf = docs[order], tf[order]
+        u, start = np.unique(docs, return_index=True)
+        tf = np.add.reduceat(tf, start) if len(u) else tf
+        return u, self._bm25(tf, len(u), u)
+
+    def _position_keys(self, ix: np.ndarray, shift: int) -> np.ndarray:
+        """Positions of postings `ix` minus `shift`, keyed by the posting's slot in `ix`."""
+        starts = np.asarray(self.pos_off[ix])
+        lens = np.asarray(self.pos_off[ix + 1]) - starts
+        total = int(lens.sum())
+        slot = np.repeat(np.arange(len(ix), dtype=np.int64), lens)
+        flat = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(lens) - lens, lens) + np.repeat(starts, lens)
+        pos = np.asarray(self.positions[flat]).astype(np.int64) - shift
+        ok = pos >= 0
+        return np.unique((slot[ok] << 32) | pos[ok])
+
+    def _phrase_clause(self, tids: List[Optional[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Chunks containing the words at consecutive positions; scored as the sum of the words' BM25."""
+        if any(t is None for t in tids):
+            return np.zeros(0, np.int32), np.zeros(0, np.float32)
+        parts = [self._postings(t) for t in tids]
+        cand = np.asarray(parts[0][0])
+        for docs, _, _ in parts[1:]:
+            cand = np.intersect1d(cand, docs, assume_unique=True)
+        if not len(cand):
+            return cand, np.zeros(0, np.float32)
+        idx = [s + np.searchsorted(docs, cand) for docs, _, s in parts]
+        # phrase start positions as (candidate << 32 | position - j) keys, intersected word by word
+        keys = None
+        for j, ix in enumerate(idx):
+            k = self._position_keys(ix, j)
+            keys = k if keys is None else np.intersect1d(keys, k, assume_unique=True)
+        keep = np.zeros(len(cand), dtype=bool)
+        keep[np.unique(keys >> 32)] = True
+        cand = cand[keep]
+        score = np.zeros(len(cand), dtype=np.float32)
+        for (docs, tf, s), ix in zip(parts, idx):
+            score += self._bm25(np.asarray(self.post_tf[ix[keep]]), len(docs), cand)
+        return cand, score
+
+    def parse(self, query: str) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """One (chunk ids, scores) pair per clause: "a phrase", prefix*, or a word."""
+        clauses = []
+        for m in _CLAUSE.finditer(query or ""):
+            if m.group(1) is not None:
+                toks = tokenize(m.group(1))
+                prefix = False
+            else:
+                word = m.group(2)
+                prefix = word.endswith("*")
+                toks = tokenize(word)
+            if not toks:
+                continue
+            if prefix and len(toks) == 1:
+                clauses.append(self._term_clause(self.prefix_ids(toks[0])))
+            elif len(toks) == 1:
+                tid = self.term_id(toks[0])
+                clauses.append(self._term_clause([] if tid is None else [tid]))
+            else:  # quoted phrase, or a word the tokenizer splits (e.g. "launch/landing")
+                clauses.append(self._phrase_clause([self.term_id(t) for t in toks]))
+        return clauses
+
+    def search(self, query: str, mode: str = "all", allowed: Optional[np.ndarray] = None,
+               limit: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (chunk ids, BM25 scores), best first. mode="all" requires every clause, "any" ranks the union.
+        `allowed` is an optional boolean row mask (facet filters); `limit` keeps only the top results.
+        """
+        clauses = self.parse(query)
+        if not clauses:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        if mode == "all":
+            docs = clauses[0][0]
+            for d, _ in clauses[1:]:
+                docs = np.intersect1d(docs, d, assume_unique=True)
+            scores = np.zeros(len(docs), dtype=np.float32)
+            for d, s in clauses:
+                scores += s[np.searchsorted(d, docs)]
+        else:
+            all_docs = np.concatenate([d for d, _ in clauses])
+            docs, inv = np.unique(all_docs, return_inverse=True)
+            scores = np.bincount(inv, weights=np.concatenate([s for _, s in clauses]), minlength=len(docs)).astype(np.float32)
+        docs = docs.astype(np.int64)
+        if allowed is not None:
+            keep = allowed[docs]
+            docs, scores = docs[keep], scores[keep]
+        if limit is not None and len(docs) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            docs, scores = docs[top], scores[top]
+        order = np.lexsort((docs, -scores))  # score desc, chunk id asc on ties
+        return docs[order], scores[order]
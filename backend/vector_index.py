@@ -0,0 +1,347 @@
+# vector_index.py
+"""
+FAISS index construction and query-time tuning, shared by ingest.py (build) and app.py (search).
+
+INDEX_TYPE=flat   exact inner-product scan (default)
+INDEX_TYPE=hnsw   IndexHNSWFlat; HNSW_M / HNSW_EF_CONSTRUCTION at build, HNSW_EF_SEARCH at query time
+INDEX_TYPE=ivf    IndexIVFFlat with k-means centroids; IVF_NLIST (0 = ~4*sqrt(N)) at build, IVF_NPROBE at query time
+
+INDEX_STORAGE=f32 | f16 | int8 | pq picks the codes any of the three types keeps per vector (4d, 2d, d or PQ_M bytes).
+A compressed index only makes the first pass: it returns RERANK_FACTOR * k candidates, which RerankIndex re-scores
+exactly against the full-precision vectors.f32 (memory-mapped, so only the candidate rows are paged in).
+
+Filtered search (search_filtered) restricts candidates inside the index with an IDSelectorBitmap, or scores
+the allowed rows exactly when there are at most FILTER_EXACT_MAX of them.
+"""
+import os, time, math, json
+from typing import Any, Dict, Optional
+import numpy as np
+
+try:
+    import faiss  # type: ignore
+except Exception:  # pragma: no cover
+    faiss = None
+
+INDEX_TYPE           = os.getenv("INDEX_TYPE", "flat").strip().lower()
+HNSW_M               = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH       = int(os.getenv("HNSW_EF_SEARCH", "128"))
+IVF_NLIST            = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE           = int(os.getenv("IVF_NPROBE", "16"))
+IVF_TRAIN_MAX        = int(os.getenv("IVF_TRAIN_MAX", "100000"))   # rows sampled for k-means
+FILTER_EXACT_MAX     = int(os.getenv("FILTER_EXACT_MAX", "8192"))  # allowed rows scored exactly below this
+FILTER_WIDEN_MAX     = int(os.getenv("FILTER_WIDEN_MAX", "4"))     # efSearch / nprobe doublings before exact
+INDEX_STORAGE        = os.getenv("INDEX_STORAGE", "f32").strip().lower()
+PQ_M                 = int(os.getenv("PQ_M", "0"))                 # PQ bytes per vector; 0 = ~dim/16
+RERANK_FACTOR        = int(os.getenv("RERANK_FACTOR", "4"))        # compressed indexes: candidates per result
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+INDEX_STORAGES = ("f32", "f16", "int8", "pq")
+_ADD_SLICE = 65536
+_PQ_MIN_ROWS = 39 * 256  # k-means training points faiss wants for 8-bit PQ codebooks
+
+def index_params(kind: str, rows: int, storage: str = INDEX_STORAGE) -> Dict[str, Any]:
+    if storage not in INDEX_STORAGES:
+        raise ValueError(f"Unknown INDEX_STORAGE {storage!r}; expected one of {INDEX_STORAGES}")
+    if storage == "pq" and rows < _PQ_MIN_ROWS:
+        storage = "int8"  # too few rows to train codebooks
+    if kind == "hnsw":
+        params = {"type": "hnsw", "M": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+    elif kind == "ivf":
+        nlist = IVF_NLIST or int(4 * math.sqrt(max(rows, 1)))
+        # faiss wants ~39+ training points per centroid
+        nlist = max(1, min(nlist, rows // 39 or 1))
+        params = {"type": "ivf", "nlist": nlist}
+    elif kind == "flat":
+        params = {"type": "flat"}
+    else:
+        raise ValueError(f"Unknown INDEX_TYPE {kind!r}; expected one of {INDEX_TYPES}")
+    if storage != "f32" and rows:
+        params["storage"] = storage
+        if storage == "pq":
+            params["pq_m"] = PQ_M
+    return params
+
+def pq_subquantizers(dim: int, m: int = 0) -> int:
+    """Largest divisor of dim up to m (0 = dim/16): faiss PQ needs dim % m == 0."""
+    target = max(1, min(dim, m or dim // 16))
+    return next(c for c in range(target, 0, -1) if dim % c == 0)
+
+def code_bytes(params: Dict[str, Any], dim: int) -> int:
+    """Bytes of vector codes per row (graph links / list ids come on top)."""
+    storage = params.get("storage", "f32")
+    if storage == "pq":
+        return pq_subquantizers(dim, params.get("pq_m", 0))
+    return dim * {"f32": 4, "f16": 2, "int8": 1}[storage]
+
+def build_index(vec: np.ndarray, params: Dict[str, Any]):
+    """Build an inner-product index over `vec` (rows x dim, may be a memmap), adding in slices."""
+    rows, dim = vec.shape
+    kind = params["type"]
+    storage = params.get("storage", "f32")
+    ip = faiss.METRIC_INNER_PRODUCT
+    qtype = {"f16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}.get(storage)
+    m = pq_subquantizers(dim, params.get("pq_m", 0)) if storage == "pq" else 0
+    if kind == "hnsw":
+        if storage == "pq":
+            index = faiss.IndexHNSWPQ(dim, m, params["M"], 8, ip)
+        elif qtype is not None:
+            index = faiss.IndexHNSWSQ(dim, qtype, params["M"], ip)
+        else:
+            index = faiss.IndexHNSWFlat(dim, params["M"], ip)
+        index.hnsw.efConstruction = params["ef_construction"]
+    elif kind == "ivf":
+        quantizer = faiss.IndexFlatIP(dim)
+        if storage == "pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, params["nlist"], m, 8, ip)
+        elif qtype is not None:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, params["nlist"], qtype, ip)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, params["nlist"], ip)
+    elif storage == "pq":
+        index = faiss.IndexPQ(dim, m, 8, ip)
+    elif qtype is not None:
+        index = faiss.IndexScalarQuantizer(dim, qtype, ip)
+    else:
+        index = faiss.IndexFlatIP(dim)
+    if not index.is_trained:  # IVF centroids, int8 ranges, PQ codebooks
+        sample = np.sort(np.random.default_rng(0).choice(rows, min(rows, IVF_TRAIN_MAX), replace=False))
+        index.train(np.ascontiguousarray(vec[sample]))
+    for s in range(0, rows, _ADD_SLICE):
+        index.add(np.ascontiguousarray(vec[s:s + _ADD_SLICE]))
+    return index
+
+class MmapFlatIndex:
+    """
+    Exact inner-product search straight over the mmap'd vectors.f32 (what IndexFlatIP would hold in RAM).
+    Exposes the part of the faiss.Index API the app uses: ntotal, d, search().
+    """
+    def __init__(self, path: str, rows: int, dim: int):
+        self.xb = np.memmap(path, dtype="float32", mode="r", shape=(rows, dim))
+        self.ntotal, self.d = rows, dim
+
+    def search(self, q: np.ndarray, k: int, params=None):
+        D, I = faiss.knn(np.ascontiguousarray(q, dtype="float32"), self.xb, min(k, self.ntotal),
+                         metric=faiss.METRIC_INNER_PRODUCT)
+        return D, I
+
+def rerank(xb: np.ndarray, q: np.ndarray, I: np.ndarray, k: int):
+    """Exact inner products of each query with its candidate rows I (-1 = none) of `xb`; best k per query."""
+    Q = np.ascontiguousarray(q, dtype="float32")
+    valid = I >= 0
+    u, inv = np.unique(np.where(valid, I, 0), return_inverse=True)
+    rows = np.asarray(xb[u])  # ascending ids: sequential reads from the mmap
+    D = np.einsum("qkd,qd->qk", rows[inv.reshape(I.shape)], Q)
+    D[~valid] = -np.inf
+    order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+    D, I = np.take_along_axis(D, order, 1), np.take_along_axis(I, order, 1)
+    return D.astype("float32"), np.where(np.isfinite(D), I, -1)
+
+class RerankIndex:
+    """
+    A compressed index (f16 / int8 / PQ codes) searched for factor * k candidates, re-scored exactly over the
+    full-precision rows `xb` (mmap'd vectors.f32). Same API as the wrapped index: ntotal, d, search().
+    """
+    def __init__(self, index, xb: np.ndarray, factor: int = RERANK_FACTOR):
+        self.index, self.xb, self.factor = index, xb, max(1, factor)
+        self.ntotal, self.d = index.ntotal, index.d
+
+    def search(self, q: np.ndarray, k: int, params=None):
+        _, I = self.index.search(q, min(self.ntotal, k * self.factor), params=params)
+        return rerank(self.xb, q, I, k)
+
+def write_index_info(path: str, info: Dict[str, Any]):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=1)
+    os.replace(tmp, path)
+
+def read_index_info(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def vectors_usable(vectors_path: str, info: Dict[str, Any]) -> bool:
+    """
+    True if vectors.f32 still holds the rows the index was built from: same file as at build time (versioned
+    builds record the inode of their hard link -- ingest only ever appends to it) or, for legacy builds, an
+    unchanged mtime.
+    """
+    vec = info.get("vectors") or {}
+    if not os.path.exists(vectors_path) or os.path.getsize(vectors_path) < info.get("rows", 0) * info.get("dim", 0) * 4:
+        return False
+    st = os.stat(vectors_path)
+    if "ino" in vec:
+        return st.st_ino == vec["ino"]
+    return st.st_mtime_ns == vec.get("mtime_ns")
+
+def load_index(faiss_path: str, vectors_path: str, info: Dict[str, Any], mode: str = "mmap"):
+    """
+    mode=mmap: a flat index is served straight from vectors.f32 when its first `rows` rows are unchanged
+    since the build (no copy in RAM, page cache shared between workers). Other types are read with
+    IO_FLAG_MMAP_IFC, which maps vectors, HNSW graph and IVF lists from index.faiss, so uvicorn workers share
+    them too; faiss builds without it fall back to IO_FLAG_MMAP (IVF lists only).
+    mode=ram: faiss.read_index as before.
+    Compressed storage (info["storage"]) comes back wrapped in a RerankIndex over vectors.f32 when that file
+    still holds the indexed rows; otherwise the compressed scores are served as they are.
+    """
+    storage = info.get("storage", "f32")
+    usable = bool(info.get("rows")) and vectors_usable(vectors_path, info)
+    index = None
+    if mode == "mmap":
+        if info.get("type") == "flat" and storage == "f32" and usable:
+            return MmapFlatIndex(vectors_path, info["rows"], info["dim"])
+        for flags in (getattr(faiss, "IO_FLAG_MMAP_IFC", None), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY):
+            if flags is None:
+                continue
+            try:
+                index = faiss.read_index(faiss_path, flags)
+                break
+            except Exception:
+                pass
+    if index is None:
+        index = faiss.read_index(faiss_path)
+    if storage != "f32":
+        if usable:
+            xb = np.memmap(vectors_path, dtype="float32", mode="r", shape=(index.ntotal, index.d))
+            return RerankIndex(index, xb)
+        print(f"[index] {faiss_path}: no usable vectors.f32, serving {storage} scores without re-ranking")
+    return index
+
+def index_type(index) -> str:
+    if isinstance(index, RerankIndex):
+        return index_type(index.index)
+    if isinstance(index, MmapFlatIndex):
+        return "flat"
+    idx = faiss.downcast_index(index)
+    if isinstance(idx, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(idx, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+def search_params(index, ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+    """Per-query SearchParameters for ANN indexes (None for flat)."""
+    kind = index_type(index)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search or HNSW_EF_SEARCH)
+    if kind == "ivf":
+        return faiss.SearchParametersIVF(nprobe=nprobe or IVF_NPROBE)
+    return None
+
+def exact_subset(xb: np.ndarray, q: np.ndarray, k: int, ids: np.ndarray):
+    """Exact inner-product top-k of the queries `q` (nq x d) over the rows `ids` of `xb`, gathered in slices."""
+    Q = np.ascontiguousarray(q, dtype="float32").reshape(-1, xb.shape[1])
+    best_s = np.empty((len(Q), 0), dtype="float32")
+    best_i = np.empty((len(Q), 0), dtype="int64")
+    for s in range(0, len(ids), _ADD_SLICE):
+        sl = ids[s:s + _ADD_SLICE]
+        scores = np.concatenate([best_s, Q @ np.asarray(xb[sl]).T], axis=1)
+        cand = np.concatenate([best_i, np.broadcast_to(sl.astype("int64"), (len(Q), len(sl)))], axis=1)
+        if scores.shape[1] > k:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores, cand = np.take_along_axis(scores, top, axis=1), np.take_along_axis(cand, top, axis=1)
+        best_s, best_i = scores, cand
+    order = np.argsort(-best_s, axis=1, kind="stable")
+    return np.take_along_axis(best_s, order, axis=1), np.take_along_axis(best_i, order, axis=1)
+
+def search_filtered(index, q: np.ndarray, k: int, allowed: Optional[np.ndarray], xb: Optional[np.ndarray] = None,
+                    ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+    """
+    Top-k among rows where the boolean mask `allowed` is set (None = no filter). Small candidate sets (or a
+    flat index) are scored exactly over `xb`; otherwise the mask goes into the index as an IDSelectorBitmap
+    and efSearch / nprobe are doubled until k allowed hits come back, falling back to exact scoring.
+    `q` may hold several queries sharing the filter. Returns (D, I) shaped like index.search; fewer than
+    k columns only when fewer rows are allowed.
+    """
+    if allowed is None:
+        return index.search(q, k, params=search_params(index, ef_search, nprobe))
+    ids = np.flatnonzero(allowed)
+    k = min(k, len(ids))
+    if k == 0:
+        return np.empty((len(q), 0), dtype="float32"), np.empty((len(q), 0), dtype="int64")
+    if isinstance(index, (MmapFlatIndex, RerankIndex)):
+        xb = index.xb
+    kind = index_type(index)
+    if xb is not None and (len(ids) <= FILTER_EXACT_MAX or kind == "flat"):
+        return exact_subset(xb, q, k, ids)
+
+    bitmap = np.packbits(allowed, bitorder="little")
+    sel = faiss.IDSelectorBitmap(bitmap)
+    ef = max(ef_search or HNSW_EF_SEARCH, k)
+    probe = nprobe or IVF_NPROBE
+    for _ in range(FILTER_WIDEN_MAX + 1):
+        if kind == "hnsw":
+            params = faiss.SearchParametersHNSW(sel=sel, efSearch=ef)
+        elif kind == "ivf":
+            params = faiss.SearchParametersIVF(sel=sel, nprobe=probe)
+        else:
+            params = faiss.SearchParameters(sel=sel)
+        D, I = index.search(q, k, params=params)
+        if ((I >= 0).sum(axis=1) >= k).all() or kind == "flat":
+            return D, I
+        ef, probe = ef * 2, probe * 2
+    if xb is not None:
+        return exact_subset(xb, q, k, ids)
+    return D, I
+
+def _timed_search(index, queries: np.ndarray, k: int, params):
+    """One query at a time, like the API does; returns (ids, per-query latencies in ms)."""
+    ids = np.empty((len(queries), k), dtype="int64")
+    lat = np.empty(len(queries))
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        _, I = index.search(queries[i:i + 1], k, params=params)
+        lat[i] = (time.perf_counter() - t0) * 1000
+        ids[i] = I[0]
+    return ids, lat
+
+def synthetic_queries(vec: np.ndarray, n: int, seed: int = 0) -> np.ndarray:
+    """
+    Queries that are not stored rows: midpoints of independently drawn pairs of distinct stored vectors,
+    re-normalised. The pairs are not sorted by row, so the two ends are usually unrelated chunks rather than
+    neighbours in the same document, and neither end is a near-exact match for the query.
+    """
+    rng = np.random.default_rng(seed)
+    rows = vec.shape[0]
+    a = rng.integers(0, rows, n)
+    b = (a + rng.integers(1, rows, n)) % rows if rows > 1 else a
+    q = (np.asarray(vec[a]) + np.asarray(vec[b])).astype("float32")
+    faiss.normalize_L2(q)
+    return q
+
+def exact_topk(vec: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Ground-truth ids by streaming inner products over `vec` in slices (bounded memory)."""
+    best_s = np.full((len(queries), k), -np.inf, dtype="float32")
+    best_i = np.full((len(queries), k), -1, dtype="int64")
+    for s in range(0, vec.shape[0], _ADD_SLICE):
+        block = np.ascontiguousarray(vec[s:s + _ADD_SLICE])
+        scores = np.concatenate([best_s, queries @ block.T], axis=1)
+        ids = np.concatenate([best_i, np.broadcast_to(np.arange(s, s + len(block)), (len(queries), len(block)))], axis=1)
+        top = np.argpartition(-scores, min(k, scores.shape[1] - 1), axis=1)[:, :k]
+        best_s = np.take_along_axis(scores, top, axis=1)
+        best_i = np.take_along_axis(ids, top, axis=1)
+    return best_i
+
+def recall_report(index, vec: np.ndarray, queries: np.ndarray, k: int = 10,
+                  ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                  truth: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    recall@k of `index` against exact search over the same vectors (or against precomputed `truth` ids, e.g.
+    full-width results for a reduced-dimension index), plus p50/p99 single-query latency.
+    """
+    truth = exact_topk(vec, queries, k) if truth is None else truth
+    params = search_params(index, ef_search, nprobe)
+    got, lat = _timed_search(index, queries, k, params)
+    hits = sum(len(set(g[g >= 0]) & set(t[t >= 0])) for g, t in zip(got, truth))
+    return {
+        "type": index_type(index),
+        "rows": int(index.ntotal),
+        "k": k,
+        "queries": int(len(queries)),
+        "search_params": {"efSearch": params.efSearch} if isinstance(params, faiss.SearchParametersHNSW)
+                         else {"nprobe": params.nprobe} if params is not None else {},
+        "recall_at_k": round(hits / max(1, int((truth >= 0).sum())), 4),
+        "latency_ms": {"p50": round(float(np.percentile(lat, 50)), 3),
+                       "p99": round(float(np.percentile(lat, 99)), 3)},
+    }